@@ -35,6 +35,7 @@ if __name__ == "__main__":
         'pytest',
         'pytest-mock',
         'pyyaml',
+        'pyarrow',
     ]
 
     setup(
@@ -60,6 +61,7 @@ if __name__ == "__main__":
         entry_points='''
             [console_scripts]
             pbuild_artifacts=vivarium_conic_sam_comparison.tools.cli:pbuild_artifacts
+            slice_artifacts=vivarium_conic_sam_comparison.tools.cli:slice_artifacts
             generate_spec_from_template=vivarium_conic_sam_comparison.tools.cli:generate_spec_from_template
         '''
     )
@@ -4,6 +4,8 @@ import scipy.stats
 
 from vivarium_public_health.utilities import TargetString
 
+from .side_table import SimulantSideTable
+
 
 class InterventionEffect:
     """An additive shift effect with optional population- and individual-level
@@ -62,9 +64,8 @@ class InterventionEffect:
         self.population_sd = config['population']['sd']
         self.individual_sd = config['individual']['sd']
 
-        self.clock = builder.time.clock()
-
-        self._effect_size = pd.Series()
+        self._effect_size = SimulantSideTable({'effect_size': float})
+        self._effect_size.register_compaction(builder)
 
         self.randomness = builder.randomness.get_stream(self.name)
 
@@ -73,7 +74,8 @@ class InterventionEffect:
         required_columns = [f'{self.intervention_name}_treatment_start']
         builder.population.initializes_simulants(self.on_initialize_simulants,
                                                  requires_columns=required_columns)
-        self.pop_view = builder.population.get_view(required_columns)
+        # The treatment algorithm owns the phase cache shared by all of the intervention's effects.
+        self.treatment_algorithm = builder.components.get_component(f'{self.intervention_name}_treatment_algorithm')
 
         self.population_effect = self.get_population_effect_size(self.population_mean,
                                                                  self.population_sd,
@@ -83,7 +85,7 @@ class InterventionEffect:
         individual_effect = self.get_individual_effect_size(pop_data.index, self.population_effect,
                                                             self.individual_sd,
                                                             'individual_effect')
-        self._effect_size = self._effect_size.append(individual_effect)
+        self._effect_size.update(individual_effect)
 
     def get_population_effect_size(self, mean, sd, key):
         if sd == 0:
@@ -103,52 +105,44 @@ class InterventionEffect:
         return pd.Series(effect_size, index=index)
 
     def adjust_exposure(self, index, exposure):
-        effect_size = pd.Series(0, index=index)
-        untreated, ramp_up, full_effect, ramp_down, post_effect = self.get_treatment_groups(index)
+        pop_index, time_since_start = self.treatment_algorithm.phase_cache.get_time_since_start(index)
+        if pop_index.empty:
+            return exposure
 
-        effect_size.loc[untreated] = 0
-        effect_size.loc[ramp_up] = self.ramp_efficacy(ramp_up)
-        effect_size.loc[full_effect] = self._effect_size.loc[full_effect]
-        if not self.permanent:
-            effect_size.loc[ramp_down] = self.ramp_efficacy(ramp_down, invert=True)
-            effect_size.loc[post_effect] = 0
+        ramp_up_end = self.ramp_up_duration.value
+        ramp_up = (0 <= time_since_start) & (time_since_start < ramp_up_end)
+        if self.permanent:
+            full_effect = ramp_up_end <= time_since_start
+            ramp_down = np.zeros(len(pop_index), dtype=bool)
+        else:
+            full_effect_end = ramp_up_end + self.full_effect_duration.value
+            ramp_down_end = full_effect_end + self.ramp_down_duration.value
+            full_effect = (ramp_up_end <= time_since_start) & (time_since_start < full_effect_end)
+            ramp_down = (full_effect_end <= time_since_start) & (time_since_start < ramp_down_end)
+
+        individual_effect = self._effect_size.get(pop_index).values
+        # Positions off the ramp are zeroed so the logistic never overflows.
+        ramp_up_position = time_since_start - (self.ramp_up_duration / 2).value
+        ramp_up_scale = self.ramp_efficacy(np.where(ramp_up, ramp_up_position, 0), self.ramp_up_duration)
+        if self.permanent:
+            ramp_down_scale = 0.
+        else:
+            ramp_down_position = full_effect_end + (self.ramp_down_duration / 2).value - time_since_start
+            ramp_down_scale = self.ramp_efficacy(np.where(ramp_down, ramp_down_position, 0),
+                                                 self.ramp_down_duration)
+        effect_size = np.select([ramp_up, full_effect, ramp_down],
+                                [ramp_up_scale * individual_effect, individual_effect,
+                                 ramp_down_scale * individual_effect],
+                                default=0.)
 
         # FIXME: Hack for lbwsg weirdness for now
         if self.target.name == 'low_birth_weight_and_short_gestation':
-            exposure['birth_weight'] += effect_size
+            exposure.loc[pop_index, 'birth_weight'] += effect_size
         else:
-            exposure += effect_size
+            exposure.loc[pop_index] += effect_size
         return exposure
 
-    def get_treatment_groups(self, index):
-        pop = self.pop_view.get(index)
-
-        # effect pattern transition boundaries
-        begin_ramp_up = pop[f'{self.intervention_name}_treatment_start']
-        begin_full_effect = pop[f'{self.intervention_name}_treatment_start'] + self.ramp_up_duration
-
-        untreated = pop.loc[(pop[f'{self.intervention_name}_treatment_start'].isnull()) |
-                            (self.clock() < begin_ramp_up)].index
-
-        ramp_up = pop.loc[(begin_ramp_up <= self.clock()) & (self.clock() < begin_full_effect)].index
-        if self.permanent:
-            full_effect = pop.loc[begin_full_effect <= self.clock()].index
-            ramp_down = pd.Index([])
-            post_effect = pd.Index([])
-        else:
-            begin_ramp_down = (pop[f'{self.intervention_name}_treatment_start'] + self.ramp_up_duration
-                                                                                + self.full_effect_duration)
-            end_ramp_down = (pop[f'{self.intervention_name}_treatment_start'] + self.ramp_up_duration
-                                                                              + self.full_effect_duration
-                                                                              + self.ramp_down_duration)
-
-            full_effect = pop.loc[(begin_full_effect <= self.clock()) & (self.clock() < begin_ramp_down)].index
-            ramp_down = pop.loc[(begin_ramp_down <= self.clock()) & (self.clock() < end_ramp_down)].index
-            post_effect = pop.loc[end_ramp_down <= self.clock()].index
-
-        return untreated, ramp_up, full_effect, ramp_down, post_effect
-
-    def ramp_efficacy(self, index, invert=False):
+    def ramp_efficacy(self, ramp_position, ramp_duration):
         """Logistic growth/decline of effect size.
 
         We're using a logistic function here to give a smooth treatment ramp.
@@ -173,27 +167,19 @@ class InterventionEffect:
         maximum effect size, p, so that the jump between the different
         sections of the function is equal to (1 / p) * L.
 
+        ``ramp_position`` is the signed distance in nanoseconds from the center
+        of the ramp, positive towards full effect. Returns the proportion of
+        the full effect at each position.
+
         """
-        if index.empty:
-            return pd.Series()
+        if ramp_duration.days == 0:
+            # Nobody is on a zero length ramp and it has no growth rate.
+            return np.zeros(len(ramp_position))
 
-        pop = self.pop_view.get(index)
         # 1/p is the proportion of the maximum effect.
         # Size of the discontinuity between constant and logistic functions.
         p = 10_000
 
-        if invert:
-            growth_rate = 2 / self.ramp_down_duration.days * np.log(p)
-            ramp_position = ((pop[f'{self.intervention_name}_treatment_start']
-                               + self.ramp_up_duration
-                               + self.full_effect_duration
-                               + (self.ramp_down_duration) / 2) - self.clock()) / pd.Timedelta(days=1)
-        else:
-            growth_rate = 2 / self.ramp_up_duration.days * np.log(p)
-            ramp_position = (self.clock()
-                             - (pop[f'{self.intervention_name}_treatment_start']
-                                 + (self.ramp_up_duration) / 2)) / pd.Timedelta(days=1)
-
-        scale = 1 / (1 + np.exp(-growth_rate * ramp_position))
-        return scale * self._effect_size[index]
-
+        growth_rate = 2 / ramp_duration.days * np.log(p)
+        ramp_position = ramp_position / pd.Timedelta(days=1).value
+        return 1 / (1 + np.exp(-growth_rate * ramp_position))
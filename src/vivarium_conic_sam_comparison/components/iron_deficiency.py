@@ -1,7 +1,12 @@
+import numpy as np
 import pandas as pd
 
 from vivarium_public_health.risks import Risk
 
+from .side_table import SimulantSideTable
+
+ANEMIA_CATEGORIES = ['unexposed', 'mild', 'moderate', 'severe']
+
 
 class IronDeficiencyAnemia(Risk):
 
@@ -41,44 +46,66 @@ class IronDeficiencyAnemia(Risk):
         self.data = {}
         self.observer_config = builder.configuration['metrics']['anemia_observer']
         self.clock = builder.time.clock()
+
+        # Anemia category and disability weight of each simulant read so far this time step phase.
+        self._anemia = self._new_anemia_table()
+        self._anemia_time = None
+        for event_name in ['time_step__prepare', 'time_step', 'time_step__cleanup', 'collect_metrics']:
+            builder.event.register_listener(event_name, self.on_event, priority=0)
         builder.value.register_value_modifier('metrics', self.metrics)
         builder.event.register_listener('collect_metrics', self.on_collect_metrics)
 
+    def on_event(self, event):
+        self._anemia = self._new_anemia_table()
+
     def compute_disability_weight(self, index):
-        disability_weight = pd.Series(0, index=index)
+        return self.get_anemia(index).disability_weight
 
-        disability_weight_data = self._disability_weight_data(index)
-        mild, moderate, severe = self.split_for_anemia(index)
+    def get_anemia(self, index) -> pd.DataFrame:
+        """Anemia category codes into ``ANEMIA_CATEGORIES`` and disability
+        weights, computed at most once per simulant per time step phase."""
+        if self.clock() != self._anemia_time:
+            self._anemia = self._new_anemia_table()
+            self._anemia_time = self.clock()
 
-        disability_weight.loc[mild] = disability_weight_data.loc[mild, 'mild']
-        disability_weight.loc[moderate] = disability_weight_data.loc[moderate, 'moderate']
-        disability_weight.loc[severe] = disability_weight_data.loc[severe, 'severe']
+        missing = index[~self._anemia.contains(index)]
+        if not missing.empty:
+            self._anemia.update(self.compute_anemia(missing))
+        return self._anemia.get(index)
 
-        return disability_weight * (self.pop_view.get(index).alive == 'alive')
+    def compute_anemia(self, index) -> pd.DataFrame:
+        category = self.split_for_anemia(index)
 
-    def split_for_anemia(self, index):
+        disability_weight_data = self._disability_weight_data(index)
+        weights = np.column_stack([np.zeros(len(index)),
+                                   disability_weight_data['mild'].values,
+                                   disability_weight_data['moderate'].values,
+                                   disability_weight_data['severe'].values])
+        disability_weight = pd.Series(weights[np.arange(len(index)), category], index=index)
+        # Untracked simulants have no alive status and get a NaN weight.
+        disability_weight = disability_weight * (self.pop_view.get(index).alive == 'alive')
+
+        return pd.DataFrame({'anemia_category': category,
+                             'disability_weight': disability_weight.reindex(index).values}, index=index)
+
+    def split_for_anemia(self, index) -> np.ndarray:
+        """Codes into ``ANEMIA_CATEGORIES`` for each simulant in ``index``."""
         anemia = self.anemia_thresholds(index)
-        hemoglobin = self.exposure(index)
-
-        mild = (anemia.moderate_threshold <= hemoglobin) & (hemoglobin < anemia.mild_threshold)
-        moderate = (anemia.severe_threshold <= hemoglobin) & (hemoglobin < anemia.moderate_threshold)
-        severe = hemoglobin < anemia.severe_threshold
+        hemoglobin = self.exposure(index).values
 
-        return mild, moderate, severe
+        # Thresholds increase from severe to mild, so the number a simulant is
+        # below counts up through the categories.
+        return ((hemoglobin < anemia.mild_threshold.values).astype(np.int64)
+                + (hemoglobin < anemia.moderate_threshold.values)
+                + (hemoglobin < anemia.severe_threshold.values))
 
     def on_collect_metrics(self, event):
         """Records counts of risk exposed by category."""
-        pop = self.pop_view.get(event.index, query='alive == "alive"')
-
         if self.should_sample(event.time):
+            pop = self.pop_view.get(event.index, query='alive == "alive"')
             sample = self.generate_sampling_frame()
-            mild, moderate, severe = self.split_for_anemia(pop.index)
-            sample.loc['0_to_5', 'mild'] = len(pop.loc[mild])
-            sample.loc['0_to_5', 'moderate'] = len(pop.loc[moderate])
-            sample.loc['0_to_5', 'severe'] = len(pop.loc[severe])
-            sample.loc['0_to_5', 'unexposed'] = len(pop) - (len(pop.loc[mild])
-                                                            + len(pop.loc[moderate])
-                                                            + len(pop.loc[severe]))
+            category = self.get_anemia(pop.index).anemia_category.values
+            sample.loc['0_to_5', ANEMIA_CATEGORIES] = np.bincount(category, minlength=len(ANEMIA_CATEGORIES))
 
             self.data[self.clock().year] = sample
 
@@ -101,6 +128,10 @@ class IronDeficiencyAnemia(Risk):
                 metrics[label] = sample.loc['0_to_5', category]
         return metrics
 
+    @staticmethod
+    def _new_anemia_table():
+        return SimulantSideTable({'anemia_category': np.int64, 'disability_weight': float})
+
     def __repr__(self):
         return f"CategoricalRiskObserver({self.risk})"
 
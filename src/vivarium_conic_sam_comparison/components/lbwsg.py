@@ -1,5 +1,9 @@
-from typing import Tuple
+from contextlib import contextmanager
+import logging
+import time
+from typing import Dict, Tuple
 
+import numpy as np
 import pandas as pd
 from vivarium_public_health.utilities import EntityString, TargetString
 import vivarium_public_health.risks.data_transformations as data_transformations
@@ -9,10 +13,15 @@ from vivarium_public_health.risks.data_transformations import get_distribution_t
 from vivarium_public_health.risks.data_transformations import pivot_categorical
 from vivarium_public_health.risks import RiskEffect
 from . import split_index_draw as sid
+from .. import external_data
+from .effect import InterventionEffect
+from .side_table import SimulantSideTable
 from vivarium.framework.randomness import RandomnessStream
 
 from pdb import set_trace
 
+_log = logging.getLogger(__name__)
+
 MISSING_CATEGORY = 'cat212'
 
 
@@ -21,7 +30,11 @@ class LBWSGRisk:
     configuration_defaults = {
         'low_birth_weight_and_short_gestation': {
             'exposure': 'data',
-            'rebinned_exposed': []
+            'rebinned_exposed': [],
+            # Freeze each simulant's category when their exposure is first used so
+            # the risk effects can gather relative risks rather than re-run the
+            # exposure pipeline. Ignored if the exposure changes after that.
+            'freeze_categories': False,
         }
     }
 
@@ -34,14 +47,21 @@ class LBWSGRisk:
 
     def setup(self, builder):
         self.exposure_distribution = LBWSGDistribution(builder)
-        self._raw_bw_and_gt = pd.DataFrame(columns=['birth_weight', 'gestation_time'])
+        self._raw_bw_and_gt = SimulantSideTable({'birth_weight': float, 'gestation_time': float})
+        self._raw_bw_and_gt.register_compaction(builder)
 
         self._raw_exposure = builder.value.register_value_producer(
             f'{self.risk.name}.raw_exposure',
-            source=lambda index: self._raw_bw_and_gt.loc[index]
+            source=self._raw_bw_and_gt.get
         )
 
-        self._cached_exposure = pd.DataFrame(columns=['birth_weight', 'gestation_time'])
+        self._cached_exposure = SimulantSideTable({'birth_weight': float, 'gestation_time': float})
+        self._cached_exposure.register_compaction(builder)
+
+        self.freeze_categories = (builder.configuration[self.risk.name].freeze_categories
+                                  and not exposure_changes_over_time(builder, self.risk))
+        self._category_codes = SimulantSideTable({'category_code': np.int64})
+        self._category_codes.register_compaction(builder)
 
         self.exposure = builder.value.register_value_producer(
             f'{self.risk.name}.exposure',
@@ -52,15 +72,26 @@ class LBWSGRisk:
         builder.population.initializes_simulants(self.on_initialize_simulants)
 
     def get_current_exposure(self, index):
-        new_index = index.difference(self._cached_exposure.index)
+        new_index = index[~self._cached_exposure.contains(index)]
+        if not new_index.empty:
+            self._cached_exposure.update(self._raw_exposure(new_index))
+        return self._cached_exposure.get(index)
+
+    def get_category_codes(self, index):
+        """Positions in ``categories`` of the simulants' frozen exposure categories."""
+        new_index = index[~self._category_codes.contains(index)]
         if not new_index.empty:
-            self._cached_exposure = self._cached_exposure.append(self._raw_exposure(new_index))
-        return self._cached_exposure.loc[index]
+            # From the cached exposure, so every simulant has a row and the codes stay integers.
+            category_codes = self.exposure_distribution.get_category_codes(self.get_current_exposure(new_index))
+            self._category_codes.update(pd.Series(category_codes, index=new_index))
+        return self._category_codes.get(index).values
+
+    @property
+    def categories(self) -> pd.Index:
+        return self.exposure_distribution.category_grid.categories
 
     def on_initialize_simulants(self, pop_data):
-        self._raw_bw_and_gt = self._raw_bw_and_gt.append(
-            self.exposure_distribution.get_birth_weight_and_gestational_age(pop_data.index)
-        )
+        self._raw_bw_and_gt.update(self.exposure_distribution.get_birth_weight_and_gestational_age(pop_data.index))
 
 
 class LBWSGDistribution:
@@ -71,84 +102,132 @@ class LBWSGDistribution:
 
         self.categories_by_interval = get_categories_by_interval(builder, self.risk)
         self.intervals_by_category = self.categories_by_interval.reset_index().set_index('cat')
-        self.max_gt_by_bw, self.max_bw_by_gt = self._get_boundary_mappings()
+        self.category_edges = get_category_edges(self.intervals_by_category)
+        self.category_grid = LBWSGCategoryGrid(self.categories_by_interval)
 
-        self.exposure_parameters = builder.lookup.build_table(get_exposure_data(builder, self.risk))
+        exposure_groups, category_cdf = get_category_cdf(get_exposure_data(builder, self.risk),
+                                                         self.categories_by_interval.values)
+        self.category_cdf = flatten_category_cdf(category_cdf)
+        self.exposure_group = builder.lookup.build_table(exposure_groups)
 
     def get_birth_weight_and_gestational_age(self, index):
         category_draw = self.randomness.get_draw(index, additional_key='category')
-        exposure = self.exposure_parameters(index)[self.categories_by_interval.values]
-        exposure_sum = exposure.cumsum(axis='columns')
-        category_index = (exposure_sum.T < category_draw).T.sum('columns')
-        categorical_exposure = pd.Series(self.categories_by_interval.values[category_index],
-                                         index=index, name='cat')
-
-        return self._convert_to_continuous(categorical_exposure)
+        exposure_group = self.exposure_group(index).values.astype(int)
+        category_codes = sample_categories(self.category_cdf, exposure_group, category_draw.values,
+                                           len(self.categories_by_interval))
+        return self._convert_to_continuous(index, category_codes)
 
     def convert_to_categorical(self, exposure, _):
-        exposure = self._convert_boundary_cases(exposure)
-        categorical_exposure = self.categories_by_interval.iloc[self._get_categorical_index(exposure)]
-        categorical_exposure.index = exposure.index
-        return categorical_exposure
+        categorical_exposure = pd.Categorical.from_codes(self.get_category_codes(exposure),
+                                                         self.category_grid.categories)
+        return pd.Series(categorical_exposure, index=exposure.index, name='cat')
+
+    def get_category_codes(self, exposure):
+        gestation_time, birth_weight = self._convert_boundary_cases(exposure)
+        category_codes = self.category_grid.get_category_codes(gestation_time, birth_weight)
+        # Exposure still off the grid falls back to the last category, as the
+        # positional lookup on the interval index always did.
+        category_codes[category_codes == -1] = len(self.category_grid.categories) - 1
+        return category_codes
 
     def _convert_boundary_cases(self, exposure):
         eps = 1e-4
-        outside_bounds = self._get_categorical_index(exposure) == -1
+        birth_weight = exposure.birth_weight.values.astype(float)
+        gestation_time = exposure.gestation_time.values.astype(float)
+
+        outside_bounds = self.category_grid.get_category_codes(gestation_time, birth_weight) == -1
         shift_down = outside_bounds & (
-                (exposure.birth_weight < 1000)
-                | ((1000 < exposure.birth_weight) & (exposure.birth_weight < 4500) & (40 < exposure.gestation_time))
+                (birth_weight < 1000)
+                | ((1000 < birth_weight) & (birth_weight < 4500) & (40 < gestation_time))
         )
         shift_left = outside_bounds & (
-                (1000 < exposure.birth_weight) & (exposure.gestation_time < 34)
-                | (4500 < exposure.birth_weight) & (exposure.gestation_time < 42)
+                (1000 < birth_weight) & (gestation_time < 34)
+                | (4500 < birth_weight) & (gestation_time < 42)
         )
         tmrel = outside_bounds & (
-                (4500 < exposure.birth_weight) & (42 < exposure.gestation_time)
+                (4500 < birth_weight) & (42 < gestation_time)
         )
 
-        exposure.loc[shift_down, 'gestation_time'] = (self.max_gt_by_bw
-                                                      .loc[exposure.loc[shift_down, 'birth_weight']]
-                                                      .values) - eps
-        exposure.loc[shift_left, 'birth_weight'] = (self.max_bw_by_gt
-                                                    .loc[exposure.loc[shift_left, 'gestation_time']]
-                                                    .values) - eps
-        exposure.loc[tmrel, 'gestation_time'] = 42 - eps
-        exposure.loc[tmrel, 'birth_weight'] = 4500 - eps
-        return exposure
-
-    def _get_categorical_index(self, exposure):
-        exposure_bw_gt_index = exposure.set_index(['gestation_time', 'birth_weight']).index
-        return self.categories_by_interval.index.get_indexer(exposure_bw_gt_index, method=None)
-
-    def _convert_to_continuous(self, categorical_exposure):
-        draws = {'birth_weight': self.randomness.get_draw(categorical_exposure.index, additional_key='birth_weight'),
-                 'gestation_time': self.randomness.get_draw(categorical_exposure.index, additional_key='gestation_time')}
-
-        def single_values_from_category(row):
-            idx = row['index']
-            bw_draw = draws['birth_weight'][idx]
-            gt_draw = draws['gestation_time'][idx]
+        gestation_time[shift_down] = self.category_grid.get_max_gestation_time(birth_weight[shift_down]) - eps
+        birth_weight[shift_left] = self.category_grid.get_max_birth_weight(gestation_time[shift_left]) - eps
+        gestation_time[tmrel] = 42 - eps
+        birth_weight[tmrel] = 4500 - eps
+        return gestation_time, birth_weight
 
-            intervals = self.intervals_by_category.loc[row['cat']]
+    def _convert_to_continuous(self, index, category_codes):
+        bw_draw = self.randomness.get_draw(index, additional_key='birth_weight')
+        gt_draw = self.randomness.get_draw(index, additional_key='gestation_time')
+        return sample_from_category_edges(self.category_edges, category_codes, bw_draw, gt_draw)
 
-            birth_weight = (intervals.birth_weight.left
-                            + bw_draw * (intervals.birth_weight.right - intervals.birth_weight.left))
-            gestational_age = (intervals.gestation_time.left
-                               + gt_draw * (intervals.gestation_time.right - intervals.gestation_time.left))
 
-            return birth_weight, gestational_age
+class LBWSGCategoryGrid:
+    """The LBWSG categories laid out on a gestation time by birth weight grid.
 
-        values = categorical_exposure.reset_index().apply(single_values_from_category, axis=1)
-        return pd.DataFrame(list(values), index=categorical_exposure.index,
-                            columns=['birth_weight', 'gestation_time'])
+    Every interval edge of every category goes into a sorted edge array per
+    axis, and each cell of the grid holds the position of the category that
+    covers it, or -1 where no category does. Exposure is then classified
+    with ``searchsorted`` and fancy indexing rather than interval lookups.
+    """
 
-    def _get_boundary_mappings(self):
-        cats = self.categories_by_interval.reset_index()
-        max_gt_by_bw = pd.Series({bw_interval: pd.Index(group.gestation_time).right.max()
-                                  for bw_interval, group in cats.groupby('birth_weight')})
-        max_bw_by_gt = pd.Series({gt_interval: pd.Index(group.birth_weight).right.max()
-                                  for gt_interval, group in cats.groupby('gestation_time')})
-        return max_gt_by_bw, max_bw_by_gt
+    def __init__(self, categories_by_interval: pd.Series):
+        self.categories = pd.Index(categories_by_interval.values)
+        gestation_time = pd.Index(categories_by_interval.index.get_level_values('gestation_time'))
+        birth_weight = pd.Index(categories_by_interval.index.get_level_values('birth_weight'))
+
+        self.gt_edges = np.unique(np.concatenate([gestation_time.left, gestation_time.right])).astype(float)
+        self.bw_edges = np.unique(np.concatenate([birth_weight.left, birth_weight.right])).astype(float)
+        gt_start, gt_end = (np.searchsorted(self.gt_edges, gestation_time.left),
+                            np.searchsorted(self.gt_edges, gestation_time.right))
+        bw_start, bw_end = (np.searchsorted(self.bw_edges, birth_weight.left),
+                            np.searchsorted(self.bw_edges, birth_weight.right))
+
+        self.category_codes = np.full((len(self.gt_edges) - 1, len(self.bw_edges) - 1), -1, dtype=int)
+        # Upper gestation time edge of the categories in each birth weight column and vice versa.
+        self.max_gt_by_bw = np.full(len(self.bw_edges) - 1, np.nan)
+        self.max_bw_by_gt = np.full(len(self.gt_edges) - 1, np.nan)
+        for code in range(len(self.categories)):
+            gt_cells = slice(gt_start[code], gt_end[code])
+            bw_cells = slice(bw_start[code], bw_end[code])
+            self.category_codes[gt_cells, bw_cells] = code
+            self.max_gt_by_bw[bw_cells] = np.fmax(self.max_gt_by_bw[bw_cells], gestation_time.right[code])
+            self.max_bw_by_gt[gt_cells] = np.fmax(self.max_bw_by_gt[gt_cells], birth_weight.right[code])
+
+    def get_category_codes(self, gestation_time: np.ndarray, birth_weight: np.ndarray) -> np.ndarray:
+        """Positions in ``categories`` of the exposure, -1 for exposure off the grid."""
+        gt_cell, gt_on_grid = get_cells(self.gt_edges, gestation_time)
+        bw_cell, bw_on_grid = get_cells(self.bw_edges, birth_weight)
+        on_grid = gt_on_grid & bw_on_grid
+        category_codes = np.full(len(on_grid), -1, dtype=int)
+        category_codes[on_grid] = self.category_codes[gt_cell[on_grid], bw_cell[on_grid]]
+        return category_codes
+
+    def get_max_gestation_time(self, birth_weight: np.ndarray) -> np.ndarray:
+        bw_cell, on_grid = get_cells(self.bw_edges, birth_weight)
+        return np.where(on_grid, self.max_gt_by_bw[np.where(on_grid, bw_cell, 0)], np.nan)
+
+    def get_max_birth_weight(self, gestation_time: np.ndarray) -> np.ndarray:
+        gt_cell, on_grid = get_cells(self.gt_edges, gestation_time)
+        return np.where(on_grid, self.max_bw_by_gt[np.where(on_grid, gt_cell, 0)], np.nan)
+
+
+def get_cells(edges: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the left-closed cell between sorted ``edges`` holding each value
+    and whether that cell is inside the edges at all."""
+    cells = np.searchsorted(edges, values, side='right') - 1
+    return cells, (0 <= cells) & (cells < len(edges) - 1)
+
+
+def exposure_changes_over_time(builder, risk: EntityString) -> bool:
+    """Whether any intervention effect modifies the LBWSG exposure pipeline
+    itself, or the raw exposure for a limited time."""
+    for effect in builder.components.get_components_by_type(InterventionEffect):
+        if effect.target.name != risk.name:
+            continue
+        config = builder.configuration.interventions[f'{effect.intervention_name}_intervention']
+        permanent = config[f'effect_on_{risk.name}'].full_effect_duration == 'permanent'
+        if effect.target.measure != 'raw_exposure' or not permanent:
+            return True
+    return False
 
 
 def get_exposure_data(builder, risk):
@@ -157,9 +236,65 @@ def get_exposure_data(builder, risk):
     return exposure
 
 
+def get_category_cdf(exposure_data: pd.DataFrame, categories: np.ndarray) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Builds the cumulative distribution over ``categories`` of each distinct
+    exposure vector in the data.
+
+    Returns the demographic key columns of the exposure data with an
+    ``exposure_group`` column giving the row of the cumulative distribution
+    that applies to them, and the cumulative distributions themselves.
+    """
+    exposure_groups, distinct_exposure = get_distinct_rows(exposure_data, categories, 'exposure_group')
+    return exposure_groups, np.cumsum(distinct_exposure, axis=1)
+
+
+def get_distinct_rows(data: pd.DataFrame, columns, group_column: str) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Finds the distinct rows of ``data[columns]``.
+
+    Returns the remaining columns of the data with ``group_column`` giving the
+    position of each row's values among the distinct rows, and the distinct
+    rows themselves.
+    """
+    distinct_rows, group = np.unique(data[columns].values, axis=0, return_inverse=True)
+    groups = data.drop(columns=list(columns))
+    groups[group_column] = group
+    return groups, distinct_rows
+
+
+def flatten_category_cdf(category_cdf: np.ndarray) -> np.ndarray:
+    """Lays the cumulative distributions of the exposure groups end to end,
+    each shifted up by twice its group so the whole is sorted.
+
+    Each distribution is closed at exactly 1, so group ``g`` spans
+    ``[2g, 2g + 1]`` and every draw in ``[0, 1)`` lands on one of its
+    categories even where the cumulative sum came to just under 1.
+    """
+    category_cdf = category_cdf.copy()
+    category_cdf[:, -1] = 1.
+    return (category_cdf + 2 * np.arange(len(category_cdf))[:, np.newaxis]).ravel()
+
+
+def sample_categories(flat_category_cdf: np.ndarray, exposure_group: np.ndarray, draw: np.ndarray,
+                      category_count: int) -> np.ndarray:
+    """Picks the position of the first category whose cumulative exposure in
+    the simulant's exposure group is at least their draw.
+
+    ``flat_category_cdf`` is the cumulative distributions of the exposure
+    groups as laid out by ``flatten_category_cdf``, each over
+    ``category_count`` categories.
+    """
+    # Shifting the draws the same way finds every simulant's category with one search.
+    position = np.searchsorted(flat_category_cdf, draw + 2 * exposure_group, side='left')
+    return position - exposure_group * category_count
+
+
 def get_categories_by_interval(builder, risk):
     category_dict = builder.data.load(f'{risk}.categories')
     category_dict[MISSING_CATEGORY] = 'Birth prevalence - [37, 38) wks, [1000, 1500) g'
+    return build_categories_by_interval(category_dict)
+
+
+def build_categories_by_interval(category_dict):
     cats = (pd.DataFrame.from_dict(category_dict, orient='index')
             .reset_index()
             .rename(columns={'index': 'cat', 0: 'name'}))
@@ -170,6 +305,36 @@ def get_categories_by_interval(builder, risk):
     return cats
 
 
+def get_category_edges(intervals_by_category: pd.DataFrame) -> pd.DataFrame:
+    """Unpacks the birth weight and gestation time intervals of each LBWSG
+    category into float columns of left and right edges, indexed by category.
+    """
+    birth_weight = pd.Index(intervals_by_category.birth_weight)
+    gestation_time = pd.Index(intervals_by_category.gestation_time)
+    return pd.DataFrame({'birth_weight_left': birth_weight.left.values.astype(float),
+                         'birth_weight_right': birth_weight.right.values.astype(float),
+                         'gestation_time_left': gestation_time.left.values.astype(float),
+                         'gestation_time_right': gestation_time.right.values.astype(float)},
+                        index=intervals_by_category.index)
+
+
+def sample_from_category_edges(category_edges: pd.DataFrame, category_codes: np.ndarray,
+                               bw_draw: pd.Series, gt_draw: pd.Series) -> pd.DataFrame:
+    """Samples birth weight and gestation time uniformly within the intervals
+    of each simulant's LBWSG category.
+
+    ``category_codes`` are positions into ``category_edges`` and line up with
+    the draws, whose index is used for the result.
+    """
+    bw_left = category_edges['birth_weight_left'].values[category_codes]
+    bw_right = category_edges['birth_weight_right'].values[category_codes]
+    gt_left = category_edges['gestation_time_left'].values[category_codes]
+    gt_right = category_edges['gestation_time_right'].values[category_codes]
+    return pd.DataFrame({'birth_weight': bw_left + bw_draw.values * (bw_right - bw_left),
+                         'gestation_time': gt_left + gt_draw.values * (gt_right - gt_left)},
+                        index=bw_draw.index, columns=['birth_weight', 'gestation_time'])
+
+
 def get_intervals_from_name(name: str) -> Tuple[pd.Interval, pd.Interval]:
     """Converts a LBWSG category name to a pair of intervals.
 
@@ -221,10 +386,20 @@ class LBWSGRiskEffect:
 
     def setup(self, builder):
         self.randomness = builder.randomness.get_stream(f'effect_of_{self.risk.name}_on_{self.target.name}')
-        self.relative_risk = builder.lookup.build_table(self.get_relative_risk_data(builder))
+        relative_risk_data = self.get_relative_risk_data(builder)
+        self.relative_risk = builder.lookup.build_table(relative_risk_data)
+
+        self.lbwsg = builder.components.get_component('low_birthweight_short_gestation_risk')
+        if self.lbwsg.freeze_categories:
+            # One row of relative risks by category for each distinct set in the data.
+            relative_risk_groups, self.relative_risk_by_category = get_distinct_rows(
+                relative_risk_data, list(self.lbwsg.categories), 'relative_risk_group')
+            self.relative_risk_group = builder.lookup.build_table(relative_risk_groups)
         self.population_attributable_fraction = builder.lookup.build_table(
-            data_transformations.get_population_attributable_fraction_data(builder, self.risk, self.target, self.randomness)
+            get_population_attributable_fraction_data(builder, self.risk, self.target, self.randomness)
         )
+        _log.info(f'LBWSG relative risk and PAF setup for {self.target} done. So far '
+                  f'{SETUP_SECONDS["io"]:.2f}s reading and {SETUP_SECONDS["transform"]:.2f}s transforming.')
 
         self.exposure_effect = data_transformations.get_exposure_effect(builder, self.risk)
 
@@ -234,6 +409,9 @@ class LBWSGRiskEffect:
                                               modifier=self.population_attributable_fraction)
 
     def adjust_target(self, index, target):
+        if self.lbwsg.freeze_categories:
+            relative_risk_group = self.relative_risk_group(index).values.astype(int)
+            return target * self.relative_risk_by_category[relative_risk_group, self.lbwsg.get_category_codes(index)]
         return self.exposure_effect(target, self.relative_risk(index))
 
     def get_relative_risk_data(self, builder):
@@ -247,28 +425,68 @@ class LBWSGRiskEffect:
 def get_relative_risk_data_lbwsg(builder, risk: EntityString, target: TargetString, randomness: RandomnessStream):
     source_type = validate_relative_risk_data_source(builder, risk, target)
     relative_risk_data = load_relative_risk_data(builder, risk, target, source_type, randomness)
-    relative_risk_data = rebin_relative_risk_data(builder, risk, relative_risk_data)
+    with timed_setup('transform'):
+        relative_risk_data = rebin_relative_risk_data(builder, risk, relative_risk_data)
 
-    if get_distribution_type(builder, risk) in ['dichotomous', 'ordered_polytomous', 'unordered_polytomous']:
-        relative_risk_data = pivot_categorical(relative_risk_data)
-    else:
-        relative_risk_data = relative_risk_data.drop(['parameter'], 'columns')
+        if get_distribution_type(builder, risk) in ['dichotomous', 'ordered_polytomous', 'unordered_polytomous']:
+            relative_risk_data = pivot_categorical(relative_risk_data)
+        else:
+            relative_risk_data = relative_risk_data.drop(['parameter'], 'columns')
 
     return relative_risk_data
 
 
-RR_SOURCE='/share/costeffectiveness/artifacts/vivarium_conic_sam_comparison/lbwsg_rr.hdf'
+# Seconds spent by all the LBWSG risk effects in this process reading and transforming their data.
+SETUP_SECONDS = {'io': 0., 'transform': 0.}
+
+
+@contextmanager
+def timed_setup(kind: str):
+    start = time.time()
+    yield
+    SETUP_SECONDS[kind] += time.time() - start
+
+
+# Data for every target by source and draw, so each is only read and partitioned once per process.
+_relative_risk_by_target = {}
+_population_attributable_fraction_by_target = {}
+
+
+def partition_by_target(data: pd.DataFrame) -> Dict[Tuple[str, str], pd.DataFrame]:
+    return {target: target_data.drop(columns=['affected_entity', 'affected_measure'])
+            for target, target_data in data.groupby(['affected_entity', 'affected_measure'])}
+
+
+def get_target_data(data_by_target: Dict[Tuple[str, str], pd.DataFrame], target: TargetString) -> pd.DataFrame:
+    if (target.name, target.measure) not in data_by_target:
+        raise ValueError(f'No data found for {target}.')
+    # Copied so the shared data can't be changed by whoever gets it.
+    return data_by_target[(target.name, target.measure)].copy()
+
+
 def load_relative_risk_data(builder, risk: EntityString, target: TargetString,
                             source_type: str, randomness: RandomnessStream):
     relative_risk_data = None
     if source_type == 'data':
         #relative_risk_data = builder.data.load(f'{risk}.relative_risk')
-        relative_risk_data = sid.read_data(RR_SOURCE, 'data',
-                                           builder.configuration.input_data.input_draw_number)
-        correct_target = ((relative_risk_data['affected_entity'] == target.name)
-                          & (relative_risk_data['affected_measure'] == target.measure))
-        relative_risk_data = (relative_risk_data[correct_target]
-                              .drop(['affected_entity', 'affected_measure'], 'columns'))
+        draw = builder.configuration.input_data.input_draw_number
+        # The memory mapped copy is read in preference if there is one.
+        name = ('lbwsg_relative_risk_npy' if external_data.has_source(builder.configuration, 'lbwsg_relative_risk_npy')
+                else 'lbwsg_relative_risk')
+        source = external_data.get_source(builder.configuration, name)
+        if (source, draw) not in _relative_risk_by_target:
+            with timed_setup('io'):
+                if name == 'lbwsg_relative_risk_npy':
+                    # Only the index and this draw are copied to the cache, if there is one.
+                    relative_risk_data = sid.read_npy_data(
+                        source, draw,
+                        get_file=lambda f: external_data.get_source_path(builder.configuration, name, f))
+                else:
+                    relative_risk_data = sid.read_data(external_data.get_source_path(builder.configuration, name),
+                                                       'data', draw)
+            with timed_setup('transform'):
+                _relative_risk_by_target[(source, draw)] = partition_by_target(relative_risk_data)
+        relative_risk_data = get_target_data(_relative_risk_by_target[(source, draw)], target)
 
     # elif source_type == 'relative risk value':
     #     relative_risk_data = _make_relative_risk_data(builder, float(relative_risk_source['relative_risk']))
@@ -281,3 +499,21 @@ def load_relative_risk_data(builder, risk: EntityString, target: TargetString,
 
     return relative_risk_data
 
+
+def get_population_attributable_fraction_data(builder, risk: EntityString, target: TargetString,
+                                              randomness: RandomnessStream):
+    """``data_transformations.get_population_attributable_fraction_data``,
+    loading PAF data from the artifact once for all targets."""
+    exposure_source = builder.configuration[f'{risk.name}']['exposure']
+    rr_source_type = validate_relative_risk_data_source(builder, risk, target)
+    if not (exposure_source == 'data' and rr_source_type == 'data' and risk.type == 'risk_factor'):
+        return data_transformations.get_population_attributable_fraction_data(builder, risk, target, randomness)
+
+    input_data = builder.configuration.input_data.to_dict()
+    key = (input_data.get('artifact_path'), input_data.get('sliced_artifact_path'), input_data['input_draw_number'])
+    if key not in _population_attributable_fraction_by_target:
+        with timed_setup('io'):
+            paf_data = builder.data.load(f'{risk}.population_attributable_fraction')
+        with timed_setup('transform'):
+            _population_attributable_fraction_by_target[key] = partition_by_target(paf_data)
+    return get_target_data(_population_attributable_fraction_by_target[key], target)
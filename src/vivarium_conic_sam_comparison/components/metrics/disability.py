@@ -1,6 +1,12 @@
+import numpy as np
+
 from vivarium_public_health.metrics.disability import Disability
-from vivarium_public_health.metrics.utilities import get_years_lived_with_disability
-from vivarium_conic_sam_comparison.components.metrics.utilities import convert_whz_to_categorical
+from vivarium_public_health.metrics.utilities import (get_output_template, get_age_sex_filter_and_iterables,
+                                                      to_years)
+from vivarium_conic_sam_comparison.components.metrics.utilities import (get_whz_thresholds, get_whz_categories,
+                                                                       get_whz_category_codes, get_age_group_codes,
+                                                                       get_sex_codes, get_age_sex_keys,
+                                                                       StratifiedTally)
 
 
 class WHZDisabilityObserver(Disability):
@@ -21,25 +27,62 @@ class WHZDisabilityObserver(Disability):
     def setup(self, builder):
         super().setup(builder)
         self.raw_whz_exposure = builder.value.get_value('child_stunting.exposure').source
+        self.whz_thresholds = get_whz_thresholds(builder, 'child_stunting')
+        self.whz_categories = get_whz_categories(self.whz_thresholds)
+
+        # Years lived with disability by cause, WHZ category, age group and sex.
+        _, (ages, sexes) = get_age_sex_filter_and_iterables(self.config.to_dict(), self.age_bins)
+        self.whz_ylds = StratifiedTally((len(self.causes), len(self.whz_categories), len(ages), len(sexes)))
+        # WHZ categories anyone was in on a step of each year, which are the ones reported.
+        self.whz_ylds_categories = {}
 
     def on_time_step_prepare(self, event):
-        # Almost the same process, just additionally subset by WHZ cat before using utilities.
+        # Almost the same process, just additionally stratified by WHZ cat.
         if not self.config.by_whz:
             super().on_time_step_prepare(event)
             return
 
         pop = self.population_view.get(event.index, query='tracked == True and alive == "alive"')
         raw_whz_exposure = self.raw_whz_exposure(pop.index)
-        whz_exposure = convert_whz_to_categorical(raw_whz_exposure)
-        for cat in whz_exposure.unique():
-            pop_for_cat = pop.loc[whz_exposure == cat]
+        whz_codes = get_whz_category_codes(raw_whz_exposure, self.whz_thresholds)
+        year = self.clock().year
+
+        if year not in self.whz_ylds_categories:
+            self.whz_ylds_categories[year] = np.zeros(len(self.whz_categories), dtype=bool)
+        self.whz_ylds_categories[year][whz_codes] = True
+
+        if self.causes:
+            # Every cause's weights go into the tally in one pass, stacked cause by cause.
+            config = self.config.to_dict()
+            cause_count = len(self.causes)
+            disability_weights = [self.disability_weight_pipelines[cause](pop.index).values
+                                  for cause in self.causes]
+            self.whz_ylds.add(year, [np.repeat(np.arange(cause_count), len(pop)),
+                                     np.tile(whz_codes, cause_count),
+                                     np.tile(get_age_group_codes(pop, config, self.age_bins), cause_count),
+                                     np.tile(get_sex_codes(pop, config), cause_count)],
+                              weights=np.concatenate(disability_weights) * to_years(self.step_size()))
 
-            ylds_this_step = get_years_lived_with_disability(pop_for_cat, self.config.to_dict(),
-                                                             self.clock().year, self.step_size(),
-                                                             self.age_bins, self.disability_weight_pipelines, self.causes)
-            ylds_this_step = {key + f'_in_{cat}': value for key, value in ylds_this_step.items()}
-            self.years_lived_with_disability.update(ylds_this_step)
+        pop['years_lived_with_disability'] += self.disability_weight(pop.index)
+        self.population_view.update(pop)
 
-            pop.loc[pop_for_cat.index, 'years_lived_with_disability'] += self.disability_weight(pop_for_cat.index)
-            self.population_view.update(pop)
+    def get_whz_years_lived_with_disability(self):
+        """Renders the years lived with disability by WHZ category to output keys."""
+        config = self.config.to_dict()
+        ylds = {}
+        for year, totals in self.whz_ylds.totals.items():
+            year_key = get_output_template(**config).substitute(year=year)
+            for cause_code, cause in enumerate(self.causes):
+                keys = get_age_sex_keys(year_key.substitute(measure=f'ylds_due_to_{cause}'), config, self.age_bins)
+                for code in np.flatnonzero(self.whz_ylds_categories[year]):
+                    cat = self.whz_categories[code]
+                    for key, value in zip(keys.ravel(), totals[cause_code, code].ravel()):
+                        key = f'{key}_in_{cat}'
+                        ylds[key] = ylds.get(key, 0) + value
+        return ylds
 
+    def metrics(self, index, metrics):
+        metrics = super().metrics(index, metrics)
+        if self.config.by_whz:
+            metrics.update(self.get_whz_years_lived_with_disability())
+        return metrics
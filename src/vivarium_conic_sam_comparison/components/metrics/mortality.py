@@ -1,13 +1,14 @@
-from collections import Counter
-
 import pandas as pd
 import numpy as np
 
 from vivarium_public_health.metrics.mortality import MortalityObserver
-from vivarium_public_health.metrics.utilities import (QueryString, get_output_template, get_group_counts,
-                                                      get_deaths, get_years_of_life_lost)
+from vivarium_public_health.metrics.utilities import (get_output_template, get_age_sex_filter_and_iterables,
+                                                      get_time_iterable, clean_cause_of_death)
 
-from vivarium_conic_sam_comparison.components.metrics.utilities import convert_whz_to_categorical
+from vivarium_conic_sam_comparison.components.metrics.utilities import (get_whz_thresholds, get_whz_categories,
+                                                                       get_whz_category_codes, get_age_group_codes,
+                                                                       get_sex_codes, get_age_sex_keys,
+                                                                       StratifiedTally)
 
 
 class WHZMortalityObserver(MortalityObserver):
@@ -32,6 +33,8 @@ class WHZMortalityObserver(MortalityObserver):
         self.step_size = builder.configuration.time.step_size / 365.25
         # NOTE: Abie wants un-intervened on exposure to govern the groupings.
         self.raw_whz_exposure = builder.value.get_value('child_wasting.exposure').source
+        self.whz_thresholds = get_whz_thresholds(builder, 'child_wasting')
+        self.whz_categories = get_whz_categories(self.whz_thresholds)
 
         builder.value.register_value_modifier('metrics', self.metrics)
 
@@ -40,7 +43,20 @@ class WHZMortalityObserver(MortalityObserver):
             self.whz_at_death_view = builder.population.get_view(['alive', 'whz_at_death'])
             builder.population.initializes_simulants(self.on_initialize_simulants, creates_columns=['whz_at_death'])
             builder.event.register_listener('time_step__prepare', self.on_time_step_prepare)
-            self.person_time = Counter()
+            # Living simulants counted each step by WHZ category, age group and sex.
+            _, (ages, sexes) = get_age_sex_filter_and_iterables(self.config.to_dict(), self.age_bins)
+            self.person_time = StratifiedTally((len(self.whz_categories), len(ages), len(sexes)))
+            # WHZ categories anyone was in on a step of each year, which are the ones reported.
+            self.person_time_categories = {}
+
+            # Deaths and ylls by cause, WHZ category at death, age group and sex, tallied as simulants die.
+            builder.event.register_listener('deaths', self.on_deaths)
+            builder.event.register_listener('time_step__cleanup', self.on_time_step_cleanup, priority=0)
+            self.died_this_step = []
+            shape = (len(self.causes), len(self.whz_categories), len(ages), len(sexes))
+            self.deaths = StratifiedTally(shape, dtype=np.int64)
+            self.years_of_life_lost = StratifiedTally(shape)
+            self.total_years_of_life_lost = 0.
 
     def on_initialize_simulants(self, pop_data):
         pop = self.whz_at_death_view.subview(['alive']).get(pop_data.index)
@@ -54,47 +70,97 @@ class WHZMortalityObserver(MortalityObserver):
     def on_time_step_prepare(self, event):
         # we count person time each time step if we are tracking WHZ
         pop = self.population_view.get(event.index)
-        raw_whz_exposure = self.raw_whz_exposure(event.index)
-        whz_exposure = convert_whz_to_categorical(raw_whz_exposure)
-        for cat in whz_exposure.unique():
-            in_cat = pop.loc[whz_exposure == cat]
-            base_filter = QueryString('alive == "alive"')
-            base_key = get_output_template(**self.config)
-            base_key = base_key.substitute(measure='person_time', year=self.clock().year)
-            counts = get_group_counts(in_cat, base_filter, base_key, self.config.to_dict(), self.age_bins)
-            counts = {str(key) + f'_in_{cat}': value * self.step_size for key, value in counts.items()}
-            self.person_time.update(counts)
+        raw_whz_exposure = self.raw_whz_exposure(pop.index)
+        whz_codes = get_whz_category_codes(raw_whz_exposure, self.whz_thresholds)
+        year = self.clock().year
+
+        if year not in self.person_time_categories:
+            self.person_time_categories[year] = np.zeros(len(self.whz_categories), dtype=bool)
+        self.person_time_categories[year][whz_codes] = True
+
+        alive = (pop.alive == 'alive').values
+        config = self.config.to_dict()
+        self.person_time.add(year, [whz_codes[alive],
+                                    get_age_group_codes(pop[alive], config, self.age_bins),
+                                    get_sex_codes(pop[alive], config)])
+
+    def on_deaths(self, event):
+        # Cause of death is only written after the event, so the dead are recorded at cleanup.
+        self.died_this_step.append(event.index)
+
+    def on_time_step_cleanup(self, event):
+        if not self.died_this_step:
+            return
+        died = self.died_this_step[0].append(self.died_this_step[1:])
+        self.died_this_step = []
+
+        pop = self.population_view.get(died)
+        pop = pop[pop.alive == 'dead']
+        whz_at_death = self.raw_whz_exposure(pop.index)
+        self.whz_at_death_view.update(whz_at_death.rename('whz_at_death'))
+
+        config = self.config.to_dict()
+        cause_codes = pd.Categorical(clean_cause_of_death(pop).cause_of_death,
+                                     categories=[f'death_due_to_{cause}' for cause in self.causes]).codes
+        codes = [cause_codes,
+                 get_whz_category_codes(whz_at_death, self.whz_thresholds),
+                 get_age_group_codes(pop, config, self.age_bins),
+                 get_sex_codes(pop, config)]
+        year = event.time.year if config['by_year'] else 'all_years'  # the single span of get_time_iterable
+        self.deaths.add(year, codes)
+        self.years_of_life_lost.add(year, codes, weights=pop.years_of_life_lost.values)
+        self.total_years_of_life_lost += pop.years_of_life_lost.sum()
+
+    def get_deaths_and_ylls(self):
+        """Renders the deaths and ylls tallied at death to output keys."""
+        config = self.config.to_dict()
+        template = get_output_template(**config)
+        # Report the categories anyone lived or died in.
+        categories = np.zeros(len(self.whz_categories), dtype=bool)
+        for seen in self.person_time_categories.values():
+            categories |= seen
+        for totals in self.deaths.totals.values():
+            categories |= totals.sum(axis=(0, 2, 3)) > 0
+        deaths_and_ylls = {}
+        for year, _ in get_time_iterable(config, self.start_time, self.clock()):
+            for measure, tally in [('death', self.deaths), ('ylls', self.years_of_life_lost)]:
+                totals = tally.totals.get(year, np.zeros(tally.shape, dtype=tally.dtype))
+                for cause_code, cause in enumerate(self.causes):
+                    keys = get_age_sex_keys(template.substitute(measure=f'{measure}_due_to_{cause}', year=year),
+                                            config, self.age_bins)
+                    for code in np.flatnonzero(categories):
+                        cat = self.whz_categories[code]
+                        deaths_and_ylls.update({f'{key}_in_{cat}': value for key, value
+                                                in zip(keys.ravel(), totals[cause_code, code].ravel())})
+        return deaths_and_ylls
+
+    def get_person_time(self):
+        """Renders the person time counted each step to output keys."""
+        config = self.config.to_dict()
+        template = get_output_template(**config)
+        person_time = {}
+        for year, counts in self.person_time.totals.items():
+            keys = get_age_sex_keys(template.substitute(measure='person_time', year=year), config, self.age_bins)
+            for code in np.flatnonzero(self.person_time_categories[year]):
+                cat = self.whz_categories[code]
+                for key, count in zip(keys.ravel(), counts[code].ravel()):
+                    key = f'{key}_in_{cat}'
+                    person_time[key] = person_time.get(key, 0) + count * self.step_size
+        return person_time
 
     def metrics(self, index, metrics):
         if not self.config.by_whz:
             return super().metrics(index, metrics)
 
         pop = self.population_view.get(index)
-        pop.loc[pop.exit_time.isnull(), 'exit_time'] = self.clock()
-
         the_living = pop[(pop.alive == 'alive') & pop.tracked]
-        the_dead = pop[pop.alive == 'dead']
-        metrics['years_of_life_lost'] = self.life_expectancy(the_dead.index).sum()
+        metrics['years_of_life_lost'] = self.total_years_of_life_lost
         metrics['total_population_living'] = len(the_living)
 
-        # Ylls and Deaths are 'point' estimates at the time of death.
-        # We can count them after-the-fact since we tracked WHZ at death.
-        raw_whz_exposure = self.raw_whz_exposure(pop.index)
-        whz_exposure = convert_whz_to_categorical(raw_whz_exposure)
-        for cat in whz_exposure.unique():
-            pop_for_cat = pop.loc[whz_exposure == cat]
-            deaths = get_deaths(pop_for_cat, self.config.to_dict(), self.start_time, self.clock(),
-                                self.age_bins, self.causes)
-            ylls = get_years_of_life_lost(pop_for_cat, self.config.to_dict(), self.start_time, self.clock(),
-                                          self.age_bins, self.life_expectancy, self.causes)
-
-            deaths = {key + f'_in_{cat}': value for key, value in deaths.items()}
-            ylls = {key + f'_in_{cat}': value for key, value in ylls.items()}
-
-            metrics.update(deaths)
-            metrics.update(ylls)
+        # Ylls and Deaths are 'point' estimates at the time of death, tallied as simulants died.
+        metrics.update(self.get_deaths_and_ylls())
 
         # toss in the person time we accrued each step
-        metrics.update(self.person_time)
+        metrics.update(self.get_person_time())
         return metrics
 
@@ -1,10 +1,12 @@
-from collections import Counter
-
+import numpy as np
 import pandas as pd
 
 from vivarium_public_health.utilities import EntityString
 from vivarium_public_health.metrics.utilities import get_age_sex_filter_and_iterables, get_age_bins, get_output_template
 
+from vivarium_conic_sam_comparison.components.metrics.utilities import (get_age_group_codes, get_sex_codes,
+                                                                       get_age_sex_keys, StratifiedTally)
+
 
 class CatStratRiskObserver:
     """ An observer for a categorical risk factor also stratified by age, sex, and year.
@@ -55,7 +57,11 @@ class CatStratRiskObserver:
         self.clock = builder.time.clock()
         self.categories = self.config.categories
         self.age_bins = get_age_bins(builder)
-        self.category_counts = Counter()
+        # Simulants in each category, age group and sex on each year's sample date.
+        _, (ages, sexes) = get_age_sex_filter_and_iterables(self.config.to_dict(), self.age_bins)
+        self.category_counts = StratifiedTally((len(self.categories), len(ages), len(sexes)), dtype=np.int64)
+        self.sample_year = None
+        self.sample_date = None
 
         self.population_view = builder.population.get_view(['alive', 'age', 'sex'], query='alive == "alive"')
 
@@ -66,32 +72,26 @@ class CatStratRiskObserver:
 
     def on_collect_metrics(self, event):
         """Records counts of risk exposed by category."""
-        pop = self.population_view.get(event.index)
-
         if self.should_sample(event.time):
-            age_sex_filter, (ages, sexes) = get_age_sex_filter_and_iterables(self.config, self.age_bins)
-            group_counts = {}
+            pop = self.population_view.get(event.index)
+            config = self.config.to_dict()
             exposure = self.exposure(pop.index)
-
-            for group, age_group in ages:
-                start, end = age_group.age_group_start, age_group.age_group_end
-                for sex in sexes:
-                    filter_kwargs = {'age_group_start': start, 'age_group_end': end, 'sex': sex, 'age_group': group}
-                    group_filter = age_sex_filter.format(**filter_kwargs)
-                    in_group = pop.query(group_filter) if group_filter and not pop.empty else pop
-
-                    for cat in self.categories:
-                        base_key = get_output_template(**self.config).substitute(
-                            measure=f'{self.risk.name}_{cat}_exposed', year=self.clock().year)
-                        group_key = base_key.substitute(**filter_kwargs)
-                        group_counts[group_key] = (exposure.loc[in_group.index] == cat).sum()
-
-            self.category_counts.update(group_counts)
+            category_codes = pd.Categorical(exposure, categories=self.categories).codes
+            self.category_counts.add(self.clock().year, [category_codes,
+                                                         get_age_group_codes(pop, config, self.age_bins),
+                                                         get_sex_codes(pop, config)])
 
     def should_sample(self, event_time: pd.Timestamp) -> bool:
-        """Returns true if we should sample on this time step."""
-        sample_date = pd.Timestamp(event_time.year, self.config.sample_date.month, self.config.sample_date.day)
-        return self.clock() <= sample_date < event_time
+        """Returns true if we should sample on this time step.
+
+        The sample date is only rebuilt when the step ends in a new year, so
+        other steps cost a single comparison.
+        """
+        if event_time.year != self.sample_year:
+            self.sample_year = event_time.year
+            self.sample_date = pd.Timestamp(event_time.year, self.config.sample_date.month,
+                                            self.config.sample_date.day)
+        return self.clock() <= self.sample_date < event_time
 
     def generate_sampling_frame(self) -> pd.DataFrame:
         """Generates an empty sampling data frame."""
@@ -99,7 +99,16 @@ class CatStratRiskObserver:
         return sample
 
     def metrics(self, index, metrics):
-        metrics.update(self.category_counts)
+        config = self.config.to_dict()
+        category_counts = {}
+        for year, counts in self.category_counts.totals.items():
+            for code, cat in enumerate(self.categories):
+                base_key = get_output_template(**config).substitute(measure=f'{self.risk.name}_{cat}_exposed',
+                                                                    year=year)
+                keys = get_age_sex_keys(base_key, config, self.age_bins)
+                for key, count in zip(keys.ravel(), counts[code].ravel()):
+                    category_counts[key] = category_counts.get(key, 0) + count
+        metrics.update(category_counts)
         return metrics
 
     def __repr__(self):
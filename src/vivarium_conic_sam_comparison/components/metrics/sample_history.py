@@ -1,13 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+
+import numpy as np
 import pandas as pd
 
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable
+
+_log = logging.getLogger(__name__)
+
+MEGABYTE = 1024 * 1024
+
+# The file extension each output format is written with, which read_sample_history goes by.
+OUTPUT_EXTENSIONS = {'hdf': '.hdf', 'parquet': '.parquet', 'feather': '.feather'}
+
+LBWSG_RAW_EXPOSURE = 'low_birth_weight_and_short_gestation.raw_exposure'
+
+# Output column: (pipeline, how it is called, what is taken from the result).
+# A pipeline is called as a 'value', with 'skip_post_processor' or through its
+# 'source' alone, and each pipeline and call is evaluated once per record
+# however many columns are taken from it.
+SAMPLED_PIPELINES = {
+    'mortality_rate': ('mortality_rate', 'value', lambda rates: rates.sum(axis=1)),
+    'disability_weight': ('disability_weight', 'value', None),
+
+    'child_wasting_exposure': ('child_wasting.exposure', 'value', None),
+    'child_wasting_raw_exposure': ('child_wasting.exposure', 'skip_post_processor', None),
+    'child_wasting_raw_exposure_baseline': ('child_wasting.exposure', 'source', None),
+
+    'child_stunting_exposure': ('child_stunting.exposure', 'value', None),
+    'child_stunting_raw_exposure': ('child_stunting.exposure', 'skip_post_processor', None),
+    'child_stunting_raw_exposure_baseline': ('child_stunting.exposure', 'source', None),
+
+    'low_birth_weight_and_short_gestation_exposure': ('low_birth_weight_and_short_gestation.exposure', 'value', None),
+
+    'low_birth_weight_and_short_gestation_raw_bw_raw_exposure': (LBWSG_RAW_EXPOSURE, 'value', 'birth_weight'),
+    'low_birth_weight_and_short_gestation_raw_bw_raw_exposure_baseline': (LBWSG_RAW_EXPOSURE, 'source', 'birth_weight'),
+    'low_birth_weight_and_short_gestation_raw_gt_raw_exposure': (LBWSG_RAW_EXPOSURE, 'value', 'gestation_time'),
+    'low_birth_weight_and_short_gestation_raw_gt_raw_exposure_baseline': (LBWSG_RAW_EXPOSURE, 'source', 'gestation_time'),
+
+    'diarrheal_diseases_incidence_rate': ('diarrheal_diseases.incidence_rate', 'value', None),
+    'lower_respiratory_infections_incidence_rate': ('lower_respiratory_infections.incidence_rate', 'value', None),
+    'measles_incidence_rate': ('measles.incidence_rate', 'value', None),
+}
+
+
+def get_pipeline_call(pipeline, call: str):
+    """A function of a population index calling ``pipeline`` the given way."""
+    if call == 'value':
+        return pipeline
+    if call == 'skip_post_processor':
+        return lambda index: pipeline(index, skip_post_processor=True)
+    if call == 'source':
+        # The source may not be registered yet when this is set up.
+        return lambda index: pipeline.source(index)
+    raise ValueError(f'Unknown pipeline call {call}.')
+
+
+def project(result, projection) -> pd.Series:
+    """Takes a sample history column from a pipeline result."""
+    if projection is None:
+        return result
+    if callable(projection):
+        return projection(result)
+    return result[projection]
+
+
+class SampleHistoryWriter:
+    """Buffers sample history snapshots and appends them in chunks to a table
+    format HDF store.
+
+    A chunk is written once ``buffer_steps`` snapshots or ``buffer_megabytes``
+    of data are buffered. Writes run on a background thread so they overlap
+    the following time steps, with at most one write in flight, so memory
+    stays bounded by about two chunks however long the simulation runs.
+    """
+
+    # Room for the longest cause of death and other string values.
+    MIN_STRING_SIZE = 128
+
+    def __init__(self, path: str, key: str = 'histories', buffer_steps: int = 30, buffer_megabytes: float = 256):
+        self.path = path
+        self.key = key
+        self.buffer_steps = buffer_steps
+        self.buffer_bytes = buffer_megabytes * MEGABYTE
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._started = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_write = None
+
+    def append(self, snapshot: pd.DataFrame):
+        self._buffer.append(snapshot)
+        self._buffered_bytes += snapshot.memory_usage(deep=True).sum()
+        if len(self._buffer) >= self.buffer_steps or self._buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered snapshots to the writer thread."""
+        if not self._buffer:
+            return
+        chunk = pd.concat(self._buffer, axis=0)
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._wait()
+        self._pending_write = self._executor.submit(self._write, chunk)
+
+    def close(self):
+        """Writes anything still buffered and waits for it to finish."""
+        self.flush()
+        self._wait()
+        self._executor.shutdown()
+
+    def _wait(self):
+        # Raises any error from the last write here, in the simulation thread.
+        if self._pending_write is not None:
+            self._pending_write.result()
+            self._pending_write = None
+
+    def _write(self, chunk: pd.DataFrame):
+        with pd.HDFStore(self.path) as store:
+            if not self._started and self.key in store:
+                store.remove(self.key)
+            self._started = True
+            store.append(self.key, chunk, format='table', min_itemsize={'values': self.MIN_STRING_SIZE})
+
+
+class ColumnarSampleHistoryWriter(SampleHistoryWriter):
+    """Writes sample histories to Parquet or Feather in a compact schema.
+
+    The (simulant, time) index becomes an int32 ``simulant`` column and an
+    int32 ``time`` column of days since the start of the simulation. Other
+    date columns become float32 day offsets from the same start, NaN where
+    the date is missing, string columns become categoricals and float
+    columns become float32.
+
+    Each chunk is written as it comes, as a Parquet row group or a Feather
+    record batch.
+    """
+
+    OUTPUT_FORMATS = ['parquet', 'feather']
+
+    def __init__(self, path: str, output_format: str, start_time: pd.Timestamp, buffer_steps: int = 30,
+                 buffer_megabytes: float = 256):
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f'Sample history output format must be one of {self.OUTPUT_FORMATS}. '
+                             f'You specified {output_format}.')
+        if os.path.splitext(path)[1] != OUTPUT_EXTENSIONS[output_format]:
+            raise ValueError(f'A {output_format} sample history must be written to a path ending in '
+                             f'{OUTPUT_EXTENSIONS[output_format]}. You specified {path}.')
+        super().__init__(path, buffer_steps=buffer_steps, buffer_megabytes=buffer_megabytes)
+        self.output_format = output_format
+        self.start_time = start_time
+
+        self._categories = {}
+        self._schema = None
+        self._table_writer = None
+
+    def close(self):
+        super().close()
+        if self._table_writer is not None:
+            self._table_writer.close()
+
+    def _write(self, chunk: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(self._set_categories(self.compact(chunk)), preserve_index=False)
+        if self._table_writer is None:
+            # Category codes are int32 in every chunk, so the schema holds as categories are added.
+            self._schema = pa.schema([pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+                                      if pa.types.is_dictionary(field.type) else field for field in table.schema],
+                                     metadata=table.schema.metadata)
+            if self.output_format == 'parquet':
+                self._table_writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                # Later chunks' categories go in as additions to the file's dictionaries.
+                self._table_writer = pa.ipc.new_file(self.path, self._schema,
+                                                     options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        self._table_writer.write_table(table.cast(self._schema))
+
+    def compact(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Converts a chunk of sample history to the compact schema."""
+        compact = chunk.reset_index()
+        day = pd.Timedelta(days=1)
+        for column in compact.columns:
+            values = compact[column]
+            if column in ['simulant', 'time']:
+                if column == 'time':
+                    values = (values - self.start_time) // day
+                compact[column] = values.astype(np.int32)
+            elif pd.api.types.is_datetime64_any_dtype(values):
+                compact[column] = ((values - self.start_time) / day).astype(np.float32)
+            elif pd.api.types.is_float_dtype(values):
+                compact[column] = values.astype(np.float32)
+            elif pd.api.types.is_string_dtype(values):
+                categories = self._categories.setdefault(column, [])
+                categories.extend(sorted(set(values.dropna().unique()).difference(categories)))
+                compact[column] = pd.Categorical(values, categories=categories)
+        return compact
+
+    def _set_categories(self, compact: pd.DataFrame) -> pd.DataFrame:
+        # Categories only ever grow, so earlier chunks keep their codes.
+        for column, categories in self._categories.items():
+            compact[column] = compact[column].cat.set_categories(categories)
+        return compact
+
 
 class SampleHistoryObserver:
+    """Records the state and pipeline values of a sample of simulants.
+
+    In the default ``daily`` recording mode every sampled simulant gets a
+    row on every time step. The two sparse modes write far fewer rows:
+
+    ``cadence``
+        Rows for everyone every ``cadence_days`` days, and every day for
+        simulants within ``treatment_window_days`` of a treatment start.
+    ``changes``
+        A row only when one of a simulant's values changes. Age is
+        left out of the comparison since it changes every step and can
+        be recomputed from the time.
+
+    Either way, each simulant also gets a row when they are first sampled
+    and on the final time step. Sparse histories have a ``tracked``
+    column, and a row with ``tracked`` False marks the first time a
+    simulant was no longer in the simulation. ``densify_sample_history``
+    turns them back into one row per simulant per time step.
+    """
+
+    RECORDING_MODES = ['daily', 'cadence', 'changes']
 
     configuration_defaults = {
         'metrics': {
             'sample_history_observer': {
                 'sample_fraction': 0.10,  # fraction of new simulants sampled
-                'path': f'/share/costeffectiveness/results/vivarium_conic_sam_comparison/sample_history.hdf'
+                'buffer_steps': 30,  # time steps of history held in memory before writing
+                'buffer_megabytes': 256,  # or megabytes, whichever comes first
+                'output_format': 'hdf',  # or 'parquet' or 'feather' for a compact columnar schema
+                'recording_mode': 'daily',  # or 'cadence' or 'changes', see SampleHistoryObserver
+                'cadence_days': 30,  # in cadence mode, record everyone every this many days
+                'treatment_window_days': 30,  # and every day for this many days after a treatment starts
+                'path': 'sample_history.hdf'  # the extension is set from the output format
             }
         }
     }
@@ -16,10 +250,6 @@ class SampleHistoryObserver:
     def name(self):
         return "sample_history_observer"
 
-    def __init__(self):
-        self.history_snapshots = []
-        self.sample_index = pd.Index([])
-
     def setup(self, builder):
         self.clock = builder.time.clock()
         self.sample_fraction = builder.configuration.metrics.sample_history_observer['sample_fraction']
@@ -31,10 +261,30 @@ class SampleHistoryObserver:
         # self.num_samples_each_step = (self.sample_size
         #                               * (1. - self.fraction_initial_pop) / ((sim_start - sim_end) / step_size))
 
-        self.path = builder.configuration.metrics.sample_history_observer['path']
+        config = builder.configuration.metrics.sample_history_observer
+        self.path = get_output_path(config['path'], config['output_format'])
+        self.recording_mode = config['recording_mode']
+        if self.recording_mode not in self.RECORDING_MODES:
+            raise ValueError(f'Sample history recording mode must be one of {self.RECORDING_MODES}. '
+                             f'You specified {self.recording_mode}.')
+        self.start_time = pd.Timestamp(**builder.configuration.time.start.to_dict())
+        self.end_time = pd.Timestamp(**builder.configuration.time.end.to_dict())
+        self.cadence_days = config['cadence_days']
+        self.treatment_window = pd.Timedelta(days=config['treatment_window_days'])
+        # The last row written for each sampled simulant still in the simulation.
+        self.last_written = None
+        if config['output_format'] == 'hdf':
+            self.writer = SampleHistoryWriter(self.path, buffer_steps=config['buffer_steps'],
+                                              buffer_megabytes=config['buffer_megabytes'])
+        else:
+            self.writer = ColumnarSampleHistoryWriter(self.path, config['output_format'],
+                                                      self.start_time,
+                                                      buffer_steps=config['buffer_steps'],
+                                                      buffer_megabytes=config['buffer_megabytes'])
         self.randomness = builder.randomness.get_stream("sample_history")
 
-        self.sample_index = pd.Index([])
+        self.sample = SimulantSideTable({})
+        self.sample.register_compaction(builder)
 
         # sample from the initial pool and people born in to sim
         builder.population.initializes_simulants(self.on_initialize_simulants)
@@ -54,36 +304,13 @@ class SampleHistoryObserver:
                             'hemolytic_disease_and_other_neonatal_jaundice_event_time']
         self.population_view = builder.population.get_view(columns_required)
 
-        # keys will become column names in the output
-        self.pipelines = {'mortality_rate': builder.value.get_value('mortality_rate'),
-                          'disability_weight': builder.value.get_value('disability_weight'),
-
-                          'child_wasting_exposure': builder.value.get_value('child_wasting.exposure'),
-                          'child_wasting_raw_exposure': lambda pop_index: builder.value.get_value('child_wasting.exposure')(pop_index, skip_post_processor=True),
-                          'child_wasting_raw_exposure_baseline': lambda pop_index: builder.value.get_value('child_wasting.exposure').source(pop_index),
-
-                          'child_stunting_exposure': builder.value.get_value('child_stunting.exposure'),
-                          'child_stunting_raw_exposure': lambda pop_index: builder.value.get_value('child_stunting.exposure')(pop_index, skip_post_processor=True),
-                          'child_stunting_raw_exposure_baseline': lambda pop_index: builder.value.get_value('child_stunting.exposure').source(pop_index),
-
-                          'low_birth_weight_and_short_gestation_exposure': builder.value.get_value('low_birth_weight_and_short_gestation.exposure'),
-
-                          'low_birth_weight_and_short_gestation_raw_bw_raw_exposure':
-                              lambda pop_index: builder.value.get_value('low_birth_weight_and_short_gestation.raw_exposure')(pop_index)['birth_weight'],
-                          'low_birth_weight_and_short_gestation_raw_bw_raw_exposure_baseline':
-                              lambda pop_index: builder.value.get_value('low_birth_weight_and_short_gestation.raw_exposure').source(pop_index)['birth_weight'],
-
-                          'low_birth_weight_and_short_gestation_raw_gt_raw_exposure':
-                              lambda pop_index: builder.value.get_value('low_birth_weight_and_short_gestation.raw_exposure')(pop_index)['gestation_time'],
-                          'low_birth_weight_and_short_gestation_raw_gt_raw_exposure_baseline':
-                              lambda pop_index: builder.value.get_value('low_birth_weight_and_short_gestation.raw_exposure').source(pop_index)['gestation_time'],
-
-                          'diarrheal_diseases_incidence_rate':
-                              builder.value.get_value('diarrheal_diseases.incidence_rate'),
-                          'lower_respiratory_infections_incidence_rate':
-                              builder.value.get_value('lower_respiratory_infections.incidence_rate'),
-                          'measles_incidence_rate': builder.value.get_value('measles.incidence_rate'),
-                          }
+        # Each distinct pipeline call, shared by all the columns taken from it.
+        self.pipeline_calls = {}
+        for pipeline_name, call, _ in SAMPLED_PIPELINES.values():
+            if (pipeline_name, call) not in self.pipeline_calls:
+                self.pipeline_calls[(pipeline_name, call)] = get_pipeline_call(
+                    builder.value.get_value(pipeline_name), call)
+        self.pipeline_seconds = {key: 0. for key in self.pipeline_calls}
 
         builder.event.register_listener('collect_metrics', self.record)
         builder.event.register_listener('simulation_end', self.dump)
@@ -93,29 +320,164 @@ class SampleHistoryObserver:
     def on_initialize_simulants(self, pop_data):
         """Sample from the initial pop and those born in the sim."""
         draw = self.randomness.get_draw(pop_data.index)
-        priority_index = [i for d, i in sorted(zip(draw, pop_data.index), key=lambda x:x[0])]
         sample_size = int(self.sample_fraction * len(pop_data.index))
         sample_size = 1 if sample_size == 0 and len(pop_data.index) > 0 else sample_size
-        self.sample_index = self.sample_index.append(pd.Index(priority_index[:sample_size]))
+        if sample_size:
+            # The simulants with the smallest draws, without sorting everyone.
+            sampled = np.argpartition(draw.values, sample_size - 1)[:sample_size]
+            self.sample.update(pop_data.index[np.sort(sampled)])
 
     def record(self, event):
-        pop = self.population_view.get(self.sample_index)
+        pop = self.population_view.get(self.sample.index)
+        if self.recording_mode == 'daily':
+            self.writer.append(self.get_record(pop))
+            return
+
+        tracked = pop.index
+        if self.last_written is None:
+            everyone = True
+            exited = pd.DataFrame()
+        else:
+            everyone = event.time >= self.end_time  # the final time step
+            new = ~tracked.isin(self.last_written.index)
+            exited = self.last_written[~self.last_written.index.isin(tracked)].copy()
+
+        if self.recording_mode == 'cadence':
+            everyone |= (self.clock() - self.start_time).days % self.cadence_days == 0
+            if not everyone:
+                pop = pop[new | self.in_treatment_window(pop)]
+            record = self.get_record(pop)
+        else:
+            record = self.get_record(pop)
+            if not everyone:
+                record = record[new | self.has_changed(record)]
+        record['tracked'] = True
 
-        pipeline_results = []
-        for name, pipeline in self.pipelines.items():
-            values = pipeline(pop.index)
-            if name == 'mortality_rate':
-                values = values.sum(axis=1)
-            values = values.rename(name)
-            pipeline_results.append(values)
+        written = record.reset_index('time', drop=True)
+        if self.last_written is not None:
+            kept = self.last_written.index.isin(tracked) & ~self.last_written.index.isin(written.index)
+            written = pd.concat([self.last_written[kept], written], axis=0)
+        self.last_written = written
+
+        if not exited.empty:
+            exited['tracked'] = False
+            exited['time'] = self.clock()
+            record = pd.concat([record, exited.set_index('time', append=True)], axis=0)
+        self.writer.append(record)
+
+    def get_record(self, pop: pd.DataFrame) -> pd.DataFrame:
+        results = {}
+        for key, pipeline_call in self.pipeline_calls.items():
+            start = time.time()
+            results[key] = pipeline_call(pop.index)
+            self.pipeline_seconds[key] += time.time() - start
+
+        pipeline_results = [project(results[(pipeline_name, call)], projection).rename(name)
+                            for name, (pipeline_name, call, projection) in SAMPLED_PIPELINES.items()]
 
         record = pd.concat(pipeline_results + [pop], axis=1)
         record['time'] = self.clock()
         record.index.rename("simulant", inplace=True)
         record.set_index('time', append=True, inplace=True)
+        return record
 
-        self.history_snapshots.append(record)
+    def in_treatment_window(self, pop: pd.DataFrame) -> np.ndarray:
+        """Whether each simulant started any treatment within the treatment window."""
+        now = self.clock()
+        in_window = np.zeros(len(pop), dtype=bool)
+        for column in [c for c in pop.columns if c.endswith('_treatment_start')]:
+            in_window |= ((pop[column] <= now) & (now - pop[column] <= self.treatment_window)).values
+        return in_window
+
+    def has_changed(self, record: pd.DataFrame) -> np.ndarray:
+        """Whether any value but age differs from the simulant's last written row."""
+        current = record.reset_index('time', drop=True)
+        previous = self.last_written.reindex(current.index)
+        changed = np.zeros(len(current), dtype=bool)
+        for column in current.columns.drop('age'):
+            current_values, previous_values = current[column].values, previous[column].values
+            changed |= (current_values != previous_values) & ~(pd.isnull(current_values) & pd.isnull(previous_values))
+        return changed
 
     def dump(self, event):
-        sample_history = pd.concat(self.history_snapshots, axis=0)
-        sample_history.to_hdf(self.path, key='histories')
+        self.writer.close()
+        for (pipeline_name, call), seconds in self.get_pipeline_timings().items():
+            _log.info(f'Sample history spent {seconds:.2f}s evaluating {pipeline_name} ({call}).')
+
+    def get_pipeline_timings(self) -> pd.Series:
+        """Seconds spent in each pipeline call so far, slowest first."""
+        timings = pd.Series(self.pipeline_seconds)
+        return timings.sort_values(ascending=False)
+
+
+def get_output_path(path: str, output_format: str) -> str:
+    """``path`` with the file extension of ``output_format``."""
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f'Sample history output format must be one of {list(OUTPUT_EXTENSIONS)}. '
+                         f'You specified {output_format}.')
+    root, extension = os.path.splitext(path)
+    if extension != OUTPUT_EXTENSIONS[output_format]:
+        _log.warning(f'Writing the {output_format} sample history to {root + OUTPUT_EXTENSIONS[output_format]} '
+                     f'rather than {path}.')
+    return root + OUTPUT_EXTENSIONS[output_format]
+
+
+def read_sample_history(path: str, key: str = 'histories') -> pd.DataFrame:
+    """Reads a sample history in any output format, indexed by simulant and time."""
+    extension = os.path.splitext(path)[1]
+    if extension == OUTPUT_EXTENSIONS['parquet']:
+        return pd.read_parquet(path).set_index(['simulant', 'time'])
+    if extension == OUTPUT_EXTENSIONS['feather']:
+        return pd.read_feather(path).set_index(['simulant', 'time'])
+    return pd.read_hdf(path, key)
+
+
+def densify_sample_history(history: pd.DataFrame, step_size: float = 1) -> pd.DataFrame:
+    """Rebuilds one row per simulant per time step from a sparse sample history.
+
+    Each simulant's values are carried forward from their last row and their
+    age is moved on by the time since, while they are alive. Histories
+    recorded every day are returned as they are.
+
+    Parameters
+    ----------
+    history :
+        A sample history as returned by ``read_sample_history``.
+    step_size :
+        The simulation time step in days.
+    """
+    if 'tracked' not in history.columns:
+        return history
+
+    history = history.sort_index()
+    simulants = history.index.get_level_values('simulant').values
+    times = history.index.get_level_values('time')
+    if pd.api.types.is_datetime64_any_dtype(times):
+        record_times = pd.date_range(times.min(), times.max(), freq=pd.Timedelta(days=step_size))
+        year = pd.Timedelta(days=365.25)
+    else:
+        record_times = pd.Index(np.arange(times.min(), times.max() + step_size, step_size).astype(times.dtype))
+        year = 365.25
+    time_positions = record_times.get_indexer(times)
+
+    ids, simulant_codes = np.unique(simulants, return_inverse=True)
+    first = np.full(len(ids), len(record_times))
+    np.minimum.at(first, simulant_codes, time_positions)
+    exit_rows = ~history['tracked'].values.astype(bool)
+    stop = np.full(len(ids), len(record_times))
+    stop[simulant_codes[exit_rows]] = time_positions[exit_rows]
+
+    rows = history[~exit_rows]
+    row_keys = simulant_codes[~exit_rows] * len(record_times) + time_positions[~exit_rows]
+    counts = stop - first
+    dense_codes = np.repeat(np.arange(len(ids)), counts)
+    dense_positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    source_rows = np.searchsorted(row_keys, dense_codes * len(record_times) + dense_positions, side='right') - 1
+
+    dense = rows.iloc[source_rows].reset_index(drop=True)
+    dense_times = record_times[dense_positions]
+    alive = (dense['alive'] == 'alive').values
+    elapsed = (dense_times - rows.index.get_level_values('time')[source_rows]) / year
+    dense.loc[alive, 'age'] = (dense['age'].values[alive] + np.asarray(elapsed)[alive]).astype(dense['age'].dtype)
+    dense.index = pd.MultiIndex.from_arrays([ids[dense_codes], dense_times], names=['simulant', 'time'])
+    return dense.drop(columns='tracked')
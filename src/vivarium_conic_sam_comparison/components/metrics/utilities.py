@@ -1,21 +1,105 @@
+from typing import Dict, List, Sequence, Tuple
+
 import numpy as np
 import pandas as pd
 
+from vivarium_public_health.metrics.utilities import get_age_sex_filter_and_iterables, OutputTemplate
+
+# Upper edges of the exposed WHZ categories. Note that actual exposure is z-score + 10.
+WHZ_CATEGORY_THRESHOLDS = [7, 8, 9]
+
+
+def get_whz_thresholds(builder, risk_name: str) -> List[float]:
+    """The ``category_thresholds`` configured for a WHZ risk, or the defaults
+    if none are set."""
+    thresholds = builder.configuration[risk_name]['category_thresholds']
+    return list(thresholds) if thresholds else WHZ_CATEGORY_THRESHOLDS
+
+
+def get_whz_categories(thresholds: Sequence[float] = WHZ_CATEGORY_THRESHOLDS) -> List[str]:
+    """Names of the WHZ categories, in code order."""
+    return ['child_stunting_not_eligible'] + [f'child_stunting_cat{i + 1}' for i in range(len(thresholds) + 1)]
 
-def convert_whz_to_categorical(whz_series):
+
+def get_whz_category_codes(whz_series: pd.Series,
+                           thresholds: Sequence[float] = WHZ_CATEGORY_THRESHOLDS) -> np.ndarray:
+    """Integer codes into ``get_whz_categories(thresholds)``.
+
+    Categories are closed on the right. Exposures at or below 0 are not
+    eligible and the last category is unbounded above.
+    """
+    whz = whz_series.values
+    if np.isnan(whz).any():
+        raise ValueError('WHZ exposure has missing values and cannot be categorized.')
+    return np.digitize(whz, [0] + list(thresholds), right=True)
+
+
+def convert_whz_to_categorical(whz_series: pd.Series,
+                               thresholds: Sequence[float] = WHZ_CATEGORY_THRESHOLDS) -> pd.Series:
     # whz z-score has 10 added to it.
-    whz_categorical = pd.Series('', index=whz_series.index)
-    categories = {
-            # Note that actual expsure is z-score + 10
-            'child_stunting_not_eligible': (-np.inf, 0),
-            'child_stunting_cat1': (0, 7),
-            'child_stunting_cat2': (7, 8),
-            'child_stunting_cat3': (8, 9),
-            'child_stunting_cat4': (9, np.inf)
-    }
-    for cat in categories.keys():
-        in_cat_mask = ((categories[cat][0]) < whz_series) & (whz_series <= (categories[cat][1]))
-        whz_categorical.loc[in_cat_mask] = cat
-    assert sum(whz_categorical == '') == 0
-    return whz_categorical
+    codes = get_whz_category_codes(whz_series, thresholds)
+    return pd.Series(pd.Categorical.from_codes(codes, get_whz_categories(thresholds)), index=whz_series.index)
+
+
+def get_age_group_codes(pop: pd.DataFrame, config: Dict[str, bool], age_bins: pd.DataFrame) -> np.ndarray:
+    """Codes into ``age_bins`` of each simulant's age, -1 for ages outside
+    every bin.
+
+    Bins are closed on the left as in ``get_group_counts``. Everyone is in
+    the single all ages group if the observer is not binning by age.
+    """
+    if not config['by_age']:
+        return np.zeros(len(pop), dtype=np.int64)
+    age = pop['age'].values
+    codes = np.searchsorted(age_bins.age_group_start.values, age, side='right') - 1
+    in_bin = (codes >= 0) & (age < age_bins.age_group_end.values[codes])
+    return np.where(in_bin, codes, -1)
+
+
+def get_sex_codes(pop: pd.DataFrame, config: Dict[str, bool]) -> np.ndarray:
+    """Codes of each simulant's sex in the order
+    ``get_age_sex_filter_and_iterables`` gives them, -1 for any other value."""
+    if not config['by_sex']:
+        return np.zeros(len(pop), dtype=np.int64)
+    sex = pop['sex'].values
+    return np.select([sex == 'Male', sex == 'Female'], [0, 1], default=-1)
+
+
+def get_age_sex_keys(base_key: OutputTemplate, config: Dict[str, bool], age_bins: pd.DataFrame) -> np.ndarray:
+    """Output keys of the age and sex groups as an age group by sex array,
+    matching the codes from ``get_age_group_codes`` and ``get_sex_codes``."""
+    _, (ages, sexes) = get_age_sex_filter_and_iterables(config, age_bins)
+    keys = np.empty((len(ages), len(sexes)), dtype=object)
+    for i, (group, age_group) in enumerate(ages):
+        for j, sex in enumerate(sexes):
+            keys[i, j] = str(base_key.substitute(age_group_start=age_group.age_group_start,
+                                                 age_group_end=age_group.age_group_end,
+                                                 sex=sex, age_group=group))
+    return keys
+
+
+class StratifiedTally:
+    """Running totals by year and a fixed set of integer coded strata.
+
+    Totals are kept in dense arrays filled with a single ``np.bincount`` per
+    call to ``add``, so observers only build output keys when metrics are
+    requested.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype: type = float):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.totals = {}
 
+    def add(self, year, codes: Sequence[np.ndarray], weights: np.ndarray = None):
+        """Adds ``weights``, or one per row if not given, into the strata given
+        by the parallel ``codes`` arrays. Rows with any negative code are
+        dropped."""
+        in_strata = np.logical_and.reduce([c >= 0 for c in codes])
+        flat_codes = np.ravel_multi_index([c[in_strata] for c in codes], self.shape)
+        if weights is not None:
+            weights = weights[in_strata]
+        counts = np.bincount(flat_codes, weights=weights, minlength=int(np.prod(self.shape)))
+        if year not in self.totals:
+            self.totals[year] = np.zeros(self.shape, dtype=self.dtype)
+        self.totals[year] += counts.reshape(self.shape)
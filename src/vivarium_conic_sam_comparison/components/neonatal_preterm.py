@@ -1,7 +1,17 @@
 from vivarium_public_health.disease import RiskAttributableDisease
 
+from .side_table import SimulantSideTable
+
 
 class NeonatalPreterm(RiskAttributableDisease):
+    """Preterm birth, attributed to gestation time of 38 weeks or less.
+
+    Gestation time is fixed at birth, so whether a simulant was born preterm
+    is found once when they are initialized and the exposure filter reads
+    that back rather than evaluating the LBWSG exposure pipeline again.
+    """
+
+    MAX_WEEKS_FOR_PRETERM = 38
 
     @property
     def name(self):
@@ -10,10 +20,16 @@ class NeonatalPreterm(RiskAttributableDisease):
     def __init__(self):
         super().__init__('cause.neonatal_preterm_birth', 'risk_factor.low_birth_weight_and_short_gestation')
 
-    def get_exposure_filter(self, distribution, exposure_pipeline, threshold):
-        max_weeks_for_preterm = 38
+    def setup(self, builder):
+        self.preterm = SimulantSideTable({'preterm': bool})
+        self.preterm.register_compaction(builder)
+        super().setup(builder)
+
+    def on_initialize_simulants(self, pop_data):
+        exposure = self.exposure_pipeline(pop_data.index, skip_post_processor=True)
+        self.preterm.update(exposure.gestation_time <= self.MAX_WEEKS_FOR_PRETERM)
+        super().on_initialize_simulants(pop_data)
 
-        def exposure_filter(index):
-            exposure = exposure_pipeline(index, skip_post_processor=True)
-            return exposure.gestation_time <= max_weeks_for_preterm
-        return exposure_filter
+    def get_exposure_filter(self, distribution, exposure_pipeline, threshold):
+        self.exposure_pipeline = exposure_pipeline
+        return self.preterm.get
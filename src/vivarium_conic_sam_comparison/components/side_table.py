@@ -0,0 +1,145 @@
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+
+COMPACTION_INTERVAL = 30  # time steps
+
+
+class SimulantSideTable:
+    """Per-simulant values a component keeps outside the state table.
+
+    Values live in NumPy columns that grow geometrically as simulants are
+    added, and an array indexed by simulant id holds each simulant's row,
+    so both adding simulants and looking them up are constant time per
+    simulant. Rows of simulants who are no longer tracked can be compacted
+    away periodically by registering the table for compaction.
+    """
+
+    def __init__(self, columns: Dict[str, type], initial_capacity: int = 1024):
+        """
+        Parameters
+        ----------
+        columns :
+            Mapping of column name to NumPy dtype. May be empty to only
+            keep track of a set of simulants.
+        initial_capacity :
+            Number of rows to preallocate.
+        """
+        self.columns = list(columns)
+        self._ids = np.empty(initial_capacity, dtype=np.int64)
+        self._values = {column: np.empty(initial_capacity, dtype=dtype) for column, dtype in columns.items()}
+        self._rows = np.full(initial_capacity, -1, dtype=np.int64)  # row of each simulant id, -1 if absent
+        self._size = 0
+
+        self._tracked = None
+        self._compaction_interval = COMPACTION_INTERVAL
+        self._steps_since_compaction = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def index(self) -> pd.Index:
+        """The simulants in the table in the order they were added."""
+        return pd.Index(self._ids[:self._size])
+
+    def contains(self, index: pd.Index) -> np.ndarray:
+        """Boolean mask of which simulants in ``index`` have a row in the table."""
+        return self._get_rows(index) != -1
+
+    def get(self, index: pd.Index) -> Union[pd.DataFrame, pd.Series]:
+        """Values for the simulants in ``index``, NaN for simulants without a row.
+
+        Like a lookup table, returns a Series if the table has one column and
+        a DataFrame otherwise.
+        """
+        rows = self._get_rows(index)
+        missing = rows == -1
+        values = {}
+        for column in self.columns:
+            column_values = self._values[column][rows]
+            if missing.any():
+                column_values = np.where(missing, np.nan, column_values)
+            values[column] = column_values
+
+        if len(self.columns) == 1:
+            return pd.Series(values[self.columns[0]], index=index, name=self.columns[0])
+        return pd.DataFrame(values, index=index, columns=self.columns)
+
+    def update(self, data: Union[pd.DataFrame, pd.Series, pd.Index]):
+        """Adds rows for simulants not yet in the table and overwrites rows for
+        those that are.
+
+        As with a population view, a Series must be named for one of the
+        columns unless the table has only one. A bare index adds simulants
+        to a table with no columns.
+        """
+        index = data if isinstance(data, pd.Index) else data.index
+        if index.empty:
+            return
+        ids = index.values.astype(np.int64)
+        self._reserve_ids(ids.max() + 1)
+
+        rows = self._rows[ids]
+        new = rows == -1
+        new_count = new.sum()
+        self._reserve_rows(self._size + new_count)
+        rows[new] = np.arange(self._size, self._size + new_count)
+        self._ids[rows[new]] = ids[new]
+        self._rows[ids[new]] = rows[new]
+        self._size += new_count
+
+        if isinstance(data, pd.Series):
+            column = self.columns[0] if len(self.columns) == 1 else data.name
+            self._values[column][rows] = data.values
+        elif isinstance(data, pd.DataFrame):
+            for column in set(data.columns).intersection(self.columns):
+                self._values[column][rows] = data[column].values
+
+    def compact(self, index: pd.Index):
+        """Drops the rows of every simulant not in ``index``."""
+        self._keep_rows(np.isin(self._ids[:self._size], index.values))
+
+    def register_compaction(self, builder, interval: int = COMPACTION_INTERVAL):
+        """Drops the rows of untracked simulants every ``interval`` time steps."""
+        self._tracked = builder.population.get_view(['tracked'])
+        self._compaction_interval = interval
+        builder.event.register_listener('time_step__cleanup', self.on_time_step_cleanup)
+
+    def on_time_step_cleanup(self, event):
+        self._steps_since_compaction += 1
+        if self._steps_since_compaction >= self._compaction_interval:
+            self._steps_since_compaction = 0
+            self._keep_rows(self._tracked.get(self.index).tracked.values.astype(bool))
+
+    def _get_rows(self, index: pd.Index) -> np.ndarray:
+        ids = index.values.astype(np.int64)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        in_range = ids < len(self._rows)
+        rows[in_range] = self._rows[ids[in_range]]
+        return rows
+
+    def _keep_rows(self, keep: np.ndarray):
+        ids = self._ids[:self._size]
+        self._rows[ids[~keep]] = -1
+        kept = np.flatnonzero(keep)
+        size = len(kept)
+        self._ids[:size] = ids[kept]
+        for values in self._values.values():
+            values[:size] = values[kept]
+        self._rows[self._ids[:size]] = np.arange(size)
+        self._size = size
+
+    def _reserve_ids(self, id_count: int):
+        if id_count > len(self._rows):
+            rows = np.full(max(id_count, 2 * len(self._rows)), -1, dtype=np.int64)
+            rows[:len(self._rows)] = self._rows
+            self._rows = rows
+
+    def _reserve_rows(self, row_count: int):
+        capacity = len(self._ids)
+        if row_count > capacity:
+            capacity = max(row_count, 2 * capacity)
+            self._ids = np.resize(self._ids, capacity)
+            self._values = {column: np.resize(values, capacity) for column, values in self._values.items()}
@@ -1,3 +1,7 @@
+import json
+import os
+
+import numpy as np
 import pandas as pd
 
 def profile(f):
@@ -66,4 +70,84 @@ def read_data(path, key, draw):
         index = store.get(f'{key}/index')
         draw = store.get(f'{key}/draw_{draw}')
         draw.rename("value", inplace=True)
-    return pd.concat([index, draw], axis=1)
\ No newline at end of file
+    return pd.concat([index, draw], axis=1)
+
+
+# Memory mapped layout: a directory holding the index once, with its string
+# columns dictionary encoded, and one .npy file of values per draw. Rows are
+# grouped by target so a read only touches the pages of one draw and target.
+NPY_INDEX_FILE = 'index.json'
+TARGET_COLUMNS = ['affected_entity', 'affected_measure']
+
+
+def get_target_order(index):
+    """A stable ordering of the index rows grouping each target's rows together,
+    and the [start, stop) row range of each target in that order."""
+    targets = index[TARGET_COLUMNS].apply(tuple, axis=1)
+    order = np.argsort(pd.Categorical(targets).codes, kind='mergesort')
+    sorted_targets = targets.values[order]
+    ranges = {}
+    for row, target in enumerate(sorted_targets):
+        start, _ = ranges.get(target, (row, row))
+        ranges[target] = (start, row + 1)
+    return order, ranges
+
+
+def write_npy_index(path, index):
+    os.makedirs(path, exist_ok=True)
+    order, ranges = get_target_order(index)
+    index = index.iloc[order].reset_index(drop=True)
+    columns = {}
+    for c in index.columns:
+        if pd.api.types.is_numeric_dtype(index[c]):
+            np.save(os.path.join(path, f'index_{c}.npy'), index[c].values)
+            columns[c] = None
+        else:
+            codes = pd.Categorical(index[c])
+            np.save(os.path.join(path, f'index_{c}.npy'), codes.codes)
+            columns[c] = list(codes.categories)
+    metadata = {'columns': columns,
+                'targets': [[entity, measure, start, stop] for (entity, measure), (start, stop) in ranges.items()]}
+    with open(os.path.join(path, NPY_INDEX_FILE), 'w') as f:
+        json.dump(metadata, f)
+    return order
+
+
+def write_npy_data(path, data):
+    order = write_npy_index(path, data.index.to_frame(index=False))
+    data = data.reset_index(drop=True)
+    for c in data.columns:
+        np.save(os.path.join(path, f'{c}.npy'), data[c].values[order])
+
+
+def convert_hdf_to_npy(hdf_path, key, npy_path):
+    """Rewrites data saved by ``write_data`` in the memory mapped layout, one draw at a time."""
+    with pd.HDFStore(hdf_path, mode='r') as store:
+        order = write_npy_index(npy_path, store.get(f'{key}/index'))
+        for draw_key in [k for k in store.keys() if k.startswith(f'/{key}/draw_')]:
+            draw = store.get(draw_key)
+            np.save(os.path.join(npy_path, f'{draw_key.split("/")[-1]}.npy'), draw.values[order])
+
+
+def read_npy_data(path, draw, affected_entity=None, affected_measure=None, get_file=None):
+    """Reads one draw like ``read_data`` does, only for the given target if there is one.
+
+    ``get_file`` gives the path to read each file in the layout from, by its
+    name, if they aren't all in ``path``.
+    """
+    get_file = get_file if get_file is not None else lambda name: os.path.join(path, name)
+    with open(get_file(NPY_INDEX_FILE)) as f:
+        metadata = json.load(f)
+    rows = slice(None)
+    if affected_entity is not None:
+        rows = [slice(start, stop) for entity, measure, start, stop in metadata['targets']
+                if entity == affected_entity and measure == affected_measure]
+        rows = rows[0] if rows else slice(0, 0)
+
+    data = {}
+    for c, categories in metadata['columns'].items():
+        values = np.load(get_file(f'index_{c}.npy'), mmap_mode='r')[rows]
+        data[c] = np.array(categories, dtype=object)[values] if categories is not None else np.array(values)
+    data = pd.DataFrame(data)
+    data['value'] = np.array(np.load(get_file(f'draw_{draw}.npy'), mmap_mode='r')[rows])
+    return data
@@ -1,7 +1,122 @@
+from typing import Tuple
+
 from vivarium.framework.event import Event
 
+import numpy as np
 import pandas as pd
 
+from .side_table import SimulantSideTable
+
+
+class TreatmentPhaseCache:
+    """Time since treatment start for the treated simulants of an intervention,
+    read from the state table at most once per time step phase and population
+    index and shared by every effect of that intervention.
+
+    Entries are keyed by the clock time and the requested index, matched first
+    by identity and then by value, and are dropped at the start of each time
+    step phase and whenever the treatment algorithm writes treatment starts.
+    ``hits`` and ``misses`` count how often a read was saved.
+    """
+
+    def __init__(self, builder, intervention_name: str, treated: SimulantSideTable):
+        self.treatment_start_column = f'{intervention_name}_treatment_start'
+        self.treated = treated
+        self.clock = builder.time.clock()
+        self.population_view = builder.population.get_view([self.treatment_start_column])
+        self.hits = 0
+        self.misses = 0
+        self._time = None
+        self._entries = {}  # id(index) -> (index, treated index, time since start)
+
+        for event_name in ['time_step__prepare', 'time_step', 'time_step__cleanup', 'collect_metrics']:
+            builder.event.register_listener(event_name, self.on_event, priority=0)
+
+    def on_event(self, event):
+        self.invalidate()
+
+    def invalidate(self):
+        self._entries = {}
+
+    def get_time_since_start(self, index: pd.Index) -> Tuple[pd.Index, np.ndarray]:
+        """The tracked, treated simulants in ``index`` and the integer
+        nanoseconds since each started treatment."""
+        now = self.clock()
+        if now != self._time:
+            self._time = now
+            self.invalidate()
+
+        entry = self._entries.get(id(index))
+        if entry is None:
+            entry = next((e for e in self._entries.values() if e[0].equals(index)), None)
+            if entry is not None:
+                self._entries[id(index)] = (index,) + entry[1:]
+
+        if entry is None:
+            self.misses += 1
+            treated = index[self.treated.contains(index)]
+            if treated.empty:
+                entry = (index, treated, np.empty(0, dtype=np.int64))
+            else:
+                treatment_start = self.population_view.get(treated)[self.treatment_start_column]
+                # Integer nanoseconds so phase boundaries and ramp positions match Timestamp arithmetic exactly.
+                start_ns = treatment_start.values.astype('datetime64[ns]').astype(np.int64)
+                entry = (index, treatment_start.index, now.value - start_ns)
+            self._entries[id(index)] = entry
+        else:
+            self.hits += 1
+        return entry[1], entry[2]
+
+    def __repr__(self):
+        return f'TreatmentPhaseCache({self.treatment_start_column}, hits={self.hits}, misses={self.misses})'
+
+
+class EnrollmentSchedule:
+    """Queue of simulants bucketed by the time step in which they become
+    eligible for enrollment.
+
+    Buckets are numbered by time steps since ``start_time``. Simulants are
+    handed out one step before the step in which they are predicted to become
+    eligible, so rounding in the prediction never makes them late; callers put
+    back those who are not yet eligible with ``reschedule``.
+    """
+
+    def __init__(self, start_time: pd.Timestamp, step_size: pd.Timedelta):
+        self.start_time = start_time
+        self.step_size = step_size
+        self._buckets = {}
+
+    def schedule(self, index: pd.Index, eligible_time: pd.Series):
+        """Queues each simulant in ``index`` for the step before the one whose
+        interval ends at or after its ``eligible_time``."""
+        # The step in which a simulant crosses is the one whose interval ends at
+        # or after the eligible time, and they're handed out a step before that.
+        steps = np.ceil((eligible_time - self.start_time) / self.step_size).values.astype(np.int64) - 2
+        for step in np.unique(steps):
+            self._add(step, index[steps == step])
+
+    def reschedule(self, index: pd.Index, time: pd.Timestamp):
+        """Queues the simulants in ``index`` again for the step after ``time``."""
+        if not index.empty:
+            self._add(self._get_step(time) + 1, index)
+
+    def pop_due(self, time: pd.Timestamp) -> pd.Index:
+        """Removes and returns every simulant queued for the step at ``time``
+        or earlier."""
+        step = self._get_step(time)
+        due = [self._buckets.pop(s) for s in sorted(s for s in self._buckets if s <= step)]
+        return pd.Index(np.concatenate(due) if due else np.empty(0, dtype=np.int64))
+
+    def _get_step(self, time: pd.Timestamp) -> int:
+        return (time - self.start_time) // self.step_size
+
+    def _add(self, step: int, index: pd.Index):
+        ids = index.values.astype(np.int64)
+        self._buckets[step] = np.concatenate([self._buckets[step], ids]) if step in self._buckets else ids
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._buckets.values())
+
 
 class MaternalTreatmentAlgorithm:
     configuration_defaults = {
@@ -38,6 +153,10 @@ class MaternalTreatmentAlgorithm:
         self.population_view = builder.population.get_view(columns_created)
         builder.population.initializes_simulants(self.on_initialize_simulants,
                                                  creates_columns=columns_created)
+        # Simulants ever enrolled, so effects only look at the treated.
+        self.treated = SimulantSideTable({})
+        self.treated.register_compaction(builder)
+        self.phase_cache = TreatmentPhaseCache(builder, self.intervention_name, self.treated)
 
     def on_initialize_simulants(self, pop_data):
         # Check that start date isn't set before sim start
@@ -52,7 +171,9 @@ class MaternalTreatmentAlgorithm:
             # This is really a maternal treatment. To signify the mother was treated, treatment
             # start is initialized to simulant creation time
             pop.loc[treated, f'{self.intervention_name}_treatment_start'] = pop_data.creation_time
+            self.treated.update(treated)
         self.population_view.update(pop)
+        self.phase_cache.invalidate()
 
 
 class NeonatalTreatmentAlgorithm:
@@ -93,6 +214,9 @@ class NeonatalTreatmentAlgorithm:
         self.treatment_duration = pd.Timedelta(days=config['treatment_duration'])
 
         self.clock = builder.time.clock()
+        self.step_size = builder.time.step_size()
+        # Simulants younger than the treatment age, queued for the step they reach it.
+        self.enrollment_schedule = EnrollmentSchedule(self.clock(), self.step_size())
 
         self.enrollment_randomness = builder.randomness.get_stream(f"{self.intervention_name}_enrollment")
 
@@ -105,6 +229,10 @@ class NeonatalTreatmentAlgorithm:
         builder.population.initializes_simulants(self.on_initialize_simulants,
                                                  creates_columns=created_columns,
                                                  requires_columns=required_columns)
+        # Simulants ever enrolled, so effects only look at the treated.
+        self.treated = SimulantSideTable({})
+        self.treated.register_compaction(builder)
+        self.phase_cache = TreatmentPhaseCache(builder, self.intervention_name, self.treated)
 
         builder.event.register_listener('time_step', self.on_time_step)
 
@@ -118,20 +246,40 @@ class NeonatalTreatmentAlgorithm:
                             f'{self.intervention_name}_treatment_end': pd.NaT},
                            index=pop_data.index)
         self.pop_view.update(pop)
+        self.phase_cache.invalidate()
+
+        # Simulants are first aged on the step after they are created, so they
+        # reach the treatment age on the first step starting at or after this.
+        age = self.pop_view.get(pop_data.index).age
+        age = age[age < self.treatment_age['start']]
+        eligible_time = (pop_data.creation_time
+                         + (self.treatment_age['start'] - age) * pd.Timedelta(days=365.25))
+        self.enrollment_schedule.schedule(age.index, eligible_time)
 
     def on_time_step(self, event):
-        pop = self.pop_view.get(event.index, query="alive == 'alive'")
+        # Intervention hasn't started
+        if event.time < self.start_date:
+            return
+
+        if self.clock() < self.start_date:  # Treatment available this time_step
+            pop = self.pop_view.get(event.index, query="alive == 'alive'")
+        else:  # past treatment start, only those scheduled to reach the treatment age
+            due = self.enrollment_schedule.pop_due(self.clock())
+            if due.empty:
+                return
+            pop = self.pop_view.get(due, query="alive == 'alive'")
+            pop_age_at_event = pop.age + (event.step_size / pd.Timedelta(days=365.25))
+            self.enrollment_schedule.reschedule(pop.index[pop_age_at_event < self.treatment_age['start']],
+                                                self.clock())
         treated_idx = self.get_treated_idx(pop, event)
 
         pop.loc[treated_idx, f'{self.intervention_name}_treatment_start'] = event.time
         pop.loc[treated_idx, f'{self.intervention_name}_treatment_end'] = event.time + self.treatment_duration
         self.pop_view.update(pop)
+        self.treated.update(treated_idx)
+        self.phase_cache.invalidate()
 
     def get_treated_idx(self, pop: pd.DataFrame, event: Event):
-        # Intervention hasn't started
-        if event.time < self.start_date:
-            return pd.Index([])
-
         # Eligible by age
         pop_age_at_event = pop.age + (event.step_size / pd.Timedelta(days=365.25))
         if self.clock() < self.start_date:  # Treatment available this time_step
@@ -141,11 +289,13 @@ class NeonatalTreatmentAlgorithm:
             # continuous enrollment of those crossing the age threshold
             eligible_mask = (pop.age < self.treatment_age['start']) & (self.treatment_age['start'] <= pop_age_at_event)
 
-        # Eligible by target
-        if self.whz_target != 'all':
-            eligible_mask &= self.wasting_exposure(pop.index, skip_post_processor=True) <= self.whz_target + 10
-
         # Filter already treated
         eligible_mask &= pd.isnull(pop[f'{self.intervention_name}_treatment_start'])
 
+        # Eligible by target, only evaluating wasting for those otherwise eligible
+        if self.whz_target != 'all' and eligible_mask.any():
+            candidates = pop.index[eligible_mask]
+            eligible_mask[candidates] = (self.wasting_exposure(candidates, skip_post_processor=True)
+                                         <= self.whz_target + 10)
+
         return self.enrollment_randomness.filter_for_probability(pop.loc[eligible_mask].index, self.coverage)
@@ -0,0 +1,63 @@
+"""Data read from outside the artifact, found by logical name.
+
+Each name maps to a path in the ``external_data.sources`` configuration block,
+which defaults to the data's location on ``/share``. If
+``external_data.cache_directory`` is set the data is read from a copy there,
+made once per node by :class:`LocalDataCache`, rather than from ``/share``.
+"""
+import os
+
+from .cache import LocalDataCache, GIGABYTE
+
+DEFAULT_SOURCES = {
+    'lbwsg_relative_risk': '/share/costeffectiveness/artifacts/vivarium_conic_sam_comparison/lbwsg_rr.hdf',
+    # The same data converted with split_index_draw.convert_hdf_to_npy, read in preference if present.
+    'lbwsg_relative_risk_npy': '/share/costeffectiveness/artifacts/vivarium_conic_sam_comparison/lbwsg_rr',
+}
+
+_caches = {}
+
+
+def get_cache(directory: str, max_gigabytes: float) -> LocalDataCache:
+    """The process' cache in ``directory``, made the first time it's asked for."""
+    if (directory, max_gigabytes) not in _caches:
+        _caches[(directory, max_gigabytes)] = LocalDataCache(directory, max_gigabytes * GIGABYTE)
+    return _caches[(directory, max_gigabytes)]
+
+
+def _get_config(configuration):
+    if 'external_data' in configuration:
+        config = configuration.external_data.to_dict()
+        return {**DEFAULT_SOURCES, **config.get('sources', {})}, config.get('cache_directory'), config.get('cache_gigabytes')
+    return dict(DEFAULT_SOURCES), None, None
+
+
+def resolve_path(configuration, path: str) -> str:
+    """``path``, or the path to its cached copy if there's a cache."""
+    _, cache_directory, cache_gigabytes = _get_config(configuration)
+    if cache_directory is None:
+        return path
+    return get_cache(cache_directory, cache_gigabytes).get(path)
+
+
+def has_source(configuration, name: str) -> bool:
+    sources, _, _ = _get_config(configuration)
+    return bool(sources.get(name)) and os.path.exists(sources[name])
+
+
+def get_source(configuration, name: str) -> str:
+    """The configured path of the external data called ``name``."""
+    sources, _, _ = _get_config(configuration)
+    if not sources.get(name):
+        raise ValueError(f'No source is configured for the external data {name}.')
+    return sources[name]
+
+
+def get_source_path(configuration, name: str, file_name: str = None) -> str:
+    """The local path to read the external data called ``name`` from.
+
+    If ``file_name`` is given the source is a directory, and only that file in
+    it is copied to the cache.
+    """
+    source = get_source(configuration, name)
+    return resolve_path(configuration, os.path.join(source, file_name) if file_name else source)
@@ -0,0 +1,54 @@
+import logging
+import os
+
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.dataset_manager import Artifact, ArtifactManager, parse_artifact_path_config
+from vivarium_public_health.dataset_manager.dataset_manager import get_location_term
+
+from . import DEFAULT_SOURCES, resolve_path
+from .sliced_artifact import SlicedArtifact, KEYS_FILE, INDEX_FILE, get_draw_file
+
+_log = logging.getLogger(__name__)
+
+
+class CachedArtifactManager(ArtifactManager):
+    """An artifact manager that reads the artifact from the node-local cache.
+
+    If ``input_data.sliced_artifact_path`` is set it reads the simulation's
+    draw of that sliced artifact instead. It also declares the
+    ``external_data`` configuration used to find the other data the
+    components read from outside the artifact.
+    """
+
+    configuration_defaults = {
+        'input_data': {
+            **ArtifactManager.configuration_defaults['input_data'],
+            # A directory written by slice_artifacts to read in place of the artifact.
+            'sliced_artifact_path': None,
+        },
+        'external_data': {
+            # A node-local directory to copy external data and the artifact into
+            # before reading them. If None they're read where they are.
+            'cache_directory': None,
+            'cache_gigabytes': 50,
+            'sources': DEFAULT_SOURCES,
+        }
+    }
+
+    def _load_artifact(self, configuration: ConfigTree) -> Artifact:
+        if configuration.input_data.sliced_artifact_path:
+            return self._load_sliced_artifact(configuration)
+        artifact_path = resolve_path(configuration, parse_artifact_path_config(configuration))
+        draw = configuration.input_data.input_draw_number
+        location = configuration.input_data.location
+        base_filter_terms = [f'draw == {draw}', get_location_term(location)]
+        _log.debug(f'Running simulation from artifact located at {artifact_path}.')
+        return Artifact(artifact_path, base_filter_terms)
+
+    def _load_sliced_artifact(self, configuration: ConfigTree) -> SlicedArtifact:
+        path = configuration.input_data.sliced_artifact_path
+        draw = configuration.input_data.input_draw_number
+        location = configuration.input_data.location
+        _log.debug(f'Running simulation from draw {draw} of the sliced artifact located at {path}.')
+        return SlicedArtifact(*[resolve_path(configuration, os.path.join(path, f))
+                                for f in [KEYS_FILE, INDEX_FILE, get_draw_file(draw)]], location, draw)
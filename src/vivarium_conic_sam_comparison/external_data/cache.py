@@ -0,0 +1,189 @@
+import fcntl
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Tuple
+
+GIGABYTE = 1024 ** 3
+CHUNK_SIZE = 16 * 1024 * 1024  # bytes
+
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'manifest.lock'
+LOCK_DIRECTORY = 'locks'
+
+
+class LocalDataCache:
+    """Copies of input files or directories kept in a node-local directory.
+
+    Each source is copied into the cache the first time it is asked for and
+    stored under the SHA-256 digest of its name and contents, so sources with
+    the same name and contents share a copy. A manifest records the size and
+    modification time each source had when it was copied, and a source is only
+    read again once those change. When the cache grows past ``max_bytes`` the
+    least recently used copies are deleted, unless they're in use.
+
+    Data read from a copy is opened again from its path on every load, so a
+    cache holds a shared lock on each copy it hands out until it's released or
+    the process ends. Copies anyone holds a lock on are never evicted, and the
+    cache may stay over ``max_bytes`` while they're in use.
+
+    Simulations running side by side on a node share the cache. Each source is
+    copied while holding a lock of its own, so only one of them copies any
+    given source while the others go on with theirs. The manifest is locked
+    only while it's read and updated.
+    """
+
+    def __init__(self, directory: str, max_bytes: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, LOCK_DIRECTORY), exist_ok=True)
+        self._reader_locks = {}
+
+    def get(self, source: str) -> str:
+        """The path to a local copy of ``source``."""
+        source = os.path.abspath(source)
+        with self._locked(get_source_lock_file(source)):
+            stamp = get_stamp(source)
+            with self._locked_manifest() as manifest:
+                entry = manifest['sources'].get(source)
+                if entry is not None and entry['stamp'] == stamp and entry['digest'] in manifest['copies']:
+                    return self._use(manifest, entry['digest'])
+
+            staging, digest, size = self._copy_in(source)
+            try:
+                with self._locked_manifest() as manifest:
+                    # If the same name and contents were already copied for another source that
+                    # copy is kept as it is, since it may be being read.
+                    if digest not in manifest['copies']:
+                        # Anything there is left from a copy whose eviction failed part way.
+                        shutil.rmtree(self._get_path(digest), ignore_errors=True)
+                        os.rename(staging, self._get_path(digest))
+                        manifest['copies'][digest] = {'name': os.path.basename(source), 'bytes': size}
+                    manifest['sources'][source] = {'stamp': stamp, 'digest': digest}
+                    return self._use(manifest, digest)
+            finally:
+                if os.path.exists(staging):
+                    shutil.rmtree(staging)
+
+    def release(self):
+        """Lets the copies handed out so far be evicted."""
+        for lock in self._reader_locks.values():
+            # Closing the lock file releases the lock.
+            lock.close()
+        self._reader_locks = {}
+
+    def _use(self, manifest: Dict, digest: str) -> str:
+        manifest['copies'][digest]['last_used'] = time.time()
+        if digest not in self._reader_locks:
+            # Taken while the manifest is locked, so the copy can't be evicted before it's held.
+            lock = open(os.path.join(self.directory, get_copy_lock_file(digest)), 'w')
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            self._reader_locks[digest] = lock
+        self._evict(manifest)
+        return os.path.join(self._get_path(digest), manifest['copies'][digest]['name'])
+
+    def _copy_in(self, source: str) -> Tuple[str, str, int]:
+        """Copies ``source`` into a staging directory in the cache, hashing it
+        on the way so it's read only once."""
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.staging-')
+        try:
+            name = os.path.basename(source)
+            digest = hashlib.sha256(name.encode())
+            size = 0
+            for relative_path in list_files(source):
+                source_file = os.path.join(source, relative_path) if relative_path else source
+                target_file = os.path.join(staging, name, relative_path) if relative_path else os.path.join(staging, name)
+                os.makedirs(os.path.dirname(target_file), exist_ok=True)
+                digest.update(relative_path.encode())
+                size += copy_and_hash(source_file, target_file, digest)
+            return staging, digest.hexdigest(), size
+        except BaseException:
+            shutil.rmtree(staging)
+            raise
+
+    def _evict(self, manifest: Dict):
+        total = sum(copy['bytes'] for copy in manifest['copies'].values())
+        by_last_use = sorted(manifest['copies'], key=lambda d: manifest['copies'][d].get('last_used', 0))
+        for digest in by_last_use:
+            if total <= self.max_bytes:
+                break
+            lock_path = os.path.join(self.directory, get_copy_lock_file(digest))
+            with open(lock_path, 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # A simulation, maybe this one, has handed the copy out and may open it again.
+                    continue
+                total -= manifest['copies'].pop(digest)['bytes']
+                shutil.rmtree(self._get_path(digest), ignore_errors=True)
+                manifest['sources'] = {source: entry for source, entry in manifest['sources'].items()
+                                       if entry['digest'] != digest}
+                os.remove(lock_path)
+
+    def _get_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    @contextmanager
+    def _locked(self, lock_file: str):
+        with open(os.path.join(self.directory, lock_file), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked_manifest(self):
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        with self._locked(LOCK_FILE):
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+            else:
+                manifest = {'sources': {}, 'copies': {}}
+            yield manifest
+            temporary_path = f'{manifest_path}.{os.getpid()}'
+            with open(temporary_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temporary_path, manifest_path)
+
+
+def get_source_lock_file(source: str) -> str:
+    return os.path.join(LOCK_DIRECTORY, f'{hashlib.sha256(source.encode()).hexdigest()}.lock')
+
+
+def get_copy_lock_file(digest: str) -> str:
+    return os.path.join(LOCK_DIRECTORY, f'{digest}.readers.lock')
+
+
+def list_files(source: str):
+    """Paths of the files under ``source`` relative to it in a fixed order, or
+    just an empty path if it's a file."""
+    if not os.path.isdir(source):
+        return ['']
+    files = []
+    for directory, _, file_names in os.walk(source):
+        files.extend(os.path.relpath(os.path.join(directory, f), source) for f in file_names)
+    return sorted(files)
+
+
+def get_stamp(source: str) -> list:
+    """Number of files, total size and latest modification time of ``source``."""
+    if not os.path.exists(source):
+        raise FileNotFoundError(f'No external data found at {source}.')
+    stats = [os.stat(os.path.join(source, f) if f else source) for f in list_files(source)]
+    return [len(stats), sum(s.st_size for s in stats), max([s.st_mtime for s in stats], default=0)]
+
+
+def copy_and_hash(source_file: str, target_file: str, digest) -> int:
+    size = 0
+    with open(source_file, 'rb') as source, open(target_file, 'wb') as target:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+            size += len(chunk)
+    return size
@@ -0,0 +1,179 @@
+"""Artifacts sliced by draw.
+
+A sliced artifact is a directory holding the data of a built artifact cut down
+to the years and ages a simulation needs. As in ``split_index_draw.write_data``
+the index of each table is written once, to ``index.hdf``, and the values of
+each draw are written to their own ``draw_{n}.hdf``, so a simulation reads only
+its own draw and nothing needs decompressing and selecting at load time.
+"""
+import json
+import os
+from typing import Any, List, Union
+
+import numpy as np
+import pandas as pd
+from vivarium_public_health.dataset_manager import Artifact, ArtifactException, EntityKey
+from vivarium_public_health.dataset_manager import hdf
+from vivarium_public_health.dataset_manager.dataset_manager import get_location_term
+
+KEYS_FILE = 'keys.json'
+INDEX_FILE = 'index.hdf'
+
+YEAR_COLUMNS = ('year_start', 'year_end')
+AGE_COLUMNS = ('age_group_start', 'age_group_end')
+# Used over the whole population, e.g. for crude birth rates, so not cut to the simulation's ages.
+UNFILTERED_KEY_TYPES = ['population', 'metadata']
+
+
+def get_draw_file(draw: int) -> str:
+    return f'draw_{draw}.hdf'
+
+
+def get_draw_columns(data: pd.DataFrame) -> List[str]:
+    return [c for c in data.columns if c.startswith('draw_')]
+
+
+def filter_to_bins(data: pd.DataFrame, columns, start: float, end: float) -> pd.DataFrame:
+    """Rows of ``data`` whose bin in ``columns`` overlaps [start, end)."""
+    bin_start, bin_end = columns
+    names = list(data.index.names) + list(data.columns)
+    if bin_start not in names or bin_end not in names:
+        return data
+    frame = data.index.to_frame(index=False) if bin_start in data.index.names else data.reset_index(drop=True)
+    keep = ((frame[bin_start] < end) & (frame[bin_end] > start)).values
+    return data[keep]
+
+
+def slice_data(entity_key: EntityKey, data: Any, year_start: int, year_end: int,
+               age_start: float, age_end: float) -> Any:
+    if not isinstance(data, pd.DataFrame):
+        return data
+    # The simulation runs to the end of its last year.
+    data = filter_to_bins(data, YEAR_COLUMNS, year_start, year_end + 1)
+    if entity_key.type not in UNFILTERED_KEY_TYPES:
+        data = filter_to_bins(data, AGE_COLUMNS, age_start, age_end)
+    return data
+
+
+def load_table_columns(artifact_path: str, entity_key: EntityKey) -> Union[List[str], None]:
+    """The columns of the table at ``entity_key``, or None if it holds an object."""
+    with pd.HDFStore(artifact_path, mode='r') as store:
+        if entity_key.path not in store.keys():
+            return None
+        return list(store.select(entity_key.path, stop=0).columns)
+
+
+def load_data(artifact_path: str, entity_key: EntityKey, location: str, draws: Union[List[int], None]) -> Any:
+    """The data at ``entity_key`` for ``location``, with only the columns of ``draws`` if they're given."""
+    columns = load_table_columns(artifact_path, entity_key)
+    if columns is not None and draws is not None and get_draw_columns(pd.DataFrame(columns=columns)):
+        draw_columns = [f'draw_{draw}' for draw in draws]
+        missing = set(draw_columns).difference(columns)
+        if missing:
+            raise ValueError(f'{entity_key} in {artifact_path} has no {sorted(missing)}.')
+        # As the artifact does, asking for 'value' too in case the data is long on draws.
+        columns = [c for c in columns if not c.startswith('draw_')] + draw_columns + ['value']
+    else:
+        columns = None
+    return hdf.load(artifact_path, entity_key, [get_location_term(location)], columns)
+
+
+def to_json(value: Any) -> Any:
+    """Numpy scalars and arrays in artifact objects as plain Python values."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} values in artifact objects can\'t be written to {KEYS_FILE}.')
+
+
+def write_sliced_artifact(artifact_path: str, output_path: str, location: str, draws: Union[List[int], None],
+                          year_start: int, year_end: int, age_start: float, age_end: float):
+    """Writes the artifact at ``artifact_path`` as a sliced artifact in ``output_path``.
+
+    Tables are kept to the rows for ``location`` overlapping the years from
+    ``year_start`` through ``year_end`` and the ages from ``age_start`` up to
+    ``age_end``. If ``draws`` is None all draws in the artifact are written.
+    Tables are read and written one at a time, with only the draws asked for.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    keys = {'location': location, 'tables': {}, 'objects': {}}
+    written_draws = None
+    for file_name in os.listdir(output_path):
+        if file_name == INDEX_FILE or (file_name.startswith('draw_') and file_name.endswith('.hdf')):
+            os.remove(os.path.join(output_path, file_name))
+
+    for entity_key in Artifact(artifact_path).keys:
+        data = slice_data(entity_key, load_data(artifact_path, entity_key, location, draws),
+                          year_start, year_end, age_start, age_end)
+        if not isinstance(data, pd.DataFrame):
+            keys['objects'][str(entity_key)] = data
+            continue
+
+        draw_columns = get_draw_columns(data)
+        table_draws = [int(c[len('draw_'):]) for c in draw_columns]
+        if draw_columns and written_draws is not None and set(table_draws) != set(written_draws):
+            raise ValueError(f'{entity_key} in {artifact_path} has different draws than the tables before it.')
+        written_draws = table_draws if draw_columns else written_draws
+
+        index_names = [n for n in data.index.names if n is not None]
+        keys['tables'][str(entity_key)] = {'index': index_names, 'draws': bool(draw_columns)}
+        index = data.drop(columns=draw_columns)
+        index = index.reset_index() if index_names else index
+        with pd.HDFStore(os.path.join(output_path, INDEX_FILE), mode='a', complevel=9) as index_store:
+            index_store.put(entity_key.path, index, format='fixed')
+        for draw, column in zip(table_draws, draw_columns):
+            with pd.HDFStore(os.path.join(output_path, get_draw_file(draw)), mode='a', complevel=9) as draw_store:
+                draw_store.put(entity_key.path, pd.Series(data[column].values), format='fixed')
+
+    keys['draws'] = sorted(written_draws) if written_draws is not None else (draws or [])
+    with open(os.path.join(output_path, KEYS_FILE), 'w') as f:
+        json.dump(keys, f, default=to_json)
+
+
+class SlicedArtifact:
+    """One draw of a sliced artifact, loaded the way an :class:`Artifact`
+    filtered to that draw and the artifact's location would load it."""
+
+    def __init__(self, keys_path: str, index_path: str, draw_path: str, location: str, draw: int):
+        with open(keys_path) as f:
+            keys = json.load(f)
+        if keys['location'] != location:
+            raise ArtifactException(f'The sliced artifact holds data for {keys["location"]}, not {location}.')
+        if draw not in keys['draws']:
+            raise ArtifactException(f'Draw {draw} was not written to the sliced artifact.')
+        self._tables = keys['tables']
+        self._objects = keys['objects']
+        self.index_path = index_path
+        self.draw_path = draw_path
+        self.draw = draw
+        self._cache = {}
+
+    @property
+    def keys(self) -> List[EntityKey]:
+        return [EntityKey(k) for k in list(self._tables) + list(self._objects)]
+
+    def load(self, entity_key: str) -> Any:
+        entity_key = EntityKey(entity_key)
+        key = str(entity_key)
+        if key in self._objects:
+            return self._objects[key]
+        if key not in self._tables:
+            raise ArtifactException(f"{entity_key} should be in the sliced artifact at {self.index_path}.")
+
+        if key not in self._cache:
+            table = self._tables[key]
+            data = pd.read_hdf(self.index_path, entity_key.path)
+            if table['draws']:
+                data[f'draw_{self.draw}'] = np.asarray(pd.read_hdf(self.draw_path, entity_key.path))
+            if 'draw' in data.columns:
+                data = data[data.draw == self.draw]
+            self._cache[key] = data.set_index(table['index']) if table['index'] else data
+        return self._cache[key]
+
+    def clear_cache(self):
+        self._cache = {}
+
+    def __contains__(self, item: str):
+        return str(EntityKey(item)) in self._tables or str(EntityKey(item)) in self._objects
+
+    def __repr__(self):
+        return f"SlicedArtifact(draw={self.draw}, keys={self.keys})"
@@ -0,0 +1,344 @@
+"""Micro-benchmarks for the hot paths of the custom components.
+
+These run on synthetic inputs and need neither an artifact nor a
+simulation, e.g.::
+
+    $> python -m vivarium_conic_sam_comparison.tools.benchmarks
+
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from vivarium_conic_sam_comparison.components import lbwsg
+from vivarium_conic_sam_comparison.components import split_index_draw as sid
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable, COMPACTION_INTERVAL
+from vivarium_conic_sam_comparison.components.metrics import sample_history
+
+SIMULANT_COUNTS = [10_000, 100_000, 1_000_000]
+
+GESTATION_TIME_EDGES = [0, 24, 26, 28, 30, 32, 34, 36, 37, 38, 40, 42]
+BIRTH_WEIGHT_EDGES = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 4500, 5000]
+
+
+def timed(f, *args, **kwargs):
+    start = time.time()
+    out = f(*args, **kwargs)
+    return out, time.time() - start
+
+
+def timed_with_peak_memory(f, *args, **kwargs):
+    """Like ``timed``, also returning the peak traced memory in megabytes."""
+    megabyte = 1024 * 1024
+    tracemalloc.start()
+    mem_start, _ = tracemalloc.get_traced_memory()
+    out, elapsed = timed(f, *args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, (peak - mem_start) / megabyte
+
+
+def make_lbwsg_category_dict():
+    """A full birth weight by gestation time grid of LBWSG category names in the
+    format used by the artifact."""
+    names = [f'Birth prevalence - [{gt_start}, {gt_end}) wks, [{bw_start}, {bw_end}) g'
+             for gt_start, gt_end in zip(GESTATION_TIME_EDGES[:-1], GESTATION_TIME_EDGES[1:])
+             for bw_start, bw_end in zip(BIRTH_WEIGHT_EDGES[:-1], BIRTH_WEIGHT_EDGES[1:])]
+    return {f'cat{i + 1}': name for i, name in enumerate(names)}
+
+
+def legacy_convert_to_continuous(intervals_by_category, categorical_exposure, bw_draw, gt_draw):
+    """The row-wise implementation ``LBWSGDistribution._convert_to_continuous`` used to have."""
+    draws = {'birth_weight': bw_draw, 'gestation_time': gt_draw}
+
+    def single_values_from_category(row):
+        idx = row['index']
+        intervals = intervals_by_category.loc[row['cat']]
+        birth_weight = (intervals.birth_weight.left
+                        + draws['birth_weight'][idx] * (intervals.birth_weight.right - intervals.birth_weight.left))
+        gestational_age = (intervals.gestation_time.left
+                           + draws['gestation_time'][idx] * (intervals.gestation_time.right
+                                                              - intervals.gestation_time.left))
+        return birth_weight, gestational_age
+
+    values = categorical_exposure.reset_index().apply(single_values_from_category, axis=1)
+    return pd.DataFrame(list(values), index=categorical_exposure.index,
+                        columns=['birth_weight', 'gestation_time'])
+
+
+def benchmark_convert_to_continuous(simulant_counts=SIMULANT_COUNTS, max_legacy_count=100_000, seed=12345):
+    """Times sampling of continuous LBWSG exposure from categories and checks the
+    vectorized sampler against the row-wise one draw for draw.
+
+    The row-wise version takes minutes at a million simulants, so it is only
+    run up to ``max_legacy_count``.
+    """
+    categories_by_interval = lbwsg.build_categories_by_interval(make_lbwsg_category_dict())
+    intervals_by_category = categories_by_interval.reset_index().set_index('cat')
+    category_edges = lbwsg.get_category_edges(intervals_by_category)
+    random_state = np.random.RandomState(seed)
+
+    for n in simulant_counts:
+        index = pd.Index(range(n))
+        categorical_exposure = pd.Series(random_state.choice(categories_by_interval.values, n),
+                                         index=index, name='cat')
+        bw_draw = pd.Series(random_state.uniform(size=n), index=index)
+        gt_draw = pd.Series(random_state.uniform(size=n), index=index)
+
+        category_codes = category_edges.index.get_indexer(categorical_exposure)
+        vectorized, vectorized_time = timed(lbwsg.sample_from_category_edges, category_edges,
+                                            category_codes, bw_draw, gt_draw)
+        line = f'convert_to_continuous n={n:>9,}: vectorized {vectorized_time:8.3f}s'
+        if n <= max_legacy_count:
+            legacy, legacy_time = timed(legacy_convert_to_continuous, intervals_by_category,
+                                        categorical_exposure, bw_draw, gt_draw)
+            pd.testing.assert_frame_equal(vectorized, legacy)
+            line += f' | row-wise {legacy_time:8.3f}s | speedup {legacy_time / vectorized_time:8.1f}x'
+        print(line)
+
+
+def make_lbwsg_exposure_data(categories, seed=12345):
+    """Random category exposure for both sexes, the under 5 age groups and the
+    years of the simulation, shaped like pivoted artifact exposure data."""
+    random_state = np.random.RandomState(seed)
+    age_edges = [0, 7 / 365, 28 / 365, 1, 5]
+    groups = pd.DataFrame([(sex, age_start, age_end, year, year + 1)
+                           for sex in ['Female', 'Male']
+                           for age_start, age_end in zip(age_edges[:-1], age_edges[1:])
+                           for year in range(2020, 2026)],
+                          columns=['sex', 'age_group_start', 'age_group_end', 'year_start', 'year_end'])
+    exposure = pd.DataFrame(random_state.dirichlet(np.ones(len(categories)), size=len(groups)), columns=categories)
+    return pd.concat([groups, exposure], axis=1)
+
+
+def legacy_sample_categories(exposure, category_draw):
+    """The simulant by category cumulative sum ``get_birth_weight_and_gestational_age`` used to do."""
+    exposure_sum = exposure.cumsum(axis='columns')
+    return (exposure_sum.T < category_draw).T.sum('columns').values
+
+
+def benchmark_sample_categories(simulant_counts=SIMULANT_COUNTS, seed=12345):
+    """Times picking LBWSG categories from cached per-group cumulative
+    distributions against cumulative sums over a full exposure frame."""
+    categories = lbwsg.build_categories_by_interval(make_lbwsg_category_dict()).values
+    exposure_data = make_lbwsg_exposure_data(categories, seed)
+    exposure_groups, category_cdf = lbwsg.get_category_cdf(exposure_data, categories)
+    flat_category_cdf = lbwsg.flatten_category_cdf(category_cdf)
+    random_state = np.random.RandomState(seed)
+
+    for n in simulant_counts:
+        index = pd.Index(range(n))
+        row = random_state.randint(len(exposure_data), size=n)
+        category_draw = pd.Series(random_state.uniform(size=n), index=index)
+        # What the exposure lookup tables hand back for each simulant.
+        exposure = exposure_data[categories].iloc[row].set_index(index)
+        exposure_group = exposure_groups['exposure_group'].values[row]
+
+        cached, cached_time = timed(lbwsg.sample_categories, flat_category_cdf, exposure_group, category_draw.values,
+                                    len(categories))
+        legacy, legacy_time = timed(legacy_sample_categories, exposure, category_draw)
+        # Draws past a cumulative sum that came to just under 1 take the last category.
+        np.testing.assert_array_equal(cached, np.minimum(legacy, len(categories) - 1))
+        print(f'sample_categories n={n:>9,}: cached cdf {cached_time:8.3f}s | full frame {legacy_time:8.3f}s '
+              f'| speedup {legacy_time / cached_time:8.1f}x')
+
+
+def simulate_side_state(store, initial_population, births_per_step, steps, exit_steps):
+    """Adds an initial population and daily births to per-simulant state with
+    two float columns, reads it back for everyone still tracked each step and
+    lets simulants age out ``exit_steps`` after they enter.
+
+    Returns the time spent in the store itself.
+    """
+    random_state = np.random.RandomState(12345)
+    initial_exit = random_state.randint(0, exit_steps, initial_population)
+    elapsed = 0.
+    for step in range(steps + 1):
+        if step == 0:
+            index = pd.Index(range(initial_population))
+        else:
+            start = initial_population + (step - 1) * births_per_step
+            index = pd.Index(range(start, start + births_per_step))
+        data = pd.DataFrame({'birth_weight': random_state.uniform(0, 5000, len(index)),
+                             'gestation_time': random_state.uniform(0, 42, len(index))}, index=index)
+        born_and_tracked = initial_population + max(0, step - exit_steps) * births_per_step
+        tracked = pd.Index(np.concatenate([np.flatnonzero(initial_exit > step),
+                                           np.arange(born_and_tracked, index[-1] + 1)]))
+
+        start_time = time.time()
+        store.add(data)
+        store.get(tracked)
+        store.step(tracked)
+        elapsed += time.time() - start_time
+    return elapsed
+
+
+class AppendedFrame:
+    """Per-simulant state the way components kept it before the side table."""
+
+    def __init__(self):
+        self.data = pd.DataFrame(columns=['birth_weight', 'gestation_time'])
+
+    def add(self, data):
+        self.data = pd.concat([self.data, data])
+
+    def get(self, index):
+        return self.data.loc[index]
+
+    def step(self, tracked):
+        pass
+
+
+class CompactedSideTable:
+    def __init__(self):
+        self.data = SimulantSideTable({'birth_weight': float, 'gestation_time': float})
+        self.steps = 0
+
+    def add(self, data):
+        self.data.update(data)
+
+    def get(self, index):
+        return self.data.get(index)
+
+    def step(self, tracked):
+        self.steps += 1
+        if self.steps % COMPACTION_INTERVAL == 0:
+            self.data.compact(tracked)
+
+
+def benchmark_side_table(initial_population=100_000, births_per_step=55, steps=2190, exit_steps=1826):
+    """Time and peak memory of keeping per-simulant state over a six year run
+    with daily steps, appending to a frame versus a compacting side table."""
+    for store in [AppendedFrame(), CompactedSideTable()]:
+        elapsed, _, peak = timed_with_peak_memory(simulate_side_state, store, initial_population,
+                                                  births_per_step, steps, exit_steps)
+        print(f'{type(store).__name__:>18}: {elapsed:8.2f}s | peak memory {peak:8.1f} MB '
+              f'| rows held at end {len(store.data):>9,}')
+
+
+LBWSG_TARGETS = ['neonatal_sepsis_and_other_neonatal_infections',
+                 'neonatal_encephalopathy_due_to_birth_asphyxia_and_trauma',
+                 'hemolytic_disease_and_other_neonatal_jaundice',
+                 'diarrheal_diseases',
+                 'lower_respiratory_infections']
+
+
+def make_relative_risk_data(draws, years=range(2010, 2020), seed=12345):
+    """Random LBWSG relative risks indexed like the split relative risk source,
+    with a column per draw."""
+    categories = list(make_lbwsg_category_dict())
+    age_edges = [0, 7 / 365, 28 / 365, 1, 5]
+    index = pd.MultiIndex.from_tuples(
+        [('Global', sex, age_start, age_end, year, year + 1, target, 'excess_mortality', cat)
+         for target in LBWSG_TARGETS
+         for sex in ['Female', 'Male']
+         for age_start, age_end in zip(age_edges[:-1], age_edges[1:])
+         for year in years
+         for cat in categories],
+        names=['location', 'sex', 'age_group_start', 'age_group_end', 'year_start', 'year_end',
+               'affected_entity', 'affected_measure', 'parameter'])
+    random_state = np.random.RandomState(seed)
+    return pd.DataFrame(random_state.uniform(1, 5, size=(len(index), draws)), index=index,
+                        columns=[f'draw_{i}' for i in range(draws)])
+
+
+def read_hdf_relative_risks(path, draw):
+    # Once per LBWSGRiskEffect, as load_relative_risk_data does.
+    for target in LBWSG_TARGETS:
+        data = sid.read_data(path, 'data', draw)
+        yield data[(data.affected_entity == target) & (data.affected_measure == 'excess_mortality')]
+
+
+def read_npy_relative_risks(path, draw):
+    for target in LBWSG_TARGETS:
+        yield sid.read_npy_data(path, draw, target, 'excess_mortality')
+
+
+def benchmark_relative_risk_reads(draws=100, draw=42):
+    """Time to read one draw of relative risks for each LBWSG target from the
+    split HDF source against the memory mapped layout converted from it."""
+    data = make_relative_risk_data(draws)
+    with tempfile.TemporaryDirectory() as directory:
+        hdf_path, npy_path = os.path.join(directory, 'lbwsg_rr.hdf'), os.path.join(directory, 'lbwsg_rr')
+        sid.write_data(hdf_path, 'data', data)
+        sid.convert_hdf_to_npy(hdf_path, 'data', npy_path)
+
+        hdf, hdf_time = timed(list, read_hdf_relative_risks(hdf_path, draw))
+        npy, npy_time = timed(list, read_npy_relative_risks(npy_path, draw))
+        for hdf_target, npy_target in zip(hdf, npy):
+            pd.testing.assert_frame_equal(npy_target, hdf_target.reset_index(drop=True))
+    print(f'relative risk reads {len(LBWSG_TARGETS)} targets, {len(data):,} rows, {draws} draws: '
+          f'hdf {hdf_time:8.3f}s | memory mapped {npy_time:8.3f}s | speedup {hdf_time / npy_time:8.1f}x')
+
+
+SAMPLE_HISTORY_CAUSES = ['not_dead', 'diarrheal_diseases', 'lower_respiratory_infections', 'measles',
+                         'protein_energy_malnutrition', 'other_causes']
+
+
+def make_sample_history_snapshot(simulants, time, start_time, random_state):
+    """One time step of sample history for ``simulants``, with the kinds of
+    columns SampleHistoryObserver records."""
+    n = len(simulants)
+    day = pd.Timedelta(days=1)
+    snapshot = pd.DataFrame({
+        'alive': np.where(random_state.uniform(size=n) < 0.99, 'alive', 'dead'),
+        'age': random_state.uniform(0, 5, n),
+        'sex': np.where(simulants.values % 2, 'Male', 'Female'),
+        'entrance_time': start_time + (simulants.values % 365) * day,
+        'cause_of_death': random_state.choice(SAMPLE_HISTORY_CAUSES, n),
+        'years_of_life_lost': random_state.uniform(0, 80, n),
+        'BEP_treatment_start': pd.Series(start_time + (simulants.values % 500) * day).where(
+            simulants.values % 3 == 0).values,
+        'child_wasting': random_state.choice(['cat1', 'cat2', 'cat3', 'cat4'], n),
+        'child_wasting_raw_exposure': random_state.normal(7, 1, n),
+        'child_stunting_raw_exposure': random_state.normal(7, 1, n),
+        'mortality_rate': random_state.uniform(0, 1, n),
+        'disability_weight': random_state.uniform(0, 0.2, n),
+        'low_birth_weight_and_short_gestation_raw_birth_weight': random_state.uniform(500, 4500, n),
+        'low_birth_weight_and_short_gestation_raw_gestation_time': random_state.uniform(24, 42, n),
+    }, index=simulants)
+    snapshot['time'] = time
+    snapshot.index.name = 'simulant'
+    return snapshot.set_index('time', append=True)
+
+
+def write_sample_history(path, output_format, snapshots, start_time):
+    if output_format == 'hdf':
+        writer = sample_history.SampleHistoryWriter(path)
+    else:
+        writer = sample_history.ColumnarSampleHistoryWriter(path, output_format, start_time)
+    for snapshot in snapshots:
+        writer.append(snapshot)
+    writer.close()
+
+
+def benchmark_sample_history_formats(simulants=10_000, steps=180, seed=12345):
+    """File size, write time and load time of a daily sample history in each
+    output format."""
+    start_time = pd.Timestamp('2020-01-01')
+    random_state = np.random.RandomState(seed)
+    index = pd.Index(range(simulants))
+    snapshots = [make_sample_history_snapshot(index, start_time + pd.Timedelta(days=step), start_time, random_state)
+                 for step in range(steps)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format in sample_history.OUTPUT_EXTENSIONS:
+            path = os.path.join(directory, f'sample_history{sample_history.OUTPUT_EXTENSIONS[output_format]}')
+            _, write_time = timed(write_sample_history, path, output_format, snapshots, start_time)
+            history, read_time = timed(sample_history.read_sample_history, path)
+            assert len(history) == simulants * steps
+            print(f'sample history {output_format:>8}, {simulants * steps:,} rows: '
+                  f'{os.path.getsize(path) / (1024 * 1024):8.1f} MB | write {write_time:8.3f}s '
+                  f'| load {read_time:8.3f}s')
+
+
+if __name__ == '__main__':
+    benchmark_convert_to_continuous()
+    benchmark_sample_categories()
+    benchmark_side_table()
+    benchmark_relative_risk_reads()
+    benchmark_sample_history_formats()
@@ -6,6 +6,8 @@ import click
 from vivarium_gbd_access.gbd import ARTIFACT_FOLDER
 from vivarium_cluster_tools.psimulate.utilities import get_drmaa
 
+from vivarium_conic_sam_comparison.external_data.sliced_artifact import write_sliced_artifact
+
 JOB_MEMORY_NEEDED = 50
 JOB_TIME_NEEDED = '24:00:00'
 
@@ -41,6 +43,29 @@ def pbuild_artifacts(model_spec, project_name, output_root):
         create_and_run_job(p.resolve(), output_root)
 
 
+@click.command()
+@click.argument('artifact', type=click.Path(dir_okay=False, exists=True))
+@click.option('--output-path', '-o', type=click.Path(file_okay=False),
+              help='The directory to write the sliced artifact to. Defaults to the artifact path without its '
+                   'extension.')
+@click.option('--location', '-l', required=True, help='The location the simulations using the artifact run for.')
+@click.option('--draw', '-d', multiple=True, type=int,
+              help='A draw to write. Multiple draws can be given, each with the option switch. Defaults to all.')
+@click.option('--year-start', default=2020, help='The first year of the simulation.')
+@click.option('--year-end', default=2025, help='The last year of the simulation.')
+@click.option('--age-start', default=0., help='The youngest age simulated.')
+@click.option('--age-end', default=5., help='The age simulants leave the simulation.')
+def slice_artifacts(artifact, output_path, location, draw, year_start, year_end, age_start, age_end):
+    """Write ARTIFACT sliced by draw and cut down to the simulated years and
+    ages, for simulations to read with the input_data.sliced_artifact_path
+    option of the CachedArtifactManager data plugin.
+    """
+    artifact = Path(artifact)
+    output_path = output_path if output_path else artifact.with_suffix('')
+    write_sliced_artifact(str(artifact), str(output_path), location, list(draw) if draw else None,
+                          year_start, year_end, age_start, age_end)
+
+
 def validate_locations(locations):
     """Locations in model specifications should be capitalized. There are other
     validations should could be added."""
@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class FakeState:
+    """A state table and the simulation clock."""
+
+    def __init__(self, time, **defaults):
+        self.table = pd.DataFrame({'tracked': pd.Series(dtype=bool)})
+        self.time = time
+        self.defaults = defaults
+
+    def add_simulants(self, count, **columns):
+        index = pd.RangeIndex(len(self.table), len(self.table) + count)
+        new = pd.DataFrame({'tracked': True, **self.defaults, **columns}, index=index)
+        self.table = new if self.table.empty else pd.concat([self.table, new])
+        return index
+
+
+class FakePopulationView:
+
+    def __init__(self, state, columns, query=''):
+        self.state = state
+        self.columns = columns
+        self.query = query
+        self.reads = []
+
+    def subview(self, columns):
+        return FakePopulationView(self.state, columns)
+
+    def get(self, index, query=''):
+        self.reads.append(index)
+        pop = self.state.table
+        if not set(self.columns) <= set(pop.columns):
+            pop = pop.reindex(columns=pop.columns.union(self.columns, sort=False))
+        pop = pop.loc[index]
+        # As in vivarium, views of the tracked column itself see everyone.
+        if 'tracked' not in self.columns:
+            pop = pop[pop.tracked.astype(bool)]
+        for q in [self.query, query]:
+            if q:
+                pop = pop.query(q)
+        return pop[self.columns].copy()
+
+    def update(self, pop):
+        pop = pop.to_frame() if isinstance(pop, pd.Series) else pop
+        for column in pop.columns:
+            if column not in self.state.table:
+                self.state.table[column] = pd.Series(np.nan, index=self.state.table.index, dtype=pop[column].dtype)
+            self.state.table.loc[pop.index, column] = pop[column]
+
+
+class FakeRandomness:
+    """Draws that depend only on the simulant, so the same simulants are chosen
+    however they're grouped when asked."""
+
+    def get_draw(self, index, additional_key=None):
+        return pd.Series(((index.values * 7919) % 10007 + 0.5) / 10007, index=index)
+
+    def filter_for_probability(self, index, probability):
+        return index[self.get_draw(index).values < probability]
+
+    def get_seed(self, additional_key=None):
+        return 12345
+
+
+@pytest.fixture
+def make_state():
+    return FakeState
+
+
+@pytest.fixture
+def make_builder(mocker):
+    """Makes a builder over a fake state, recording the views it hands out and
+    the simulant initializers and event listeners registered with it."""
+
+    def make_builder(state, step_size=None):
+        builder = mocker.MagicMock()
+        builder.views, builder.initializers, builder.listeners = [], [], {}
+
+        def get_view(columns, query=''):
+            builder.views.append(FakePopulationView(state, columns, query))
+            return builder.views[-1]
+
+        builder.time.clock.return_value = lambda: state.time
+        builder.time.step_size.return_value = lambda: step_size
+        builder.randomness.get_stream.return_value = FakeRandomness()
+        builder.population.get_view.side_effect = get_view
+        builder.population.initializes_simulants.side_effect = lambda f, **_: builder.initializers.append(f)
+        builder.event.register_listener.side_effect = lambda name, f, **_: builder.listeners.setdefault(
+            name, []).append(f)
+        return builder
+    return make_builder
+
+
+@pytest.fixture
+def emit():
+    def emit(builder, name, event):
+        for listener in builder.listeners.get(name, []):
+            listener(event)
+    return emit
+
+
+@pytest.fixture
+def initialize():
+    def initialize(builder, index, **pop_data):
+        for initializer in builder.initializers:
+            initializer(SimpleNamespace(index=index, **pop_data))
+    return initialize
+
+
+@pytest.fixture
+def masked_convert_whz_to_categorical():
+    def masked_convert_whz_to_categorical(whz_series):
+        """How WHZ exposure was categorized before it was binned with np.digitize."""
+        whz_categorical = pd.Series('', index=whz_series.index)
+        categories = {
+                'child_stunting_not_eligible': (-np.inf, 0),
+                'child_stunting_cat1': (0, 7),
+                'child_stunting_cat2': (7, 8),
+                'child_stunting_cat3': (8, 9),
+                'child_stunting_cat4': (9, np.inf)
+        }
+        for cat in categories.keys():
+            in_cat_mask = ((categories[cat][0]) < whz_series) & (whz_series <= (categories[cat][1]))
+            whz_categorical.loc[in_cat_mask] = cat
+        assert sum(whz_categorical == '') == 0
+        return whz_categorical
+    return masked_convert_whz_to_categorical
@@ -0,0 +1,101 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.metrics.utilities import get_years_lived_with_disability
+
+from vivarium_conic_sam_comparison.components.metrics.disability import WHZDisabilityObserver
+
+START = pd.Timestamp('2020-11-01')
+STEP = pd.Timedelta(days=10)
+YEAR = pd.Timedelta(days=365.25)
+CAUSES = ['diarrheal_diseases', 'measles']
+AGE_BINS = pd.DataFrame({'age_group_name': ['early_neonatal', 'late_neonatal', 'post_neonatal', '1_to_4'],
+                         'age_group_start': [0., 7 / 365, 28 / 365, 1.],
+                         'age_group_end': [7 / 365, 28 / 365, 1., 5.]})
+
+
+class FakeDisabilityWeight:
+    """A weight for each simulant that changes with the time step."""
+
+    def __init__(self, state, weights):
+        self.state = state
+        self.weights = weights
+
+    def __call__(self, index):
+        return self.weights[index] * (1 + self.state.time.month / 12)
+
+
+@pytest.fixture
+def simulate(mocker, make_state, make_builder, initialize, emit):
+    def simulate(config, steps=40):
+        """The observer's metrics, the final state table, each step's living
+        simulants with their disability weights and everyone's WHZ exposure."""
+        mocker.patch('vivarium_public_health.metrics.disability.get_age_bins', return_value=AGE_BINS)
+        state = make_state(START, alive='alive')
+        random_state = np.random.RandomState(12345)
+        whz = pd.Series(random_state.normal(7, 3, 10_000))
+        weight_state = np.random.RandomState(23)
+        disability_weights = {cause: FakeDisabilityWeight(state, pd.Series(
+            weight_state.uniform(0, 0.2, 10_000) * (weight_state.uniform(size=10_000) < 0.3))) for cause in CAUSES}
+        values = {'child_stunting.exposure': SimpleNamespace(source=lambda index: whz[index]),
+                  **{f'{cause}.disability_weight': weight for cause, weight in disability_weights.items()}}
+
+        builder = make_builder(state, STEP)
+        builder.configuration = ConfigTree({'child_stunting': {'category_thresholds': []}})
+        builder.configuration.update(WHZDisabilityObserver.configuration_defaults)
+        builder.configuration.update({'metrics': {'disability': {**config, 'by_whz': True}}})
+        builder.components.get_components_by_type.return_value = [SimpleNamespace(state_column=c) for c in CAUSES]
+        builder.value.get_value.side_effect = lambda name: values[name]
+        builder.value.register_value_producer.return_value = lambda index: sum(
+            weight(index) for weight in disability_weights.values())
+        observer = WHZDisabilityObserver()
+        observer.setup(builder)
+
+        def add_simulants(count, max_age):
+            initialize(builder, state.add_simulants(count, age=random_state.uniform(0, max_age, count),
+                                                    sex=random_state.choice(['Male', 'Female'], count)))
+
+        add_simulants(600, 5.5)
+        steps_lived = []
+        for _ in range(steps):
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            pop = state.table[state.table.tracked.astype(bool) & (state.table.alive == 'alive')].copy()
+            steps_lived.append((state.time.year, pop, {cause: weight(pop.index)
+                                                       for cause, weight in disability_weights.items()}))
+            emit(builder, 'time_step__prepare', event)
+            alive = state.table.index[state.table.alive == 'alive']
+            state.table.loc[alive[random_state.uniform(size=len(alive)) < 0.02], 'alive'] = 'dead'
+            state.table.loc[random_state.uniform(size=len(state.table)) < 0.005, 'tracked'] = False
+            state.table.loc[state.table.alive == 'alive', 'age'] += STEP / YEAR
+            add_simulants(random_state.poisson(5), 0)
+            state.time = event.time
+        return observer.metrics(state.table.index, {}), state.table, steps_lived, whz
+    return simulate
+
+
+@pytest.mark.parametrize('config', [{'by_age': False, 'by_sex': False, 'by_year': False},
+                                    {'by_age': True, 'by_sex': True, 'by_year': True},
+                                    {'by_age': True, 'by_sex': False, 'by_year': False}])
+def test_whz_ylds_match_group_counts(simulate, masked_convert_whz_to_categorical, config):
+    metrics, table, steps_lived, whz = simulate(config)
+
+    expected = Counter()
+    expected_ylds = pd.Series(0., index=table.index)
+    for year, pop, weights in steps_lived:
+        pipelines = {cause: weight.reindex for cause, weight in weights.items()}
+        whz_categories = masked_convert_whz_to_categorical(whz[pop.index])
+        for cat in whz_categories.unique():
+            ylds = get_years_lived_with_disability(pop[whz_categories == cat], config, year, STEP, AGE_BINS,
+                                                   pipelines, CAUSES)
+            expected.update({key + f'_in_{cat}': value for key, value in ylds.items()})
+        expected_ylds[pop.index] += sum(weights.values())
+    # The view includes the tracked column, so the untracked are summed as well.
+    expected['years_lived_with_disability'] = expected_ylds.sum()
+
+    assert metrics == pytest.approx(dict(expected))
+    pd.testing.assert_series_equal(table.years_lived_with_disability, expected_ylds, check_names=False)
+    assert any(key.startswith('ylds_due_to_measles') and value > 0 for key, value in expected.items())
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+from vivarium.config_tree import ConfigTree
+
+from vivarium_conic_sam_comparison.components.effect import InterventionEffect
+from vivarium_conic_sam_comparison.components.treatment import MaternalTreatmentAlgorithm
+
+START = pd.Timestamp('2019-12-20')
+STEP = pd.Timedelta(days=3)
+LBWSG = 'risk_factor.low_birth_weight_and_short_gestation.exposure'
+WASTING = 'risk_factor.child_wasting.exposure'
+EFFECTS = {
+    'ramped': {'population': {'mean': 200., 'sd': 0.}, 'individual': {'sd': 50.},
+               'ramp_up_duration': 30, 'full_effect_duration': 60, 'ramp_down_duration': 30},
+    'permanent': {'population': {'mean': 0.5, 'sd': 0.}, 'individual': {'sd': 0.},
+                  'ramp_up_duration': 10, 'full_effect_duration': 'permanent', 'ramp_down_duration': 0},
+    'stepped': {'population': {'mean': 1., 'sd': 0.}, 'individual': {'sd': 0.3},
+                'ramp_up_duration': 0, 'full_effect_duration': 28, 'ramp_down_duration': 0},
+}
+
+
+def get_expected_effect(config, draw, time_since_start):
+    """The effect on simulants ``time_since_start`` days into treatment, or NaN
+    days if untreated, with individual effects from ``draw``."""
+    mean, sd = config['population']['mean'], config['individual']['sd']
+    individual = np.maximum(scipy.stats.norm(mean, sd).ppf(draw), 0) if sd else np.full(len(draw), mean)
+
+    ramp_up, ramp_down = config['ramp_up_duration'], config['ramp_down_duration']
+    full_effect_end = np.inf if config['full_effect_duration'] == 'permanent' else (
+        ramp_up + config['full_effect_duration'])
+    with np.errstate(all='ignore'):
+        # A logistic ramp that is within 1/10,000th of the effect at either end.
+        ramp_up_scale = 1 / (1 + 10_000 ** (-2 * (time_since_start - ramp_up / 2) / ramp_up))
+        ramp_down_scale = 1 / (1 + 10_000 ** (-2 * (full_effect_end + ramp_down / 2 - time_since_start) / ramp_down))
+        scale = np.select([time_since_start < 0, time_since_start < ramp_up, time_since_start < full_effect_end,
+                           time_since_start < full_effect_end + ramp_down],
+                          [0., ramp_up_scale, 1., ramp_down_scale], default=0.)
+    return individual * scale
+
+
+@pytest.fixture
+def simulate(make_state, make_builder, emit, initialize):
+    def simulate(effect_config, steps=60):
+        """Each step's exposure from an LBWSG and a wasting effect of a maternal
+        intervention, with who was tracked when it was evaluated."""
+        state = make_state(START)
+        builder = make_builder(state)
+        builder.configuration = ConfigTree({'interventions': {'maternal_intervention': {
+            'coverage_proportion': 0.8, 'start_date': {'year': 2020, 'month': 1, 'day': 1},
+            'effect_on_low_birth_weight_and_short_gestation': effect_config,
+            'effect_on_child_wasting': EFFECTS['permanent'],
+        }}})
+        algorithm = MaternalTreatmentAlgorithm('maternal')
+        builder.components.get_component.return_value = algorithm
+        algorithm.setup(builder)
+        effects = [InterventionEffect('maternal', LBWSG), InterventionEffect('maternal', WASTING)]
+        for effect in effects:
+            effect.setup(builder)
+
+        random_state = np.random.RandomState(12345)
+        initialize(builder, state.add_simulants(200), creation_time=state.time, user_data={'sim_state': 'setup'})
+        records = []
+        for _ in range(steps):
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            emit(builder, 'time_step__prepare', event)
+            index = state.table.index
+            lbwsg = pd.DataFrame({'birth_weight': 3000., 'gestation_time': 39.}, index=index)
+            wasting = pd.Series(7., index=index)
+            records.append((state.time, state.table.tracked.copy(),
+                            effects[0].adjust_exposure(index, lbwsg), effects[1].adjust_exposure(index, wasting)))
+            emit(builder, 'time_step', event)
+            state.table.loc[random_state.uniform(size=len(index)) < 0.01, 'tracked'] = False
+            initialize(builder, state.add_simulants(random_state.poisson(10)), creation_time=event.time,
+                       user_data={'sim_state': 'time_step'})
+            emit(builder, 'time_step__cleanup', event)
+            state.time = event.time
+        return records, state, builder
+    return simulate
+
+
+@pytest.mark.parametrize('effect_config', EFFECTS.values(), ids=list(EFFECTS))
+def test_effect_follows_phases(simulate, effect_config):
+    records, state, builder = simulate(effect_config)
+
+    randomness = builder.randomness.get_stream.return_value
+    treatment_start = state.table.maternal_treatment_start
+    for time, tracked, lbwsg, wasting in records:
+        index = lbwsg.index
+        draw = randomness.get_draw(index).values
+        # The untracked are left as they are.
+        time_since_start = ((time - treatment_start[index]) / pd.Timedelta(days=1)).where(tracked[index]).values
+        np.testing.assert_allclose(lbwsg.birth_weight.values - 3000.,
+                                   get_expected_effect(effect_config, draw, time_since_start), atol=1e-9)
+        np.testing.assert_allclose(wasting.values - 7.,
+                                   get_expected_effect(EFFECTS['permanent'], draw, time_since_start), atol=1e-9)
+        assert (lbwsg.gestation_time == 39.).all()
+    # Simulants on each part of the effect by the end.
+    last_lbwsg = records[-1][2].birth_weight
+    assert (last_lbwsg == 3000.).any() and (last_lbwsg > 3000.).any()
+
+
+def test_effects_share_one_read_per_step(simulate):
+    steps = 60
+    _, _, builder = simulate(EFFECTS['ramped'], steps)
+
+    # Both effects are evaluated with the same index each step, and only the first reads the state table.
+    phase_cache = builder.components.get_component.return_value.phase_cache
+    assert phase_cache.misses == steps
+    assert phase_cache.hits == steps
+    cache_reads = [v for v in builder.views if v.columns == ['maternal_treatment_start']][-1].reads
+    assert 0 < len(cache_reads) <= steps
+
+
+def test_effects_read_only_the_treated(simulate):
+    records, state, builder = simulate(EFFECTS['stepped'])
+
+    treated = set(state.table.index[state.table.maternal_treatment_start.notnull()])
+    cache_reads = [v for v in builder.views if v.columns == ['maternal_treatment_start']][-1].reads
+    assert cache_reads
+    assert all(set(read) <= treated for read in cache_reads)
+    assert len(treated) < len(records[-1][3])
+    # Nobody is treated before the start date and the exposure is left as it was.
+    before_start = (pd.Timestamp('2020-01-01') - START) // STEP
+    assert len(cache_reads) == len(records) - before_start
+    for _, _, lbwsg, wasting in records[:before_start]:
+        assert (lbwsg.birth_weight == 3000.).all() and (wasting == 7.).all()
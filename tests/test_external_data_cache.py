@@ -0,0 +1,158 @@
+import fcntl
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+
+from vivarium_conic_sam_comparison import external_data
+from vivarium_conic_sam_comparison.components import split_index_draw as sid
+
+from vivarium_conic_sam_comparison.external_data import LocalDataCache
+from vivarium_conic_sam_comparison.external_data.cache import LOCK_FILE
+
+
+@pytest.fixture
+def share(tmp_path):
+    """A local directory standing in for /share."""
+    share = tmp_path / 'share'
+    share.mkdir()
+    return share
+
+
+def write(path, contents):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(contents)
+    return str(path)
+
+
+def test_source_copied_once(share, tmp_path, mocker):
+    source = write(share / 'lbwsg_rr.hdf', b'relative risks')
+    cache = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024)
+    copy = mocker.spy(cache, '_copy_in')
+
+    path = cache.get(source)
+    assert cache.get(source) == path
+    assert copy.call_count == 1
+    assert not path.startswith(str(share))
+    assert os.path.basename(path) == 'lbwsg_rr.hdf'
+    with open(path, 'rb') as f:
+        assert f.read() == b'relative risks'
+
+
+def test_directory_source(share, tmp_path):
+    source = share / 'lbwsg_rr'
+    write(source / 'index.json', b'{}')
+    write(source / 'draw_0.npy', b'draw 0')
+
+    path = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024).get(str(source))
+    assert sorted(os.listdir(path)) == ['draw_0.npy', 'index.json']
+
+
+def test_same_contents_shared(share, tmp_path):
+    cache = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024)
+    first = cache.get(write(share / 'a' / 'data.hdf', b'same'))
+    second = cache.get(write(share / 'b' / 'data.hdf', b'same'))
+    assert first == second
+
+
+def test_same_contents_different_names(share, tmp_path):
+    cache = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024)
+    first = cache.get(write(share / 'a.hdf', b'same'))
+    second = cache.get(write(share / 'b.hdf', b'same'))
+
+    assert os.path.basename(first) == 'a.hdf'
+    assert os.path.basename(second) == 'b.hdf'
+    assert os.path.exists(first)
+    assert os.path.exists(second)
+    assert cache.get(str(share / 'a.hdf')) == first
+
+
+def test_changed_source_copied_again(share, tmp_path):
+    source = write(share / 'data.hdf', b'old')
+    cache = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024)
+    old_path = cache.get(source)
+
+    write(share / 'data.hdf', b'new contents')
+    new_path = cache.get(source)
+    assert new_path != old_path
+    with open(new_path, 'rb') as f:
+        assert f.read() == b'new contents'
+
+
+def test_least_recently_used_evicted(share, tmp_path):
+    cache_directory = str(tmp_path / 'cache')
+    sources = [write(share / f'data_{i}.hdf', bytes([i]) * 40) for i in range(3)]
+    cache = LocalDataCache(cache_directory, max_bytes=100)
+
+    first = cache.get(sources[0])
+    second = cache.get(sources[1])
+    cache.get(sources[0])
+    cache.release()
+    # A new cache in the same directory, as in another simulation on the node, sees the same copies.
+    other = LocalDataCache(cache_directory, max_bytes=100)
+    third = other.get(sources[2])
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert os.path.exists(third)
+    assert other.get(sources[0]) == first
+
+
+def test_copy_in_use_not_evicted(share, tmp_path):
+    cache_directory = str(tmp_path / 'cache')
+    sources = [write(share / f'data_{i}.hdf', bytes([i]) * 40) for i in range(3)]
+    reader = LocalDataCache(cache_directory, max_bytes=100)
+    path = reader.get(sources[0])
+
+    # Another simulation on the node fills the cache before the first one reads its data.
+    other = LocalDataCache(cache_directory, max_bytes=100)
+    other.get(sources[1])
+    other.get(sources[2])
+    with open(path, 'rb') as f:
+        assert f.read() == bytes([0]) * 40
+
+    reader.release()
+    other.get(sources[1])
+    assert not os.path.exists(path)
+
+
+def test_missing_source(share, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024).get(str(share / 'missing.hdf'))
+
+
+def test_manifest_not_locked_while_copying(share, tmp_path, mocker):
+    cache = LocalDataCache(str(tmp_path / 'cache'), max_bytes=1024)
+    copy_in = cache._copy_in
+
+    def copy_in_checking_lock(source):
+        # Another simulation on the node can still read and update the manifest.
+        with open(os.path.join(cache.directory, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        return copy_in(source)
+
+    mocker.patch.object(cache, '_copy_in', side_effect=copy_in_checking_lock)
+    cache.get(write(share / 'data.hdf', b'data'))
+
+
+def test_npy_source_cached_per_draw(share, tmp_path):
+    index = pd.MultiIndex.from_product([['diarrheal_diseases'], ['incidence_rate'], ['cat2', 'cat8'], [0., 0.01]],
+                                       names=['affected_entity', 'affected_measure', 'parameter', 'age_group_start'])
+    data = pd.DataFrame(np.random.RandomState(0).uniform(size=(len(index), 3)), index=index,
+                        columns=[f'draw_{i}' for i in range(3)])
+    sid.write_npy_data(str(share / 'lbwsg_rr'), data)
+    configuration = ConfigTree({'external_data': {'cache_directory': str(tmp_path / 'cache'), 'cache_gigabytes': 1,
+                                                  'sources': {'lbwsg_relative_risk_npy': str(share / 'lbwsg_rr')}}})
+
+    result = sid.read_npy_data(
+        None, 1, get_file=lambda f: external_data.get_source_path(configuration, 'lbwsg_relative_risk_npy', f))
+
+    expected = sid.read_npy_data(str(share / 'lbwsg_rr'), 1)
+    pd.testing.assert_frame_equal(result, expected)
+    cached_files = {os.path.basename(f) for f in glob.glob(str(tmp_path / 'cache' / ('?' * 64) / '*'))}
+    assert cached_files == {'index.json', 'index_affected_entity.npy', 'index_affected_measure.npy',
+                            'index_parameter.npy', 'index_age_group_start.npy', 'draw_1.npy'}
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+
+from vivarium_conic_sam_comparison.components import iron_deficiency
+from vivarium_conic_sam_comparison.components.iron_deficiency import IronDeficiencyAnemia
+
+START = pd.Timestamp('2020-01-01')
+STEP = pd.Timedelta(days=10)
+YEAR = pd.Timedelta(days=365.25)
+PHASES = ['time_step__prepare', 'time_step', 'time_step__cleanup', 'collect_metrics']
+
+
+def get_thresholds(state, index):
+    thresholds = iron_deficiency.get_anemia_thresholds()
+    age_group = np.searchsorted(thresholds.age_group_start.values, state.table.loc[index, 'age'].values,
+                                side='right') - 1
+    return thresholds.iloc[age_group].set_index(index)
+
+
+def get_disability_weight_data(state, index):
+    age = state.table.loc[index, 'age'].values
+    return pd.DataFrame({'mild': 0.004 + 0.001 * age, 'moderate': 0.05 + 0.002 * age,
+                         'severe': 0.15 + 0.01 * age}, index=index)
+
+
+def get_expected_weights(state, index):
+    """Disability weights classified from the state table as it is now."""
+    pop = state.table.loc[index]
+    thresholds = get_thresholds(state, index)
+    category = np.select([pop.hemoglobin < thresholds.severe_threshold,
+                          pop.hemoglobin < thresholds.moderate_threshold,
+                          pop.hemoglobin < thresholds.mild_threshold], ['severe', 'moderate', 'mild'], 'unexposed')
+    data = get_disability_weight_data(state, index).assign(unexposed=0.)
+    weights = pd.Series(data.values[np.arange(len(index)), data.columns.get_indexer(category)], index=index)
+    return (weights * (pop.alive == 'alive')).where(pop.tracked.astype(bool)), pd.Series(category, index=index)
+
+
+@pytest.fixture
+def simulate(mocker, make_state, make_builder):
+    def simulate(steps=75):
+        """Each disability weight read with what it should be, and the metrics."""
+        mocker.patch('vivarium_public_health.risks.Risk.setup')
+        mocker.patch.object(iron_deficiency, 'get_iron_deficiency_disability_weight')
+        state = make_state(START, alive='alive')
+        builder = make_builder(state)
+        builder.configuration = ConfigTree({'metrics': {'anemia_observer': {'sample_date': {'month': 7, 'day': 1}}}})
+        builder.lookup.build_table.side_effect = [lambda index: get_thresholds(state, index),
+                                                  lambda index: get_disability_weight_data(state, index)]
+        builder.value.register_value_producer.side_effect = lambda name, source: source
+        component = IronDeficiencyAnemia()
+        component.setup(builder)
+        classified = []
+
+        def exposure(index):
+            classified.append(len(index))
+            return state.table.loc[index, 'hemoglobin']
+        component.exposure = exposure
+        random_state = np.random.RandomState(12345)
+        state.add_simulants(1000, age=random_state.uniform(0, 5, 1000), hemoglobin=random_state.normal(105, 20, 1000))
+
+        weights, counts = [], {}
+        for _ in range(steps):
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            state.table['hemoglobin'] += random_state.normal(0, 5, len(state.table))
+            for phase in PHASES:
+                component.on_event(event)
+                if phase == 'time_step':
+                    # Deaths and simulants aging out before the phase's reads.
+                    state.table.loc[random_state.uniform(size=len(state.table)) < 0.005, 'alive'] = 'dead'
+                    state.table.loc[state.table.age >= 5, 'tracked'] = False
+                del classified[:]
+                subset = event.index[random_state.uniform(size=len(event.index)) < 0.3]
+                for index in [subset, event.index, subset[::-1]]:
+                    weights.append((component.compute_disability_weight(index), get_expected_weights(state, index)[0]))
+                # Each simulant is classified once a phase however often it's read.
+                assert sum(classified) == len(event.index)
+            if component.should_sample(event.time):
+                pop = state.table[(state.table.alive == 'alive') & state.table.tracked.astype(bool)]
+                counts[state.time.year] = get_expected_weights(state, pop.index)[1].value_counts()
+            component.on_collect_metrics(event)
+
+            state.table.loc[state.table.alive == 'alive', 'age'] += STEP / YEAR
+            births = random_state.poisson(5)
+            state.add_simulants(births, age=np.zeros(births), hemoglobin=random_state.normal(105, 20, births))
+            state.time = event.time
+        return weights, component.metrics(None, {}), counts
+    return simulate
+
+
+def test_anemia_memo_matches_classification(simulate):
+    weights, metrics, counts = simulate()
+
+    for result, expected in weights:
+        pd.testing.assert_series_equal(result, expected, check_names=False)
+    assert metrics == {f'anemia_{category}_in_{year}_among_0_to_5': counts[year].get(category, 0)
+                       for year in counts for category in iron_deficiency.ANEMIA_CATEGORIES}
+    assert len(metrics) == 4 * 2
+    # Weights for the dead, the untracked and each anemia category.
+    final = weights[-2][0]
+    assert (final == 0).any() and final.isnull().any() and final.nunique() > 100
@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.utilities import EntityString, TargetString
+
+from vivarium_conic_sam_comparison.components import lbwsg
+from vivarium_conic_sam_comparison.components import split_index_draw as sid
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable
+
+CATEGORIES = [f'cat{i}' for i in range(1, 31)]
+GT_EDGES = [0, 24, 26, 28, 30, 32, 34, 36, 37, 38, 40, 42]
+BW_EDGES = [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 4500, 5000]
+
+
+def make_category_names():
+    """LBWSG category names on an irregular grid, with cells no category covers
+    and one cell left for the category filled in for missing data."""
+    cells = [(gt, bw) for gt in zip(GT_EDGES[:-1], GT_EDGES[1:]) for bw in zip(BW_EDGES[:-1], BW_EDGES[1:])
+             if not (gt[1] <= 34 and bw[0] >= 4000) and not (gt[0] >= 40 and bw[1] <= 1000)
+             and (gt, bw) != ((37, 38), (1000, 1500))]
+    return {f'cat{i + 1}': f'Birth prevalence - [{gt[0]}, {gt[1]}) wks, [{bw[0]}, {bw[1]}) g'
+            for i, (gt, bw) in enumerate(cells)}
+
+
+def get_categories_by_interval():
+    category_names = make_category_names()
+    category_names[lbwsg.MISSING_CATEGORY] = 'Birth prevalence - [37, 38) wks, [1000, 1500) g'
+    return lbwsg.build_categories_by_interval(category_names)
+
+
+def row_wise_convert_to_continuous(intervals_by_category, categorical_exposure, bw_draw, gt_draw):
+    """How continuous exposure was sampled before the category edges were gathered."""
+    draws = {'birth_weight': bw_draw, 'gestation_time': gt_draw}
+
+    def single_values_from_category(row):
+        idx = row['index']
+        intervals = intervals_by_category.loc[row['cat']]
+        birth_weight = (intervals.birth_weight.left
+                        + draws['birth_weight'][idx] * (intervals.birth_weight.right - intervals.birth_weight.left))
+        gestational_age = (intervals.gestation_time.left
+                           + draws['gestation_time'][idx]
+                           * (intervals.gestation_time.right - intervals.gestation_time.left))
+        return birth_weight, gestational_age
+
+    values = categorical_exposure.rename('cat').reset_index().apply(single_values_from_category, axis=1)
+    return pd.DataFrame(list(values), index=categorical_exposure.index, columns=['birth_weight', 'gestation_time'])
+
+
+def test_continuous_exposure_matches_row_wise_sampler():
+    random_state = np.random.RandomState(12345)
+    intervals_by_category = get_categories_by_interval().reset_index().set_index('cat')
+    category_edges = lbwsg.get_category_edges(intervals_by_category)
+    index = pd.Index(random_state.permutation(5000)[:2000])
+    category_codes = random_state.randint(len(category_edges), size=len(index))
+    bw_draw = pd.Series(random_state.uniform(size=len(index)), index=index)
+    gt_draw = pd.Series(random_state.uniform(size=len(index)), index=index)
+
+    expected = row_wise_convert_to_continuous(
+        intervals_by_category, pd.Series(category_edges.index[category_codes], index=index), bw_draw, gt_draw)
+    result = lbwsg.sample_from_category_edges(category_edges, category_codes, bw_draw, gt_draw)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+class IntervalLookupDistribution:
+    """How exposure was classified before the categories were laid out on a grid."""
+
+    def __init__(self, categories_by_interval):
+        self.categories_by_interval = categories_by_interval
+        cats = categories_by_interval.reset_index()
+        self.max_gt_by_bw = pd.Series({bw_interval: pd.Index(group.gestation_time).right.max()
+                                       for bw_interval, group in cats.groupby('birth_weight')})
+        self.max_bw_by_gt = pd.Series({gt_interval: pd.Index(group.birth_weight).right.max()
+                                       for gt_interval, group in cats.groupby('gestation_time')})
+
+    def convert_to_categorical(self, exposure):
+        exposure = self._convert_boundary_cases(exposure)
+        categorical_exposure = self.categories_by_interval.iloc[self._get_categorical_index(exposure)]
+        categorical_exposure.index = exposure.index
+        return categorical_exposure
+
+    def _convert_boundary_cases(self, exposure):
+        eps = 1e-4
+        outside_bounds = self._get_categorical_index(exposure) == -1
+        shift_down = outside_bounds & (
+                (exposure.birth_weight < 1000)
+                | ((1000 < exposure.birth_weight) & (exposure.birth_weight < 4500) & (40 < exposure.gestation_time))
+        )
+        shift_left = outside_bounds & (
+                (1000 < exposure.birth_weight) & (exposure.gestation_time < 34)
+                | (4500 < exposure.birth_weight) & (exposure.gestation_time < 42)
+        )
+        tmrel = outside_bounds & (
+                (4500 < exposure.birth_weight) & (42 < exposure.gestation_time)
+        )
+
+        exposure.loc[shift_down, 'gestation_time'] = (self.max_gt_by_bw
+                                                      .loc[exposure.loc[shift_down, 'birth_weight']]
+                                                      .values) - eps
+        exposure.loc[shift_left, 'birth_weight'] = (self.max_bw_by_gt
+                                                    .loc[exposure.loc[shift_left, 'gestation_time']]
+                                                    .values) - eps
+        exposure.loc[tmrel, 'gestation_time'] = 42 - eps
+        exposure.loc[tmrel, 'birth_weight'] = 4500 - eps
+        return exposure
+
+    def _get_categorical_index(self, exposure):
+        exposure_bw_gt_index = exposure.set_index(['gestation_time', 'birth_weight']).index
+        return self.categories_by_interval.index.get_indexer(exposure_bw_gt_index, method=None)
+
+
+def test_category_grid_matches_interval_lookup():
+    random_state = np.random.RandomState(12345)
+    categories_by_interval = get_categories_by_interval()
+    distribution = object.__new__(lbwsg.LBWSGDistribution)
+    distribution.category_grid = lbwsg.LBWSGCategoryGrid(categories_by_interval)
+
+    edges = np.array([(gt, bw) for gt in GT_EDGES for bw in BW_EDGES])
+    # Off the grid: shifted down, shifted left, to the TMREL, and left off it.
+    off_grid = np.array([[43, 3000], [50, 500], [20, 4700], [30, 4600], [45, 5500], [45, 1000], [42, 4500]])
+    exposure = pd.DataFrame(np.concatenate([np.column_stack([random_state.uniform(0, 42, 20_000),
+                                                             random_state.uniform(0, 5000, 20_000)]),
+                                            edges, off_grid]),
+                            columns=['gestation_time', 'birth_weight'])
+    exposure.index = random_state.permutation(len(exposure))
+
+    original = exposure.copy()
+    expected = IntervalLookupDistribution(categories_by_interval).convert_to_categorical(exposure.copy())
+    result = distribution.convert_to_categorical(exposure, None)
+    pd.testing.assert_frame_equal(exposure, original)
+    pd.testing.assert_series_equal(result.astype(str), expected.astype(str), check_names=False)
+    # Exposure no category covers, before and after shifting.
+    assert (result.iloc[-2:] == categories_by_interval.iloc[-1]).all()
+    assert (distribution.category_grid.category_codes == -1).any()
+
+
+def make_exposure_data(random_state, groups=12):
+    demography = pd.DataFrame({'sex': np.repeat(['Female', 'Male'], groups // 2),
+                               'age_group_start': np.tile(np.arange(groups // 2), 2)})
+    exposure = pd.DataFrame(random_state.dirichlet(np.ones(len(CATEGORIES)), size=groups), columns=CATEGORIES)
+    # Repeated exposure vectors share a group.
+    exposure.iloc[1] = exposure.iloc[0]
+    return pd.concat([demography, exposure], axis=1)
+
+
+def per_row_sample_categories(exposure, category_draw):
+    """How categories were sampled before the cumulative distributions were cached."""
+    exposure_sum = exposure.cumsum(axis='columns')
+    return (exposure_sum.T < category_draw).T.sum(axis='columns').values
+
+
+@pytest.mark.parametrize('n', [0, 1, 10_000])
+def test_sample_categories_matches_per_row_sampler(n):
+    random_state = np.random.RandomState(12345)
+    exposure_data = make_exposure_data(random_state)
+    exposure_groups, category_cdf = lbwsg.get_category_cdf(exposure_data, CATEGORIES)
+    row = random_state.randint(len(exposure_data), size=n)
+    draw = random_state.uniform(size=n)
+    # Draws on a cumulative exposure and the largest draw there is.
+    draw[:n // 10] = category_cdf[exposure_groups['exposure_group'].values[row[:n // 10]], 5]
+    draw[n // 10:n // 5] = np.nextafter(1., 0.)
+
+    index = pd.Index(range(n))
+    expected = per_row_sample_categories(exposure_data[CATEGORIES].iloc[row].set_index(index),
+                                         pd.Series(draw, index=index))
+    # Draws past a cumulative sum that came to just under 1 now take the last category.
+    assert (expected == len(CATEGORIES)).any() or n < 10
+    expected = np.minimum(expected, len(CATEGORIES) - 1)
+    result = lbwsg.sample_categories(lbwsg.flatten_category_cdf(category_cdf),
+                                     exposure_groups['exposure_group'].values[row], draw, len(CATEGORIES))
+    np.testing.assert_array_equal(result, expected)
+    assert len(exposure_groups.exposure_group.unique()) == len(exposure_data) - 1
+
+
+class FakeExposureDistribution:
+
+    def get_category_codes(self, exposure):
+        return (exposure.birth_weight.values // 500).astype(int)
+
+
+def make_frozen_risk(raw_exposure):
+    risk = lbwsg.LBWSGRisk()
+    risk.freeze_categories = True
+    risk.exposure_distribution = FakeExposureDistribution()
+    risk._raw_exposure = lambda index: raw_exposure.loc[index]
+    risk._cached_exposure = SimulantSideTable({'birth_weight': float, 'gestation_time': float})
+    risk._category_codes = SimulantSideTable({'category_code': np.int64})
+    return risk
+
+
+def test_frozen_category_codes_for_every_simulant():
+    raw_exposure = pd.DataFrame({'birth_weight': np.arange(10) * 450., 'gestation_time': 38.})
+    risk = make_frozen_risk(raw_exposure)
+    # Exposure cached for simulants without a frozen category, and a frozen category kept as it is.
+    risk._cached_exposure.update(raw_exposure.loc[[1, 2, 3]])
+    risk._category_codes.update(pd.Series([0], index=pd.Index([2])))
+
+    index = pd.Index([8, 3, 2, 1, 0])
+    category_codes = risk.get_category_codes(index)
+    assert category_codes.dtype == np.int64
+    np.testing.assert_array_equal(category_codes, [7, 2, 0, 0, 0])
+    np.testing.assert_array_equal(np.arange(10)[category_codes], category_codes)
+
+
+RISK = EntityString('risk_factor.low_birth_weight_and_short_gestation')
+TARGETS = [TargetString('cause.diarrheal_diseases.incidence_rate'),
+           TargetString('cause.diarrheal_diseases.excess_mortality'),
+           TargetString('cause.lower_respiratory_infections.incidence_rate')]
+
+
+def make_target_data(random_state, draws=3):
+    index = pd.MultiIndex.from_product([['Male', 'Female'], [0., 0.01, 0.08],
+                                        ['diarrheal_diseases', 'lower_respiratory_infections'],
+                                        ['incidence_rate', 'excess_mortality'], CATEGORIES[:4]],
+                                       names=['sex', 'age_group_start', 'affected_entity', 'affected_measure',
+                                              'parameter'])
+    data = pd.DataFrame(random_state.uniform(1, 5, size=(len(index), draws)), index=index,
+                        columns=[f'draw_{i}' for i in range(draws)])
+    return data.iloc[random_state.permutation(len(data))]
+
+
+def select_target(data, target):
+    """How each target's data was selected before it was read once for all of them."""
+    correct_target = ((data['affected_entity'] == target.name) & (data['affected_measure'] == target.measure))
+    return data[correct_target].drop(columns=['affected_entity', 'affected_measure']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('layout', ['hdf', 'npy'])
+def test_relative_risk_read_once_for_all_targets(mocker, tmp_path, layout):
+    mocker.patch.dict(lbwsg._relative_risk_by_target, clear=True)
+    hdf_path = str(tmp_path / 'lbwsg_rr.hdf')
+    sid.write_data(hdf_path, 'data', make_target_data(np.random.RandomState(12345)))
+    sources = {'lbwsg_relative_risk': hdf_path, 'lbwsg_relative_risk_npy': ''}
+    if layout == 'npy':
+        sources['lbwsg_relative_risk_npy'] = str(tmp_path / 'lbwsg_rr')
+        sid.convert_hdf_to_npy(hdf_path, 'data', sources['lbwsg_relative_risk_npy'])
+    builder = mocker.MagicMock()
+    builder.configuration = ConfigTree({'input_data': {'input_draw_number': 2},
+                                        'external_data': {'cache_directory': None, 'sources': sources}})
+    reads = [mocker.spy(sid, 'read_data'), mocker.spy(sid, 'read_npy_data')]
+
+    all_targets = sid.read_data(hdf_path, 'data', 2)
+    for target in TARGETS + TARGETS:
+        result = lbwsg.load_relative_risk_data(builder, RISK, target, 'data', None)
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), select_target(all_targets, target))
+        # Changing what's handed out doesn't change the data the next target gets.
+        result['value'] = 0.
+    assert sum(read.call_count for read in reads) == 2  # the one above and the memoized read
+
+    with pytest.raises(ValueError):
+        lbwsg.load_relative_risk_data(builder, RISK, TargetString('cause.measles.incidence_rate'), 'data', None)
+
+
+def test_population_attributable_fraction_loaded_once_per_draw(mocker):
+    mocker.patch.dict(lbwsg._population_attributable_fraction_by_target, clear=True)
+    mocker.patch.object(lbwsg, 'validate_relative_risk_data_source', return_value='data')
+    random_state = np.random.RandomState(12345)
+    paf_data = {draw: make_target_data(random_state, draws=1).reset_index().rename(columns={'draw_0': 'value'})
+                for draw in [0, 1]}
+    builder = mocker.MagicMock()
+    builder.configuration = ConfigTree({RISK.name: {'exposure': 'data'},
+                                        'input_data': {'input_draw_number': 0, 'artifact_path': 'artifact.hdf',
+                                                       'sliced_artifact_path': None}})
+    builder.data.load.side_effect = lambda key: paf_data[builder.configuration.input_data.input_draw_number].copy()
+
+    for draw in [0, 1]:
+        builder.configuration.update({'input_data': {'input_draw_number': draw}})
+        for target in TARGETS:
+            result = lbwsg.get_population_attributable_fraction_data(builder, RISK, target, None)
+            pd.testing.assert_frame_equal(result.reset_index(drop=True), select_target(paf_data[draw], target))
+    assert builder.data.load.call_count == 2
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vivarium_conic_sam_comparison.components.metrics import utilities
+
+
+def test_whz_categories_match_masks(masked_convert_whz_to_categorical):
+    random_state = np.random.RandomState(12345)
+    # Exposure on each category edge as well as between them.
+    whz = np.concatenate([random_state.normal(7, 3, 10_000), [-1., 0., 7., 8., 9., 20.]])
+    whz_series = pd.Series(whz, index=random_state.permutation(len(whz)))
+
+    expected = masked_convert_whz_to_categorical(whz_series)
+    result = utilities.convert_whz_to_categorical(whz_series)
+    pd.testing.assert_series_equal(result.astype(str), expected)
+    assert list(result.cat.categories) == utilities.get_whz_categories()
+
+
+def test_whz_categories_with_missing_exposure():
+    with pytest.raises(ValueError):
+        utilities.get_whz_category_codes(pd.Series([7., np.nan]))
@@ -0,0 +1,117 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.metrics.utilities import (QueryString, get_output_template, get_group_counts,
+                                                      get_deaths, get_years_of_life_lost)
+
+from vivarium_conic_sam_comparison.components.metrics.mortality import WHZMortalityObserver
+
+START = pd.Timestamp('2020-11-01')
+STEP = pd.Timedelta(days=10)
+YEAR = pd.Timedelta(days=365.25)
+CAUSES = ['diarrheal_diseases', 'measles']
+AGE_BINS = pd.DataFrame({'age_group_name': ['early_neonatal', 'late_neonatal', 'post_neonatal', '1_to_4'],
+                         'age_group_start': [0., 7 / 365, 28 / 365, 1.],
+                         'age_group_end': [7 / 365, 28 / 365, 1., 5.]})
+
+
+def life_expectancy(pop):
+    return 80. - pop.age
+
+
+@pytest.fixture
+def simulate(mocker, make_state, make_builder, emit, initialize):
+    def simulate(config, steps=50):
+        """The observer's metrics, with the simulants alive at the start of each
+        step, the final state table and the WHZ exposure of each simulant."""
+        mocker.patch('vivarium_public_health.metrics.mortality.get_age_bins', return_value=AGE_BINS)
+        state = make_state(START, alive='alive', exit_time=pd.NaT, cause_of_death='not_dead', years_of_life_lost=0.)
+        random_state = np.random.RandomState(12345)
+        # Each simulant keeps their WHZ exposure, so its category at death is the one it always had.
+        whz = pd.Series(random_state.normal(7, 3, 10_000))
+        builder = make_builder(state, STEP)
+        builder.configuration = ConfigTree({'time': {'step_size': STEP.days},
+                                            'child_wasting': {'category_thresholds': []}})
+        builder.configuration.update(WHZMortalityObserver.configuration_defaults)
+        builder.configuration.update({'metrics': {'mortality': {**config, 'by_whz': True}}})
+        builder.components.get_components_by_type.return_value = [SimpleNamespace(state_column=c) for c in CAUSES]
+        builder.lookup.build_table.return_value = lambda index: life_expectancy(state.table.loc[index])
+        builder.value.get_value.return_value.source = lambda index: whz[index]
+        observer = WHZMortalityObserver()
+        observer.setup(builder)
+
+        def add_simulants(count, max_age):
+            initialize(builder, state.add_simulants(count, entrance_time=state.time,
+                                                    age=random_state.uniform(0, max_age, count),
+                                                    sex=random_state.choice(['Male', 'Female'], count)))
+
+        add_simulants(1000, 5.5)
+        snapshots = []
+        for _ in range(steps):
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            snapshots.append((state.time.year, state.table[state.table.tracked.astype(bool)].copy()))
+            emit(builder, 'time_step__prepare', event)
+
+            alive = state.table.index[state.table.alive == 'alive']
+            died = alive[random_state.uniform(size=len(alive)) < 0.02]
+            emit(builder, 'deaths', SimpleNamespace(index=died, time=event.time))
+            # As the mortality component does, the state table is updated after the deaths event.
+            state.table.loc[died, 'alive'] = 'dead'
+            state.table.loc[died, 'exit_time'] = event.time
+            state.table.loc[died, 'cause_of_death'] = random_state.choice(CAUSES + ['other_causes'], len(died))
+            state.table.loc[died, 'years_of_life_lost'] = life_expectancy(state.table.loc[died])
+            alive = state.table.alive == 'alive'
+            state.table.loc[alive, 'age'] += STEP / YEAR
+            emit(builder, 'time_step__cleanup', event)
+
+            add_simulants(random_state.poisson(5), 0)
+            state.time = event.time
+        return observer.metrics(state.table.index, {}), snapshots, state.table, whz
+    return simulate
+
+
+CONFIGS = [{'by_age': False, 'by_sex': False, 'by_year': False},
+           {'by_age': True, 'by_sex': True, 'by_year': True},
+           {'by_age': True, 'by_sex': False, 'by_year': False}]
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+def test_person_time_matches_group_counts(simulate, masked_convert_whz_to_categorical, config):
+    metrics, snapshots, _, whz = simulate(config)
+
+    expected = Counter()
+    for year, pop in snapshots:
+        whz_categories = masked_convert_whz_to_categorical(whz[pop.index])
+        base_key = get_output_template(**config).substitute(measure='person_time', year=year)
+        for cat in whz_categories.unique():
+            counts = get_group_counts(pop[whz_categories == cat], QueryString('alive == "alive"'), base_key,
+                                      config, AGE_BINS)
+            expected.update({f'{key}_in_{cat}': value * STEP.days / 365.25 for key, value in counts.items()})
+    result = {key: value for key, value in metrics.items() if key.startswith('person_time')}
+    assert result == pytest.approx(dict(expected))
+    assert sum(expected.values()) > 0
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+def test_deaths_and_ylls_match_recount(simulate, masked_convert_whz_to_categorical, config):
+    metrics, _, table, whz = simulate(config)
+
+    pop = table[table.tracked.astype(bool)]
+    end = START + 50 * STEP
+    expected = {'years_of_life_lost': life_expectancy(pop[pop.alive == 'dead']).sum(),
+                'total_population_living': (pop.alive == 'alive').sum()}
+    whz_categories = masked_convert_whz_to_categorical(whz[pop.index])
+    for cat in whz_categories.unique():
+        pop_for_cat = pop[whz_categories == cat]
+        deaths = get_deaths(pop_for_cat, config, START, end, AGE_BINS, CAUSES + ['other_causes'])
+        ylls = get_years_of_life_lost(pop_for_cat, config, START, end, AGE_BINS,
+                                      lambda index: life_expectancy(pop.loc[index]), CAUSES + ['other_causes'])
+        expected.update({key + f'_in_{cat}': value for key, value in {**deaths, **ylls}.items()})
+    result = {key: value for key, value in metrics.items() if not key.startswith('person_time')}
+    assert result == pytest.approx(expected)
+    assert any(key.startswith('death_due_to_measles') and value > 0 for key, value in expected.items())
+    assert any(key.startswith('ylls_due_to_other_causes') and value > 0 for key, value in expected.items())
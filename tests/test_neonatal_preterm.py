@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from vivarium_conic_sam_comparison.components.neonatal_preterm import NeonatalPreterm
+
+START = pd.Timestamp('2020-01-01')
+STEP = pd.Timedelta(days=1)
+
+
+class FakeExposure:
+    """Fixed gestation times with a birth weight that moves on every call, like
+    an intervention effect on the raw exposure would."""
+
+    def __init__(self, gestation_time):
+        self.gestation_time = gestation_time
+        self.calls = 0
+
+    def __call__(self, index, skip_post_processor=False):
+        self.calls += 1
+        return pd.DataFrame({'birth_weight': 2500. + self.calls,
+                             'gestation_time': self.gestation_time[index]}, index=index)
+
+
+@pytest.fixture
+def make_preterm_builder(make_builder):
+    def make_preterm_builder(state, exposure):
+        builder = make_builder(state, STEP)
+        builder.configuration = {'neonatal_preterm_birth': SimpleNamespace(recoverable=True, mortality=False,
+                                                                           threshold=None)}
+        builder.value.get_value.return_value = exposure
+        return builder
+    return make_preterm_builder
+
+
+@pytest.fixture
+def simulate(make_state, make_preterm_builder, emit, initialize):
+    def simulate(gestation_time, steps=20, births_per_step=5):
+        """The final state table, when each simulant was created and how
+        often the exposure was evaluated."""
+        state = make_state(START, alive='alive')
+        exposure = FakeExposure(gestation_time)
+        builder = make_preterm_builder(state, exposure)
+        NeonatalPreterm().setup(builder)
+        initialize(builder, state.add_simulants(100, created=state.time))
+
+        random_state = np.random.RandomState(12345)
+        for _ in range(steps):
+            state.time += STEP
+            dying = random_state.uniform(size=len(state.table)) < 0.05
+            state.table.loc[dying, 'alive'] = 'dead'
+            state.table.loc[random_state.uniform(size=len(state.table)) < 0.02, 'tracked'] = False
+            emit(builder, 'time_step', SimpleNamespace(index=state.table.index, time=state.time))
+            initialize(builder, state.add_simulants(births_per_step, created=state.time))
+        return state.table, exposure.calls
+    return simulate
+
+
+def test_preterm_state_set_once_from_gestation_time(simulate):
+    gestation_time = pd.Series(np.random.RandomState(0).uniform(24, 42, 1000))
+    table, evaluations = simulate(gestation_time)
+
+    # Whether born preterm never changes, whoever dies or leaves.
+    preterm = gestation_time[table.index] <= 38
+    assert (table['neonatal_preterm_birth'] == np.where(preterm, 'neonatal_preterm_birth',
+                                                        'susceptible_to_neonatal_preterm_birth')).all()
+    pd.testing.assert_series_equal(table['neonatal_preterm_birth_event_time'],
+                                   table.created.where(preterm).astype('datetime64[ns]'), check_names=False)
+    assert table['susceptible_to_neonatal_preterm_birth_event_time'].isnull().all()
+    assert preterm.any() and not preterm.all()
+    # Once at the start and once for each birth cohort.
+    assert evaluations == 21
+
+
+@pytest.mark.parametrize('gestation_time, preterm', [(37.99, True), (38, True), (38.01, False)])
+def test_preterm_threshold(make_state, make_preterm_builder, gestation_time, preterm):
+    state = make_state(START, alive='alive')
+    component = NeonatalPreterm()
+    component.setup(make_preterm_builder(state, FakeExposure(pd.Series([gestation_time]))))
+    index = state.add_simulants(1)
+    component.on_initialize_simulants(SimpleNamespace(index=index))
+
+    assert component.filter_by_exposure(index).tolist() == [preterm]
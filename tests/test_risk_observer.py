@@ -0,0 +1,85 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.metrics.utilities import QueryString, get_group_counts, get_output_template
+
+from vivarium_conic_sam_comparison.components.metrics.risk import CatStratRiskObserver
+
+YEAR = pd.Timedelta(days=365.25)
+CATEGORIES = ['cat1', 'cat2', 'cat3', 'cat4']
+AGE_BINS = pd.DataFrame({'age_group_name': ['early_neonatal', 'late_neonatal', 'post_neonatal', '1_to_4'],
+                         'age_group_start': [0., 7 / 365, 28 / 365, 1.],
+                         'age_group_end': [7 / 365, 28 / 365, 1., 5.]})
+
+
+class FakeExposure:
+    """A category for each simulant that moves on every month."""
+
+    def __init__(self, state):
+        self.state = state
+        self.categories = np.array(CATEGORIES)[np.random.RandomState(7).randint(len(CATEGORIES), size=100_000)]
+
+    def __call__(self, index):
+        return pd.Series(self.categories[index.values + self.state.time.month], index=index)
+
+
+@pytest.fixture
+def simulate(mocker, make_state, make_builder, emit):
+    def simulate(config, start, step, days=800):
+        """The observer's metrics and the living simulants with their exposure
+        on each step that ends past a sample date."""
+        mocker.patch('vivarium_conic_sam_comparison.components.metrics.risk.get_age_bins', return_value=AGE_BINS)
+        state = make_state(start, alive='alive')
+        builder = make_builder(state, step)
+        builder.configuration = ConfigTree(CatStratRiskObserver('risk_factor.child_wasting').configuration_defaults)
+        builder.configuration.update({'metrics': {'child_wasting_observer': config}})
+        exposure = FakeExposure(state)
+        builder.value.get_value.return_value = exposure
+        observer = CatStratRiskObserver('risk_factor.child_wasting')
+        observer.setup(builder)
+        sample_date = builder.configuration.metrics.child_wasting_observer.sample_date
+        random_state = np.random.RandomState(12345)
+        state.add_simulants(500, age=random_state.uniform(0, 5.5, 500),
+                            sex=random_state.choice(['Male', 'Female'], 500))
+
+        samples = []
+        for _ in range(days // step.days):
+            event = SimpleNamespace(index=state.table.index, time=state.time + step, step_size=step)
+            if state.time <= pd.Timestamp(event.time.year, sample_date.month, sample_date.day) < event.time:
+                pop = state.table[state.table.tracked.astype(bool)]
+                samples.append((state.time.year, pop.copy(), exposure(pop.index)))
+            emit(builder, 'collect_metrics', event)
+            alive = state.table.index[state.table.alive == 'alive']
+            state.table.loc[alive[random_state.uniform(size=len(alive)) < 0.01], 'alive'] = 'dead'
+            state.table.loc[state.table.alive == 'alive', 'age'] += step / YEAR
+            births = random_state.poisson(step.days / 2)
+            state.add_simulants(births, age=np.zeros(births), sex=random_state.choice(['Male', 'Female'], births))
+            state.time = event.time
+        return observer.metrics(state.table.index, {}), samples
+    return simulate
+
+
+@pytest.mark.parametrize('config', [{'by_age': False, 'by_sex': False, 'by_year': False},
+                                    {'by_age': True, 'by_sex': True, 'by_year': True},
+                                    {'by_age': False, 'by_sex': True, 'by_year': False,
+                                     'sample_date': {'month': 12, 'day': 15}}])
+@pytest.mark.parametrize('start, step', [(pd.Timestamp('2020-06-25'), pd.Timedelta(days=1)),
+                                         (pd.Timestamp('2020-01-01'), pd.Timedelta(days=7)),
+                                         (pd.Timestamp('2020-07-01'), pd.Timedelta(days=30))])
+def test_category_counts_match_group_counts(simulate, config, start, step):
+    metrics, samples = simulate(config, start, step)
+
+    config = {'by_age': False, 'by_sex': False, 'by_year': False, **config}
+    expected = Counter()
+    for year, pop, exposure in samples:
+        for cat in CATEGORIES:
+            base_key = get_output_template(**config).substitute(measure=f'child_wasting_{cat}_exposed', year=year)
+            counts = get_group_counts(pop, QueryString('alive == "alive"'), base_key, config, AGE_BINS,
+                                      aggregate=lambda in_group: (exposure[in_group.index] == cat).sum())
+            expected.update({str(key): count for key, count in counts.items()})
+    assert metrics == dict(expected)
+    assert len(samples) >= 2 and sum(expected.values()) > 0
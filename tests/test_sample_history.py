@@ -0,0 +1,305 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+
+from vivarium_conic_sam_comparison.components.metrics.sample_history import (LBWSG_RAW_EXPOSURE, SAMPLED_PIPELINES,
+                                                                              ColumnarSampleHistoryWriter,
+                                                                              SampleHistoryObserver,
+                                                                              densify_sample_history,
+                                                                              get_output_path,
+                                                                              read_sample_history)
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable
+
+START = pd.Timestamp('2020-01-01')
+STEP = pd.Timedelta(days=3)
+END = START + 60 * STEP
+YEAR = pd.Timedelta(days=365.25)
+COLUMNS = ['alive', 'age', 'sex', 'entrance_time', 'exit_time', 'cause_of_death', 'years_of_life_lost',
+           'BEP_treatment_start', 'SQ_LNS_treatment_start', 'TF_SAM_treatment_start',
+           'neonatal_preterm_birth_event_time', 'diarrheal_diseases_event_time',
+           'lower_respiratory_infections_event_time', 'measles_event_time',
+           'neonatal_sepsis_and_other_neonatal_infections_event_time',
+           'neonatal_encephalopathy_due_to_birth_asphyxia_and_trauma_event_time',
+           'hemolytic_disease_and_other_neonatal_jaundice_event_time']
+
+
+def make_snapshot(time, simulants=20):
+    index = pd.MultiIndex.from_arrays([np.arange(simulants), np.full(simulants, time)], names=['simulant', 'time'])
+    return pd.DataFrame({'alive': np.where(np.arange(simulants) % 5, 'alive', 'dead'),
+                         'age': np.linspace(0, 5, simulants),
+                         'BEP_treatment_start': pd.Series(START, index=index).where(np.arange(simulants) % 2 == 0)},
+                        index=index)
+
+
+@pytest.mark.parametrize('path, output_format, expected', [('out/sample_history.hdf', 'hdf', 'out/sample_history.hdf'),
+                                                           ('out/sample_history.hdf', 'parquet',
+                                                            'out/sample_history.parquet'),
+                                                           ('out/sample_history', 'feather',
+                                                            'out/sample_history.feather')])
+def test_output_path_follows_format(path, output_format, expected):
+    assert get_output_path(path, output_format) == expected
+
+
+def test_unknown_output_format():
+    with pytest.raises(ValueError):
+        get_output_path('sample_history.hdf', 'csv')
+
+
+def test_columnar_writer_rejects_mismatched_extension(tmp_path):
+    with pytest.raises(ValueError):
+        ColumnarSampleHistoryWriter(str(tmp_path / 'sample_history.hdf'), 'parquet', START)
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'feather'])
+def test_columnar_history_reads_back(tmp_path, output_format):
+    path = get_output_path(str(tmp_path / 'sample_history.hdf'), output_format)
+    writer = ColumnarSampleHistoryWriter(path, output_format, START, buffer_steps=2)
+    snapshots = [make_snapshot(START + pd.Timedelta(days=day)) for day in range(5)]
+    for snapshot in snapshots:
+        writer.append(snapshot)
+    writer.close()
+
+    history = read_sample_history(path)
+    expected = pd.concat(snapshots)
+    assert history.index.get_level_values('time').tolist() == list(np.repeat(np.arange(5), 20))
+    assert history.alive.astype(str).tolist() == expected.alive.tolist()
+    np.testing.assert_allclose(history.age.values, expected.age.values, rtol=1e-6)
+    np.testing.assert_array_equal(np.isnan(history.BEP_treatment_start.values),
+                                  expected.BEP_treatment_start.isnull().values)
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'feather'])
+def test_columnar_history_streams_growing_categories(tmp_path, output_format):
+    path = get_output_path(str(tmp_path / 'sample_history.hdf'), output_format)
+    writer = ColumnarSampleHistoryWriter(path, output_format, START, buffer_steps=1)
+    snapshots = []
+    sizes = []
+    for day in range(5):
+        snapshot = make_snapshot(START + pd.Timedelta(days=day), simulants=60)
+        # Each chunk brings new categories, past the 127 an int8 code can hold.
+        snapshot['cause_of_death'] = [f'cause_{day * 40 + i % 50}' for i in range(60)]
+        snapshots.append(snapshot)
+        writer.append(snapshot)
+        writer.flush()
+        writer._wait()
+        sizes.append(os.path.getsize(path))
+    writer.close()
+
+    # Chunks are in the file as they're written rather than when the writer closes.
+    assert sizes == sorted(set(sizes))
+    history = read_sample_history(path)
+    assert history.cause_of_death.astype(str).tolist() == pd.concat(snapshots).cause_of_death.tolist()
+
+
+def add_simulants(state, count, random_state):
+    columns = {'whz': random_state.normal(0, 1, count).round(1), 'haz': random_state.normal(0, 1, count).round(1),
+               'birth_weight': random_state.uniform(500, 4500, count).round(),
+               'sex': np.where(random_state.uniform(size=count) < 0.5, 'Male', 'Female'),
+               'entrance_time': state.time}
+    if state.table.empty:
+        columns['age'] = random_state.uniform(0, 5, count)
+    return state.add_simulants(count, **columns)
+
+
+def step(state, random_state):
+    table = state.table
+    alive = (table.alive == 'alive') & table.tracked
+    # Exposures change for a few simulants each step.
+    changed = alive & (random_state.uniform(size=len(table)) < 0.05)
+    table.loc[changed, 'whz'] = random_state.normal(0, 1, changed.sum()).round(1)
+    treated = alive & table.BEP_treatment_start.isnull() & (random_state.uniform(size=len(table)) < 0.01)
+    table.loc[treated, 'BEP_treatment_start'] = state.time
+    died = alive & (random_state.uniform(size=len(table)) < 0.003)
+    table.loc[died, 'alive'] = 'dead'
+    table.loc[died, 'cause_of_death'] = 'diarrheal_diseases'
+    table.loc[died, 'exit_time'] = state.time + STEP
+    table.loc[died, 'years_of_life_lost'] = 80. - table.loc[died, 'age']
+
+
+class FakePipeline:
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+        self.calls = {'value': 0, 'skip_post_processor': 0, 'source': 0}
+
+    def __call__(self, index, skip_post_processor=False):
+        self.calls['skip_post_processor' if skip_post_processor else 'value'] += 1
+        return self.get_values(index, 1. if skip_post_processor else 2.)
+
+    def source(self, index):
+        self.calls['source'] += 1
+        return self.get_values(index, 0.)
+
+    def get_values(self, index, shift):
+        table = self.state.table.loc[index]
+        if self.name == 'mortality_rate':
+            return pd.DataFrame({'other_causes': 0.01 * (table.alive == 'alive'),
+                                 'diarrheal_diseases': 0.001 * table.whz}, index=index)
+        if self.name == 'low_birth_weight_and_short_gestation.raw_exposure':
+            return pd.DataFrame({'birth_weight': table.birth_weight + shift, 'gestation_time': 38. + shift},
+                                index=index)
+        if self.name == 'child_stunting.exposure':
+            return table.haz + shift
+        return (table.whz + shift).astype(float)
+
+
+def get_expected_history(snapshots, sampled):
+    """Each sampled simulant's row of the state table and pipeline values at
+    each record."""
+    records = []
+    for time, table in snapshots:
+        pop = table.loc[table.index.intersection(sampled)]
+        pop = pop[pop.tracked.astype(bool)]
+        columns = []
+        for name, (pipeline_name, call, projection) in SAMPLED_PIPELINES.items():
+            pipeline = FakePipeline(SimpleNamespace(table=table), pipeline_name)
+            values = pipeline.get_values(pop.index, {'value': 2., 'skip_post_processor': 1., 'source': 0.}[call])
+            if callable(projection):
+                values = projection(values)
+            elif projection is not None:
+                values = values[projection]
+            columns.append(values.rename(name))
+        record = pd.concat(columns + [pop[COLUMNS]], axis=1)
+        record.index = pd.MultiIndex.from_arrays([pop.index, np.full(len(pop), time)], names=['simulant', 'time'])
+        records.append(record)
+    return pd.concat(records)
+
+
+def get_expected_sample(batches, sample_fraction=0.2):
+    """The simulants with the smallest draws from each batch initialized."""
+    sampled = []
+    for index, draw in batches:
+        sample_size = max(int(sample_fraction * len(index)), 1) if len(index) else 0
+        sampled.append(index[np.argsort(draw.values)[:sample_size]])
+    return sampled[0].append(sampled[1:])
+
+
+@pytest.fixture
+def simulate(tmp_path, make_state, make_builder, emit, initialize):
+    def simulate(**config):
+        """The sample history read back, with the builder, what the state table
+        was at each record and the simulants initialized with their draws."""
+        config = dict(SampleHistoryObserver.configuration_defaults['metrics']['sample_history_observer'],
+                      path=str(tmp_path / f'sample_history_{len(list(tmp_path.iterdir()))}.hdf'),
+                      sample_fraction=0.2, buffer_steps=7, **config)
+        state = make_state(START, alive='alive', age=0., exit_time=pd.NaT, cause_of_death='not_dead',
+                           years_of_life_lost=0., **{column: pd.NaT for column in COLUMNS
+                                                     if column.endswith('_start') or column.endswith('_event_time')})
+        builder = make_builder(state, STEP)
+        builder.configuration = ConfigTree({
+            'time': {'start': {'year': START.year, 'month': START.month, 'day': START.day},
+                     'end': {'year': END.year, 'month': END.month, 'day': END.day}},
+            'metrics': {'sample_history_observer': config}})
+        pipelines = {}
+        builder.value.get_value.side_effect = lambda name: pipelines.setdefault(name, FakePipeline(state, name))
+        builder.pipelines = pipelines
+        observer = SampleHistoryObserver()
+        observer.setup(builder)
+        randomness = builder.randomness.get_stream.return_value
+        random_state = np.random.RandomState(12345)
+
+        batches, snapshots = [], []
+
+        def add_batch(count):
+            index = add_simulants(state, count, random_state)
+            batches.append((index, randomness.get_draw(index)))
+            initialize(builder, index)
+
+        add_batch(400)
+        while state.time < END:
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            step(state, random_state)
+            snapshots.append((state.time, state.table.copy()))
+            emit(builder, 'collect_metrics', event)
+            emit(builder, 'time_step__cleanup', event)
+            # Aging comes after the observers, and simulants leave at 5.
+            alive = state.table.alive == 'alive'
+            state.table.loc[alive, 'age'] += STEP / YEAR
+            state.table.loc[state.table.age >= 5, 'tracked'] = False
+            add_batch(random_state.poisson(4))
+            state.time = event.time
+        emit(builder, 'simulation_end', None)
+        return read_sample_history(observer.path), builder, snapshots, batches
+    return simulate
+
+
+def test_streamed_history_matches_state(simulate):
+    history, _, snapshots, batches = simulate()
+
+    expected = get_expected_history(snapshots, get_expected_sample(batches))
+    pd.testing.assert_frame_equal(history.sort_index(), expected.sort_index(), check_like=True, check_dtype=False)
+    assert len(history.index.get_level_values('time').unique()) == (END - START) / STEP
+    assert (~history.alive.eq('alive')).any()
+
+
+def test_change_history_densifies_to_daily_history(simulate):
+    daily = simulate()[0].sort_index()
+    changes = simulate(recording_mode='changes')[0]
+
+    assert len(changes) < len(daily) / 5
+    dense = densify_sample_history(changes, step_size=STEP.days)
+    pd.testing.assert_frame_equal(dense.drop(columns='age'), daily.drop(columns='age'))
+    np.testing.assert_allclose(dense.age.values, daily.age.values)
+    # Exit rows for simulants who aged out.
+    assert (~changes.tracked.astype(bool)).sum() == len(set(daily.index.get_level_values('simulant'))
+                                                       - set(daily.xs(END - STEP, level='time').index))
+
+
+def test_cadence_history_rows_match_daily_history(simulate):
+    daily = simulate()[0]
+    cadence = simulate(recording_mode='cadence', cadence_days=30, treatment_window_days=9)[0]
+
+    written = cadence[cadence.tracked.astype(bool)].drop(columns='tracked')
+    pd.testing.assert_frame_equal(written, daily.loc[written.index])
+    times = daily.index.get_level_values('time')
+    on_cadence = ((times - START).days % 30 == 0) | (times == END - STEP)
+    assert daily.index[on_cadence].isin(written.index).all()
+    # Daily rows just after a treatment starts.
+    start = daily.BEP_treatment_start
+    in_window = (start <= times) & (times - start <= pd.Timedelta(days=9))
+    assert in_window.any() and daily.index[in_window].isin(written.index).all()
+    assert len(written) < len(daily) / 5
+
+
+def test_each_pipeline_call_made_once_per_record(simulate):
+    history, builder, _, _ = simulate()
+
+    records = len(history.index.get_level_values('time').unique())
+    calls = {(name, call): count for name, pipeline in builder.pipelines.items()
+             for call, count in pipeline.calls.items() if count}
+    assert calls == {(name, call): records for name, call, _ in SAMPLED_PIPELINES.values()}
+    # The four LBWSG raw exposure columns come from two calls.
+    assert sum(count for (name, _), count in calls.items() if name == LBWSG_RAW_EXPOSURE) == 2 * records
+
+
+class RandomDraws:
+
+    def __init__(self, random_state):
+        self.random_state = random_state
+
+    def get_draw(self, index):
+        return pd.Series(self.random_state.uniform(size=len(index)), index=index)
+
+
+def test_sampled_simulants_match_sorted_draws():
+    observer = SampleHistoryObserver()
+    observer.sample_fraction = 0.1
+    observer.randomness = RandomDraws(np.random.RandomState(12345))
+    observer.sample = SimulantSideTable({})
+    draws = RandomDraws(np.random.RandomState(12345))
+
+    start = 0
+    batches = []
+    for count in [1000, 0, 3, 1, 25, 100_000]:
+        index = pd.RangeIndex(start, start + count)
+        start += count
+        observer.on_initialize_simulants(SimpleNamespace(index=index))
+        batches.append((index, draws.get_draw(index)))
+        assert set(observer.sample.index) == set(get_expected_sample(batches, sample_fraction=0.1))
+    assert observer.sample.index.is_monotonic_increasing
+    assert len(observer.sample) == 100 + 1 + 1 + 2 + 10_000
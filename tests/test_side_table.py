@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable
+
+COLUMNS = {'birth_weight': float, 'gestation_time': float}
+
+
+class FakeTrackedView:
+
+    def __init__(self, tracked):
+        self.tracked = tracked
+
+    def get(self, index):
+        return pd.DataFrame({'tracked': self.tracked.loc[index].values}, index=index)
+
+
+def make_builder(mocker, tracked, listeners):
+    builder = mocker.MagicMock()
+    builder.population.get_view.return_value = FakeTrackedView(tracked)
+    builder.event.register_listener.side_effect = lambda name, listener: listeners.append(listener)
+    return builder
+
+
+def update_frame(frame, data):
+    """How per-simulant values were kept before the side table, in a frame
+    appended to and overwritten with pandas."""
+    return pd.concat([frame.drop(index=frame.index.intersection(data.index)), data])
+
+
+def test_side_table_matches_appended_frame(mocker):
+    random_state = np.random.RandomState(12345)
+    tracked = pd.Series(True, index=range(20_000))
+    listeners = []
+    table = SimulantSideTable(COLUMNS, initial_capacity=8)
+    table.register_compaction(make_builder(mocker, tracked, listeners), interval=5)
+    expected = pd.DataFrame(columns=list(COLUMNS), dtype=float)
+
+    population = 0
+    for step in range(40):
+        # New simulants and new values for some of those already there, in no particular order.
+        born = pd.Index(np.arange(population, population + random_state.poisson(300)))
+        population += len(born)
+        updated = pd.Index(random_state.choice(population, size=50, replace=False))
+        for index in [born, updated]:
+            index = index[random_state.permutation(len(index))]
+            data = pd.DataFrame(random_state.uniform(size=(len(index), 2)), index=index, columns=list(COLUMNS))
+            table.update(data)
+            expected = update_frame(expected, data)
+
+        tracked[random_state.choice(population, size=20, replace=False)] = False
+        for listener in listeners:
+            listener(SimpleNamespace(index=tracked.index))
+        if step % 5 == 4:
+            expected = expected[tracked.loc[expected.index].values]
+
+        # Simulants never added and those compacted away read as NaN.
+        index = pd.Index(random_state.choice(population + 100, size=200, replace=False))
+        pd.testing.assert_frame_equal(table.get(index), expected.reindex(index))
+        np.testing.assert_array_equal(table.contains(index), index.isin(expected.index))
+        assert len(table) == len(expected)
+    assert set(table.index) == set(expected.index)
+
+
+def test_single_column_side_table_is_a_series():
+    table = SimulantSideTable({'category_code': np.int64})
+    table.update(pd.Series([3, 1], index=pd.Index([7, 2])))
+    table.update(pd.Series([4], index=pd.Index([2])))
+
+    result = table.get(pd.Index([2, 7]))
+    pd.testing.assert_series_equal(result, pd.Series([4, 3], index=pd.Index([2, 7]), name='category_code'))
+    assert table.index.tolist() == [7, 2]
@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from vivarium.config_tree import ConfigTree
+from vivarium_public_health.dataset_manager import Artifact, ArtifactException, ArtifactManager
+
+from vivarium_conic_sam_comparison.external_data.artifact_manager import CachedArtifactManager
+from vivarium_conic_sam_comparison.external_data.sliced_artifact import KEYS_FILE, to_json, write_sliced_artifact
+
+DRAWS = 5
+AGE_BINS = {0.: 1., 1.: 5., 5.: 10., 10.: 15.}
+
+
+def make_draws(random_state):
+    index = pd.MultiIndex.from_product([['Mali', 'Global', 'Malawi'], ['Male', 'Female'], list(AGE_BINS), [2018, 2020, 2025, 2026]],
+                                       names=['location', 'sex', 'age_group_start', 'year_start']).to_frame(index=False)
+    index['age_group_end'] = index.age_group_start.map(AGE_BINS)
+    index['year_end'] = index.year_start + 1
+    index = pd.MultiIndex.from_frame(index[['location', 'sex', 'age_group_start', 'age_group_end',
+                                            'year_start', 'year_end']])
+    return pd.DataFrame(random_state.uniform(size=(len(index), DRAWS)), index=index,
+                        columns=[f'draw_{i}' for i in range(DRAWS)])
+
+
+@pytest.fixture
+def artifact_path(tmp_path):
+    path = str(tmp_path / 'vivarium_conic_sam_comparison_Mali.hdf')
+    artifact = Artifact(path)
+    random_state = np.random.RandomState(12345)
+    artifact.write('cause.diarrheal_diseases.incidence', make_draws(random_state))
+    artifact.write('population.structure', make_draws(random_state))
+    artifact.write('cause.diarrheal_diseases.restrictions', {'yld_only': False})
+    return path
+
+
+def get_manager(manager_type, artifact_path, location='Mali', **input_data):
+    configuration = ConfigTree()
+    configuration.update(manager_type.configuration_defaults)
+    configuration.update({'input_data': {'input_draw_number': 3, 'location': location,
+                                         'artifact_path': artifact_path, **input_data}})
+    manager = manager_type()
+    manager.config_filter_term = None
+    manager.artifact = manager._load_artifact(configuration)
+    return manager
+
+
+def test_sliced_artifact_matches_artifact(artifact_path, tmp_path):
+    sliced_path = str(tmp_path / 'sliced')
+    write_sliced_artifact(artifact_path, sliced_path, 'Mali', [1, 3], 2020, 2025, 0, 5)
+    expected = get_manager(ArtifactManager, artifact_path)
+    result = get_manager(CachedArtifactManager, artifact_path, sliced_artifact_path=sliced_path)
+
+    incidence = expected.load('cause.diarrheal_diseases.incidence')
+    incidence = incidence[(incidence.year_start <= 2025) & (incidence.year_end > 2020)
+                          & (incidence.age_group_start < 5)]
+    pd.testing.assert_frame_equal(result.load('cause.diarrheal_diseases.incidence'),
+                                  incidence.reset_index(drop=True))
+
+    # Population data is kept for all ages.
+    structure = expected.load('population.structure')
+    structure = structure[(structure.year_start <= 2025) & (structure.year_end > 2020)]
+    pd.testing.assert_frame_equal(result.load('population.structure'), structure.reset_index(drop=True))
+
+    assert result.load('cause.diarrheal_diseases.restrictions') == {'yld_only': False}
+
+
+def test_sliced_artifact_has_only_requested_draws(artifact_path, tmp_path):
+    sliced_path = tmp_path / 'sliced'
+    write_sliced_artifact(artifact_path, str(sliced_path), 'Mali', [0, 2, 4], 2020, 2025, 0, 5)
+    write_sliced_artifact(artifact_path, str(sliced_path), 'Mali', [1, 3], 2020, 2025, 0, 5)
+
+    assert sorted(os.listdir(str(sliced_path))) == ['draw_1.hdf', 'draw_3.hdf', 'index.hdf', KEYS_FILE]
+    with open(str(sliced_path / KEYS_FILE)) as f:
+        assert json.load(f)['draws'] == [1, 3]
+    with pytest.raises(ArtifactException):
+        get_manager(CachedArtifactManager, artifact_path, input_draw_number=2, sliced_artifact_path=str(sliced_path))
+
+
+def test_sliced_artifact_missing_draw(artifact_path, tmp_path):
+    with pytest.raises(ValueError):
+        write_sliced_artifact(artifact_path, str(tmp_path / 'sliced'), 'Mali', [3, DRAWS], 2020, 2025, 0, 5)
+
+
+def test_sliced_artifact_for_other_location(artifact_path, tmp_path):
+    sliced_path = str(tmp_path / 'sliced')
+    write_sliced_artifact(artifact_path, sliced_path, 'Mali', None, 2020, 2025, 0, 5)
+
+    with pytest.raises(ArtifactException):
+        get_manager(CachedArtifactManager, artifact_path, location='Malawi', sliced_artifact_path=sliced_path)
+
+
+def test_numpy_objects_written_as_json():
+    objects = {'age_bins': np.array(list(AGE_BINS)), 'draws': np.int64(DRAWS), 'yld_only': np.bool_(False)}
+    assert json.loads(json.dumps(objects, default=to_json)) == {'age_bins': list(AGE_BINS), 'draws': DRAWS,
+                                                                'yld_only': False}
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vivarium_conic_sam_comparison.components import split_index_draw as sid
+
+DRAWS = 4
+TARGETS = [('diarrheal_diseases', 'incidence_rate'), ('diarrheal_diseases', 'excess_mortality'),
+           ('lower_respiratory_infections', 'incidence_rate')]
+
+
+@pytest.fixture
+def data():
+    index = pd.MultiIndex.from_product([['Global'], ['Male', 'Female'], [0., 0.01, 0.08], [2017],
+                                        ['diarrheal_diseases', 'lower_respiratory_infections'],
+                                        ['incidence_rate', 'excess_mortality'], ['cat2', 'cat8', 'cat212']],
+                                       names=['location', 'sex', 'age_group_start', 'year_start',
+                                              'affected_entity', 'affected_measure', 'parameter'])
+    random_state = np.random.RandomState(12345)
+    data = pd.DataFrame(random_state.uniform(1, 5, size=(len(index), DRAWS)), index=index,
+                        columns=[f'draw_{i}' for i in range(DRAWS)])
+    # Targets interleaved and one missing, as they may be in the source data.
+    data = data.iloc[random_state.permutation(len(data))]
+    missing = ((data.index.get_level_values('affected_entity') == 'lower_respiratory_infections')
+               & (data.index.get_level_values('affected_measure') == 'excess_mortality'))
+    return data[~missing]
+
+
+def read_target(path, draw, affected_entity, affected_measure):
+    """How a target's relative risks were read before the memory mapped layout."""
+    data = sid.read_data(path, 'data', draw)
+    correct_target = (data['affected_entity'] == affected_entity) & (data['affected_measure'] == affected_measure)
+    return data[correct_target].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('draw', [0, DRAWS - 1])
+def test_npy_target_matches_hdf(tmp_path, data, draw):
+    hdf_path = str(tmp_path / 'lbwsg_rr.hdf')
+    npy_path = str(tmp_path / 'lbwsg_rr')
+    sid.write_data(hdf_path, 'data', data)
+    sid.convert_hdf_to_npy(hdf_path, 'data', npy_path)
+
+    for affected_entity, affected_measure in TARGETS:
+        expected = read_target(hdf_path, draw, affected_entity, affected_measure)
+        result = sid.read_npy_data(npy_path, draw, affected_entity, affected_measure)
+        pd.testing.assert_frame_equal(result, expected)
+        assert not result.empty
+
+    assert sid.read_npy_data(npy_path, draw, 'lower_respiratory_infections', 'excess_mortality').empty
+
+
+def test_npy_draw_matches_hdf(tmp_path, data):
+    hdf_path = str(tmp_path / 'lbwsg_rr.hdf')
+    npy_path = str(tmp_path / 'lbwsg_rr')
+    sid.write_data(hdf_path, 'data', data)
+    sid.write_npy_data(npy_path, data)
+
+    expected = sid.read_data(hdf_path, 'data', 1)
+    result = sid.read_npy_data(npy_path, 1)
+    # Rows are grouped by target, in their order within each target.
+    order = expected.groupby(['affected_entity', 'affected_measure'], sort=True).ngroup().argsort(kind='mergesort')
+    pd.testing.assert_frame_equal(result, expected.iloc[order].reset_index(drop=True))
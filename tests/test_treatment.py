@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from vivarium.config_tree import ConfigTree
+
+from vivarium_conic_sam_comparison.components.side_table import SimulantSideTable
+from vivarium_conic_sam_comparison.components.treatment import (EnrollmentSchedule, NeonatalTreatmentAlgorithm,
+                                                                 TreatmentPhaseCache)
+
+START = pd.Timestamp('2019-12-25')
+STEP = pd.Timedelta(days=1)
+YEAR = pd.Timedelta(days=365.25)
+
+
+WHZ = pd.Series(np.random.RandomState(1).normal(7, 2, 10_000))
+
+
+@pytest.fixture
+def make_algorithm_builder(make_builder):
+    def make_algorithm_builder(state, whz_target):
+        builder = make_builder(state, STEP)
+        builder.configuration = ConfigTree({'interventions': {'neonatal_intervention': {
+            'whz_target': whz_target, 'coverage_proportion': 0.8, 'treatment_duration': 365.25,
+            'start_date': {'year': 2020, 'month': 1, 'day': 1}, 'treatment_age': {'start': 0.5, 'end': 1.0},
+        }}})
+        builder.value.get_value.return_value = lambda index, skip_post_processor=False: WHZ[index]
+        return builder
+    return make_algorithm_builder
+
+
+@pytest.fixture
+def simulate(make_state, make_algorithm_builder, emit, initialize):
+    def simulate(whz_target, steps=250):
+        """The final state table and, for each step, the state the treatment
+        algorithm saw."""
+        state = make_state(START, alive='alive')
+        builder = make_algorithm_builder(state, whz_target)
+        component = NeonatalTreatmentAlgorithm('neonatal')
+        component.setup(builder)
+        random_state = np.random.RandomState(12345)
+
+        initialize(builder, state.add_simulants(500, age=random_state.uniform(0, 1.2, 500)),
+                   creation_time=state.time, user_data={'sim_state': 'setup'})
+        seen = []
+        for _ in range(steps):
+            event = SimpleNamespace(index=state.table.index, time=state.time + STEP, step_size=STEP)
+            state.table.loc[random_state.uniform(size=len(state.table)) < 0.002, 'alive'] = 'dead'
+            seen.append((state.time, state.table.copy()))
+            emit(builder, 'time_step', event)
+            # Aging comes after the treatment algorithm, as with the base population's priority.
+            alive = state.table.alive == 'alive'
+            state.table.loc[alive, 'age'] += STEP / YEAR
+            births = random_state.poisson(3)
+            initialize(builder, state.add_simulants(births, age=np.zeros(births)), creation_time=event.time,
+                       user_data={'sim_state': 'time_step'})
+            state.time = event.time
+        return state.table, seen, builder.randomness.get_stream.return_value
+    return simulate
+
+
+@pytest.mark.parametrize('whz_target', ['all', -1])
+def test_enrollment_by_age_and_coverage(simulate, whz_target):
+    result, seen, randomness = simulate(whz_target)
+
+    start = result['neonatal_treatment_start']
+    start_date = pd.Timestamp('2020-01-01')
+    for clock, pop in seen:
+        time = clock + STEP
+        if time < start_date:
+            continue
+        age = pop.age
+        if clock < start_date:
+            # Everyone in the age range when the intervention starts.
+            eligible = (0.5 <= age) & (age <= 1.0)
+        else:
+            # Then those who reach the start of it during the step.
+            eligible = (age < 0.5) & (0.5 <= age + STEP / YEAR)
+        eligible &= (pop.alive == 'alive') & pop.neonatal_treatment_start.isnull()
+        if whz_target != 'all':
+            eligible &= WHZ[pop.index] <= whz_target + 10
+        eligible &= randomness.get_draw(pop.index) < 0.8
+        assert set(start.index[start == time]) == set(pop.index[eligible])
+
+    pd.testing.assert_series_equal(result['neonatal_treatment_end'], start + pd.Timedelta(days=365.25),
+                                   check_names=False)
+    # Both the mass enrollment at the start date and the continuous enrollment after it.
+    assert (start == start_date).any()
+    assert start.dropna().nunique() > 100
+
+
+def test_schedule_hands_out_a_step_early():
+    schedule = EnrollmentSchedule(START, STEP)
+    # Eligible during the step starting at START + 10 days, so handed out in the one before.
+    schedule.schedule(pd.Index([0]), pd.Series([START + 10.6 * STEP]))
+
+    assert schedule.pop_due(START + 8 * STEP).empty
+    assert schedule.pop_due(START + 9 * STEP).tolist() == [0]
+    schedule.reschedule(pd.Index([0]), START + 9 * STEP)
+    assert schedule.pop_due(START + 10 * STEP).tolist() == [0]
+
+
+def test_phase_cache_reads_once_per_time_and_index(make_state, make_algorithm_builder):
+    state = make_state(START, alive='alive', age=0.)
+    index = state.add_simulants(10)
+    state.table['neonatal_treatment_start'] = pd.Series(pd.NaT, index=index, dtype='datetime64[ns]')
+    state.table.loc[[2, 5], 'neonatal_treatment_start'] = START - 2 * STEP
+    treated = SimulantSideTable({})
+    treated.update(pd.Index([2, 5]))
+    builder = make_algorithm_builder(state, 'all')
+    cache = TreatmentPhaseCache(builder, 'neonatal', treated)
+
+    treated_index, time_since_start = cache.get_time_since_start(index)
+    assert treated_index.tolist() == [2, 5]
+    assert time_since_start.tolist() == [(2 * STEP).value] * 2
+    # An equal index from another caller is served from the cache.
+    cache.get_time_since_start(pd.Index(index.tolist()))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Treatment written mid step is seen once the algorithm invalidates the cache.
+    state.table.loc[7, 'neonatal_treatment_start'] = START
+    treated.update(pd.Index([7]))
+    cache.invalidate()
+    treated_index, time_since_start = cache.get_time_since_start(index)
+    assert treated_index.tolist() == [2, 5, 7]
+    assert time_since_start[-1] == 0
+
+    state.time += STEP
+    _, time_since_start = cache.get_time_since_start(index)
+    assert time_since_start.tolist() == [(3 * STEP).value] * 2 + [STEP.value]
+    assert (cache.hits, cache.misses) == (1, 3)